@@ -0,0 +1,671 @@
+import argparse
+import gc
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from reframer import Reframer
+from resampler import Resampler
+from metrics import Histogram
+from udpsniffer import UdpSniffer
+from callspec import CallSpec
+from realtime import ThreadTuning
+
+# pjsua2 is only available in the client image, so benchmarks that do not need it run anywhere
+pj = None
+ducall = None
+
+# The main loop of sip_client.py before and after blocking in the event handling, see SipCall.handleEvents
+SLEEP_POLL = "sleep-poll"
+BLOCK = "block"
+EVENT_LOOP_MODES = [SLEEP_POLL, BLOCK]
+# Kept in sync with SipCall
+WATCHDOG_PERIOD_SEC = 1
+WATCHDOG_MARGIN_MS = 20
+
+
+def importPjsua2(standIn=False):
+    global pj, ducall
+    if standIn:
+        import pjstandin
+        pjstandin.install()
+    import pjsua2
+    import ducall as ducallModule
+    pj = pjsua2
+    ducall = ducallModule
+
+
+def frameSizeBytes(sampleRate, frameLenMs):
+    return Reframer.frameSizeOf(sampleRate, frameLenMs * 1000, 1, 16)
+
+
+def ingestPerByte(data):
+    frameBuffer = pj.ByteVector()
+    for i in range(len(data)):
+        frameBuffer.append(data[i])
+    return frameBuffer
+
+
+def ingestBulk(data):
+    return ducall.toByteVector(data)
+
+
+def timePerFrame(ingest, data, frames):
+    frame = pj.MediaFrame()
+    start = time.perf_counter_ns()
+    for i in range(frames):
+        frameBuffer = ingest(data)
+        frame.buf = frameBuffer
+        frame.size = len(frameBuffer)
+    return (time.perf_counter_ns() - start) / frames
+
+
+def benchIngest(args):
+    importPjsua2()
+    frameSize = frameSizeBytes(args.sample_rate, args.frame_length_msec)
+    data = bytes(i & 0xff for i in range(frameSize))
+    assert bytes(ingestBulk(data)) == bytes(ingestPerByte(data)), "Bulk ingest produced a different frame"
+    print(f"Ingest of {frameSize} bytes frames ({args.sample_rate} Hz, {args.frame_length_msec} ms), {args.frames} frames")
+    perByteNs = timePerFrame(ingestPerByte, data, args.frames)
+    bulkNs = timePerFrame(ingestBulk, data, args.frames)
+    bulkViewNs = timePerFrame(ingestBulk, memoryview(data), args.frames)
+    print(f"\tper byte append:     {perByteNs / 1000:10.2f} usec/frame")
+    print(f"\tbulk from bytes:     {bulkNs / 1000:10.2f} usec/frame")
+    print(f"\tbulk from memoryview:{bulkViewNs / 1000:10.2f} usec/frame")
+    print(f"\tspeedup:             {perByteNs / bulkNs:10.1f}x")
+
+
+# Runs in a separate process so the sender does not compete for the GIL with the measured capture loop
+SENDER_SCRIPT = """
+import socket, sys, time
+port, noisePort, count, rate, size, noise = map(int, sys.argv[1:])
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+payload = bytes(size)
+start = time.monotonic()
+for i in range(count):
+    sock.sendto(payload, ("127.0.0.1", port))
+    for n in range(noise):
+        sock.sendto(payload, ("127.0.0.1", noisePort))
+    delay = start + (i + 1) / rate - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+"""
+
+
+def sniffBackend(backend, args):
+    stats = {"packets": 0, "first": None, "last": None, "cpu": 0.0}
+    done = threading.Event()
+
+    def processPacket(payload, timestampNs):
+        now = time.monotonic()
+        if stats["first"] is None:
+            stats["first"] = now
+            stats["cpuStart"] = time.thread_time()
+        stats["packets"] += 1
+        stats["last"] = now
+        stats["cpu"] = time.thread_time() - stats["cpuStart"]
+        if stats["packets"] == args.packets:
+            done.set()
+
+    sniffer = UdpSniffer(args.port)
+    target = sniffer.sniffRing if backend == UdpSniffer.MMAP_BACKEND else sniffer.sniff
+    threading.Thread(target=target, args=(processPacket,), daemon=True).start()
+    time.sleep(0.5)
+    sender = subprocess.Popen([sys.executable, "-c", SENDER_SCRIPT, str(args.port), str(args.port + 1),
+                               str(args.packets), str(args.rate), str(args.size), str(args.noise)])
+    sender.wait()
+    done.wait(timeout=2)
+    duration = (stats["last"] - stats["first"]) if stats["packets"] > 1 else 0
+    pps = stats["packets"] / duration if duration else 0
+    cpuPerPacket = stats["cpu"] / stats["packets"] * 1e6 if stats["packets"] else 0
+    print(f"\t{backend:10} received {stats['packets']:8}/{args.packets}  {pps:10.0f} pkt/s  "
+          f"capture thread CPU {stats['cpu']:.3f} s ({cpuPerPacket:.2f} usec/packet)")
+
+
+def benchSniffer(args):
+    print(f"Sniffer capture of {args.packets} packets of {args.size} bytes at {args.rate} pkt/s "
+          f"with {args.noise} unrelated loopback packets per packet")
+    for backend in args.backends:
+        sniffBackend(backend, args)
+        args.port += 2
+
+
+def toneFrames(rate, channels, sampleFormat, frameLenMs, frames):
+    import numpy as np
+    samples = rate * frameLenMs // 1000 * frames
+    tone = 0.5 * np.sin(2 * np.pi * 440 * np.arange(samples) / rate)
+    tone = np.repeat(tone, channels)
+    if sampleFormat == Resampler.F32:
+        data = tone.astype("<f4")
+    elif sampleFormat == Resampler.S32:
+        data = (tone * 2147483647).astype("<i4")
+    elif sampleFormat == Resampler.U8:
+        data = (tone * 127 + 128).astype("u1")
+    else:
+        data = (tone * 32767).astype("<i2")
+    data = data.tobytes()
+    frameBytes = len(data) // frames
+    return [data[i * frameBytes:(i + 1) * frameBytes] for i in range(frames)]
+
+
+def bridgeCpuPerFrame(sourceRate, bridgeRate, frameLenMs, seconds):
+    """
+    Process CPU per frame of a custom port at sourceRate feeding one at the bridge rate through the
+    conference bridge, which resamples when the rates differ. The null sound device drives the clock.
+    """
+    class SourcePort(pj.AudioMediaPort):
+        def __init__(self, frameBuffer):
+            pj.AudioMediaPort.__init__(self)
+            self.frameBuffer = frameBuffer
+
+        def onFrameRequested(self, frame):
+            frame.type = pj.PJMEDIA_TYPE_AUDIO
+            frame.buf = self.frameBuffer
+            frame.size = len(self.frameBuffer)
+
+    class SinkPort(pj.AudioMediaPort):
+        def __init__(self):
+            pj.AudioMediaPort.__init__(self)
+            self.frames = 0
+
+        def onFrameReceived(self, frame):
+            self.frames += 1
+
+    def portFormat(rate):
+        fmt = pj.MediaFormatAudio()
+        fmt.type = pj.PJMEDIA_TYPE_AUDIO
+        fmt.clockRate = rate
+        fmt.channelCount = 1
+        fmt.bitsPerSample = 16
+        fmt.frameTimeUsec = frameLenMs * 1000
+        return fmt
+
+    source = SourcePort(ducall.toByteVector(bytes(frameSizeBytes(sourceRate, frameLenMs))))
+    source.createPort(f"source{sourceRate}", portFormat(sourceRate))
+    sink = SinkPort()
+    sink.createPort(f"sink{sourceRate}", portFormat(bridgeRate))
+    source.startTransmit(sink)
+    cpuStart = time.process_time()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpuStart
+    frames = sink.frames
+    source.stopTransmit(sink)
+    return cpu / frames if frames else 0
+
+
+def benchResample(args):
+    print(f"Adaptation of {args.input_rate} Hz {args.input_channels} channel(s) {args.input_format} to "
+          f"{args.sample_rate} Hz mono s16, {args.frame_length_msec} ms frames")
+    resampler = Resampler(args.input_rate, args.sample_rate, args.input_channels, args.input_format,
+                          args.frame_length_msec * 1000)
+    frames = toneFrames(args.input_rate, args.input_channels, args.input_format, args.frame_length_msec, args.frames)
+    for batch in args.batches:
+        resampler.reset()
+        start = time.thread_time()
+        for i in range(0, len(frames), batch):
+            resampler.push(b"".join(frames[i:i + batch]))
+        perFrameUs = (time.thread_time() - start) / len(frames) * 1e6
+        print(f"\tnumpy stage, batches of {batch:3} frames: {perFrameUs:8.2f} usec/frame")
+    if not args.bridge:
+        return
+    importPjsua2()
+    endpoint = pj.Endpoint()
+    endpoint.libCreate()
+    config = pj.EpConfig()
+    config.logConfig.level = 1
+    config.logConfig.consoleLevel = 1
+    config.medConfig.clockRate = args.sample_rate
+    config.medConfig.sndClockRate = args.sample_rate
+    config.medConfig.audioFramePtime = args.frame_length_msec
+    endpoint.libInit(config)
+    endpoint.audDevManager().setNullDev()
+    endpoint.libStart()
+    # The same ports without resampling give the cost of the callbacks and the bridge itself
+    directUs = bridgeCpuPerFrame(args.sample_rate, args.sample_rate, args.frame_length_msec, args.bridge_seconds) * 1e6
+    resampledUs = bridgeCpuPerFrame(args.input_rate, args.sample_rate, args.frame_length_msec, args.bridge_seconds) * 1e6
+    print(f"\tbridge without resampling:     {directUs:8.2f} usec/frame")
+    print(f"\tbridge resampling mono s16:    {resampledUs:8.2f} usec/frame "
+          f"({resampledUs - directUs:.2f} usec/frame for the resampler)")
+    endpoint.libDestroy()
+
+
+def tonePayloads(sampleRate, frameLenMs, seconds=1):
+    """
+    Frames of a 440 Hz tone, generated at once for the whole period
+    """
+    import numpy as np
+    samples = sampleRate * seconds
+    tone = (8000 * np.sin(2 * np.pi * 440 * np.arange(samples) / sampleRate)).astype("<i2").tobytes()
+    frameSize = frameSizeBytes(sampleRate, frameLenMs)
+    return [tone[i:i + frameSize] for i in range(0, len(tone) - frameSize + 1, frameSize)]
+
+
+def stamped(payload):
+    # The first 4 samples carry the send time, for the end to end latency
+    return time.time_ns().to_bytes(8, "little") + payload[8:]
+
+
+def stampAgeUs(payload):
+    return (time.time_ns() - int.from_bytes(bytes(payload[:8]), "little")) // 1000
+
+
+def benchTone(args):
+    payloads = tonePayloads(args.sample_rate, args.frame_length_msec)
+    if CallSpec.isUnixSocket(args.port):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.connect(args.port)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((args.host, args.port))
+    period = args.frame_length_msec / 1000
+    frames = int(args.duration_sec / period) if args.duration_sec else None
+    deadline = time.monotonic()
+    i = 0
+    while frames is None or i < frames:
+        payload = payloads[i % len(payloads)]
+        sock.send(stamped(payload) if args.stamp else payload)
+        i += 1
+        # Absolute deadlines - the sleep overshoot does not accumulate
+        deadline += period
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def transportRun(endpoint, frameLenMs, args):
+    stats = {"frames": 0, "cpu": 0.0}
+    latency = Histogram()
+    done = threading.Event()
+
+    def processBatch(frames, timestamps):
+        if done.is_set():
+            return
+        if "cpuStart" not in stats:
+            stats["cpuStart"] = time.thread_time()
+        for payload in frames:
+            latency.record(stampAgeUs(payload))
+        stats["frames"] += len(frames)
+        stats["cpu"] = time.thread_time() - stats["cpuStart"]
+
+    # The receiving side of the client, as in the recvmmsg reading mode
+    receiver = UdpSniffer(endpoint, batchSize=16, timeoutMs=100)
+    threading.Thread(target=receiver.readBatched, args=(processBatch,), daemon=True).start()
+    time.sleep(0.5)
+    senderCpuStart = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sender = subprocess.Popen([sys.executable, os.path.abspath(__file__), "tone", "--port", str(endpoint),
+                               "--sample-rate", str(args.sample_rate), "--frame-length-msec", str(frameLenMs),
+                               "--duration-sec", str(args.duration_sec), "--stamp"])
+    sender.wait()
+    time.sleep(0.2)
+    done.set()
+    senderCpuEnd = resource.getrusage(resource.RUSAGE_CHILDREN)
+    senderCpu = senderCpuEnd.ru_utime + senderCpuEnd.ru_stime - senderCpuStart.ru_utime - senderCpuStart.ru_stime
+    frames = stats["frames"]
+    expected = int(args.duration_sec * 1000 / frameLenMs)
+    kind = "unix" if CallSpec.isUnixSocket(endpoint) else "udp"
+    # The sender CPU includes the interpreter start up, the same for both transports
+    print(f"\t{kind:5} {frameLenMs:4} ms  received {frames:6}/{expected}  latency usec p50 {latency.percentile(50):5} "
+          f"p99 {latency.percentile(99):5} max {latency.max:6}  receiver CPU {stats['cpu'] / max(frames, 1) * 1e6:6.1f} "
+          f"usec/frame  sender process CPU {senderCpu:.2f} s")
+
+
+def benchTransport(args):
+    print(f"Streamer to client PCM over UDP loopback and AF_UNIX datagrams, {args.duration_sec} sec per run, "
+          f"{args.sample_rate} Hz")
+    for frameLenMs in args.frame_lengths:
+        transportRun(args.port, frameLenMs, args)
+        transportRun(os.path.join(args.socket_dir, f"bench-{frameLenMs}.sock"), frameLenMs, args)
+        args.port += 1
+
+
+class StandInEvents:
+    """
+    SIP messages of the stand-in endpoint, queued straight into its event handling
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def send(self, latency):
+        arrivalNs = time.monotonic_ns()
+        self.endpoint.deliverEvent(lambda: latency.record((time.monotonic_ns() - arrivalNs) // 1000))
+
+
+class OptionsProbe:
+    """
+    SIP messages of a real endpoint: OPTIONS requests to its UDP transport, which pjsua answers from
+    libHandleEvents. The latency is the round trip from the request to the 200 response.
+    """
+
+    def __init__(self, sipPort):
+        self.sipPort = sipPort
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.probePort = self.sock.getsockname()[1]
+        self.sequence = 0
+        self.sentNs = {}
+        self.latency = None
+        threading.Thread(target=self.receive, daemon=True).start()
+
+    def request(self, sequence):
+        return (f"OPTIONS sip:bench@127.0.0.1:{self.sipPort} SIP/2.0\r\n"
+                f"Via: SIP/2.0/UDP 127.0.0.1:{self.probePort};rport;branch=z9hG4bK-bench-{sequence}\r\n"
+                "Max-Forwards: 70\r\n"
+                f"From: <sip:probe@127.0.0.1:{self.probePort}>;tag=bench\r\n"
+                f"To: <sip:bench@127.0.0.1:{self.sipPort}>\r\n"
+                f"Call-ID: bench-{sequence}@127.0.0.1\r\n"
+                f"CSeq: {sequence} OPTIONS\r\n"
+                "Content-Length: 0\r\n\r\n").encode()
+
+    def send(self, latency):
+        self.latency = latency
+        self.sequence += 1
+        self.sentNs[self.sequence] = time.monotonic_ns()
+        self.sock.sendto(self.request(self.sequence), ("127.0.0.1", self.sipPort))
+
+    def receive(self):
+        while True:
+            response = self.sock.recv(65536)
+            now = time.monotonic_ns()
+            for line in response.split(b"\r\n"):
+                if line.lower().startswith(b"cseq:"):
+                    sentNs = self.sentNs.pop(int(line.split()[1]), None)
+                    if sentNs is not None:
+                        self.latency.record((now - sentNs) // 1000)
+
+
+def createPjsua2Endpoint(sipPort):
+    endpoint = pj.Endpoint()
+    endpoint.libCreate()
+    config = pj.EpConfig()
+    # As sip_client.py without --pjsip-threads: the main loop handles every event and posted job
+    config.uaConfig.threadCnt = 0
+    config.uaConfig.mainThreadOnly = True
+    config.logConfig.level = 0
+    config.logConfig.consoleLevel = 0
+    endpoint.libInit(config)
+    transportConfig = pj.TransportConfig()
+    transportConfig.port = sipPort
+    transportConfig.boundAddress = "127.0.0.1"
+    endpoint.transportCreate(pj.PJSIP_TRANSPORT_UDP, transportConfig)
+    endpoint.libStart()
+    endpoint.audDevManager().setNullDev()
+    return endpoint
+
+
+def eventLoopRun(endpoint, events, mode, args):
+    state = {"nextWatchdogTime": time.monotonic() + WATCHDOG_PERIOD_SEC, "running": True}
+    # A SIP message of the call set up, handled in the wait, and a job posted by another thread
+    ioLatency = Histogram()
+    jobLatency = Histogram()
+
+    class PostedJob(pj.PendingJob):
+        def __init__(self):
+            super().__init__()
+            self.postedNs = time.monotonic_ns()
+
+        def execute(self, isPending):
+            jobLatency.record((time.monotonic_ns() - self.postedNs) // 1000)
+
+    def postJob():
+        job = PostedJob()
+        if hasattr(job, "__disown__"):
+            # pjsua2 deletes the job after running it
+            job.__disown__()
+        endpoint.utilAddPendingJob(job)
+
+    def network():
+        # Sparse events, the loop is idle most of the time
+        rng = random.Random(args.seed)
+        deadline = time.monotonic() + args.duration_sec
+        while True:
+            time.sleep(rng.uniform(0, 2 * args.duration_sec / args.events))
+            if time.monotonic() >= deadline:
+                break
+            events.send(ioLatency)
+            postJob()
+        state["running"] = False
+
+    def watchdog():
+        while state["running"]:
+            state["nextWatchdogTime"] = time.monotonic() + WATCHDOG_PERIOD_SEC
+            time.sleep(WATCHDOG_PERIOD_SEC)
+
+    threading.Thread(target=network, daemon=True).start()
+    threading.Thread(target=watchdog, daemon=True).start()
+    wakeups = 0
+    start = time.monotonic()
+    cpuStart = time.process_time()
+    while state["running"]:
+        if mode == SLEEP_POLL:
+            time.sleep(0.01)
+            endpoint.libHandleEvents(10)
+        else:
+            timeoutMs = (state["nextWatchdogTime"] - time.monotonic()) * 1000 + WATCHDOG_MARGIN_MS
+            endpoint.libHandleEvents(int(min(max(timeoutMs, WATCHDOG_MARGIN_MS), args.max_event_wait_msec)))
+        wakeups += 1
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpuStart
+    # The last responses and jobs of the run
+    for _ in range(5):
+        endpoint.libHandleEvents(10)
+    print(f"\t{mode:10}  wake ups {wakeups / elapsed:6.1f}/sec  CPU {100 * cpu / elapsed:5.2f}%  "
+          f"SIP message latency usec p50 {ioLatency.percentile(50):6} max {ioLatency.max:6}  "
+          f"posted job latency usec p50 {jobLatency.percentile(50):7} max {jobLatency.max:7}  "
+          f"({ioLatency.count} messages, {jobLatency.count} jobs)")
+
+
+def benchEventLoop(args):
+    importPjsua2(standIn=not args.pjsua2)
+    if args.pjsua2:
+        endpoint = createPjsua2Endpoint(args.sip_port)
+        events = OptionsProbe(args.sip_port)
+        kind = f"pjsua2 endpoint, OPTIONS to port {args.sip_port}"
+    else:
+        endpoint = pj.Endpoint()
+        events = StandInEvents(endpoint)
+        kind = "stand-in endpoint"
+    print(f"Main loop without pjsip worker threads on the {kind}, {args.events} messages and jobs in "
+          f"{args.duration_sec} sec per mode, --max-event-wait-msec {args.max_event_wait_msec}")
+    try:
+        for mode in args.modes:
+            eventLoopRun(endpoint, events, mode, args)
+    finally:
+        if args.pjsua2:
+            endpoint.libDestroy()
+
+
+def rssBytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def benchSoak(args):
+    if args.round_trip and args.plc:
+        parser.error("--round-trip needs the stamps the concealment cross-fades, leave out --plc")
+    importPjsua2(standIn=not args.pjsua2)
+    frameSize = frameSizeBytes(args.sample_rate, args.frame_length_msec)
+    # Replaced by a fresh histogram every report interval
+    interval = {"upstreamLatency": Histogram()}
+
+    def upstreamSink():
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", args.upport))
+        while True:
+            interval["upstreamLatency"].record(stampAgeUs(sink.recv(65536)))
+
+    threading.Thread(target=upstreamSink, daemon=True).start()
+    concealer = None
+    if args.plc:
+        from plc import Concealer
+        concealer = Concealer(args.sample_rate, frameSize)
+    threadTuning = ThreadTuning(args.cpu_affinity, args.rt_priority, busyPoll=bool(args.busy_poll_usec)) \
+        if args.cpu_affinity or args.rt_priority else None
+    port = ducall.CustomMediaPort(ducall.WatchdogData(name="soak"), args.upport, args.downport, frameSize=frameSize,
+                                  frameTimeMs=args.frame_length_msec, jitterTargetMs=args.jitter_target_msec,
+                                  concealer=concealer, busyPollUsec=args.busy_poll_usec, threadTuning=threadTuning)
+    tone = subprocess.Popen([sys.executable, os.path.abspath(__file__), "tone", "--port", str(args.downport),
+                             "--sample-rate", str(args.sample_rate), "--frame-length-msec", str(args.frame_length_msec),
+                             "--stamp"])
+    payloads = tonePayloads(args.sample_rate, args.frame_length_msec)
+    print(f"Soak of CustomMediaPort ({'pjsua2' if args.pjsua2 else 'stand-in'}) for {args.duration_sec} sec, "
+          f"{args.sample_rate} Hz {args.frame_length_msec} ms frames, jitter target {args.jitter_target_msec} ms, "
+          f"report every {args.report_sec} sec{', round trip' if args.round_trip else ''}, busy poll "
+          f"{args.busy_poll_usec} usec, CPUs {args.cpu_affinity}, SCHED_FIFO {args.rt_priority}")
+    print(f"\t   time   frames  cb CPU p50/p99/max usec  process CPU usec/frame  down e2e p50/p99 usec  "
+          f"{'round trip' if args.round_trip else 'up e2e'} p50/p99 usec  underruns  RSS MB (growth)  objects")
+    period = args.frame_length_msec / 1000
+    callbackCpu = Histogram()
+    downstreamLatency = Histogram()
+    start = time.monotonic()
+    deadline = start
+    nextReport = start + args.report_sec
+    lastFrames = 0
+    lastCpu = time.process_time()
+    baselineRss = None
+    frames = 0
+    try:
+        while time.monotonic() - start < args.duration_sec:
+            requested = pj.MediaFrame()
+            received = pj.MediaFrame()
+            received.type = pj.PJMEDIA_TYPE_AUDIO
+            received.buf = pj.ByteVector(stamped(payloads[frames % len(payloads)]))
+            received.size = frameSize
+            cpuStart = time.thread_time_ns()
+            port.onFrameRequested(requested)
+            if not args.round_trip:
+                port.onFrameReceived(received)
+            elif requested.type == pj.PJMEDIA_TYPE_AUDIO:
+                # The far end loops the audio back, the stamp of the tone sender reaches the upstream sink
+                received.buf = pj.ByteVector(requested.buf)
+                port.onFrameReceived(received)
+            callbackCpu.record((time.thread_time_ns() - cpuStart) // 1000)
+            if requested.type == pj.PJMEDIA_TYPE_AUDIO and not concealer:
+                downstreamLatency.record(stampAgeUs(requested.buf))
+            frames += 1
+            now = time.monotonic()
+            if now >= nextReport:
+                nextReport += args.report_sec
+                cpu = time.process_time()
+                rss = rssBytes()
+                # The first interval warms up the caches and queues, growth is counted from its end
+                if baselineRss is None:
+                    baselineRss = rss
+                upstreamLatency = interval["upstreamLatency"]
+                interval["upstreamLatency"] = Histogram()
+                print(f"\t{now - start:7.0f}  {frames:7}  {callbackCpu.percentile(50):6} {callbackCpu.percentile(99):6} "
+                      f"{callbackCpu.max:6}        {(cpu - lastCpu) / (frames - lastFrames) * 1e6:10.1f}          "
+                      f"{downstreamLatency.percentile(50):7} {downstreamLatency.percentile(99):7}      "
+                      f"{upstreamLatency.percentile(50):6} {upstreamLatency.percentile(99):6}  "
+                      f"{port.framesToSip.underruns:9}  {rss / 1048576:7.1f} ({(rss - baselineRss) / 1048576:+.1f})  "
+                      f"{len(gc.get_objects())}")
+                lastFrames = frames
+                lastCpu = cpu
+                callbackCpu = Histogram()
+                downstreamLatency = Histogram()
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        tone.terminate()
+    elapsedHours = (time.monotonic() - start) / 3600
+    if baselineRss is not None:
+        growth = (rssBytes() - baselineRss) / 1048576
+        print(f"\tRSS growth after warm up {growth:+.1f} MB ({growth / elapsedHours:+.1f} MB/hour)")
+    print(f"\tjitter buffer {port.framesToSip.stats()}")
+
+
+parser = argparse.ArgumentParser(description="Micro benchmarks of the du-sip-client media hot paths")
+subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+ingestParser = subparsers.add_parser("ingest", help="Per frame cost of converting a downstream datagram to pj.ByteVector")
+ingestParser.add_argument("--sample-rate", type=int, default=16000)
+ingestParser.add_argument("--frame-length-msec", type=int, default=40)
+ingestParser.add_argument("--frames", type=int, default=10000)
+ingestParser.set_defaults(run=benchIngest)
+
+snifferParser = subparsers.add_parser("sniffer", help="Packets/sec and CPU of the --use-sniffer capture backends. "
+                                                      "Needs CAP_NET_RAW")
+snifferParser.add_argument("--backends", nargs="+", choices=UdpSniffer.SNIFFER_BACKENDS, default=UdpSniffer.SNIFFER_BACKENDS)
+snifferParser.add_argument("--port", type=int, default=16600)
+snifferParser.add_argument("--packets", type=int, default=20000)
+snifferParser.add_argument("--rate", type=int, default=5000, help="Packets per second")
+snifferParser.add_argument("--size", type=int, default=1280)
+snifferParser.add_argument("--noise", type=int, default=1, help="Packets to another port sent along with each measured one")
+snifferParser.set_defaults(run=benchSniffer)
+
+resampleParser = subparsers.add_parser("resample", help="Per frame CPU of the numpy downstream adaptation stage and, "
+                                                        "with --bridge, of the pjsip conference bridge resampler")
+resampleParser.add_argument("--input-rate", type=int, default=48000)
+resampleParser.add_argument("--input-channels", type=int, default=1)
+resampleParser.add_argument("--input-format", choices=Resampler.FORMATS, default=Resampler.S16)
+resampleParser.add_argument("--sample-rate", type=int, default=16000)
+resampleParser.add_argument("--frame-length-msec", type=int, default=40)
+resampleParser.add_argument("--frames", type=int, default=5000)
+resampleParser.add_argument("--batches", type=int, nargs="+", default=[1, 4, 16], help="Frames per conversion")
+resampleParser.add_argument("--bridge", action="store_true", help="Also measure the conference bridge (needs pjsua2)")
+resampleParser.add_argument("--bridge-seconds", type=float, default=10)
+resampleParser.set_defaults(run=benchResample)
+
+toneParser = subparsers.add_parser("tone", help="Sends a 440 Hz tone as PCM frames over UDP at the frame clock, "
+                                                "a stand-in for the Streamer")
+toneParser.add_argument("--host", default="127.0.0.1")
+toneParser.add_argument("--port", type=CallSpec.endpoint, default=6600, help="UDP port or AF_UNIX socket path")
+toneParser.add_argument("--sample-rate", type=int, default=16000)
+toneParser.add_argument("--frame-length-msec", type=int, default=40)
+toneParser.add_argument("--duration-sec", type=float, default=0, help="0 sends until killed")
+toneParser.add_argument("--stamp", action="store_true", help="Carry the send time in the first 8 bytes of each frame")
+toneParser.set_defaults(run=benchTone)
+
+soakParser = subparsers.add_parser("soak", help="Drives CustomMediaPort callbacks at the frame clock with a loopback "
+                                                "tone downstream: callback CPU, end to end latency and memory growth")
+soakParser.add_argument("--pjsua2", action="store_true", help="Use the real pjsua2 types instead of the stand-in")
+soakParser.add_argument("--duration-sec", type=float, default=60, help="Hours long runs catch slow leaks")
+soakParser.add_argument("--report-sec", type=float, default=10)
+soakParser.add_argument("--sample-rate", type=int, default=16000)
+soakParser.add_argument("--frame-length-msec", type=int, default=40)
+soakParser.add_argument("--jitter-target-msec", type=int, default=80)
+soakParser.add_argument("--plc", action="store_true", help="Enable the concealment, the downstream latency is not "
+                                                           "measured then as the cross-fade alters the stamps")
+soakParser.add_argument("--downport", type=int, default=16600)
+soakParser.add_argument("--upport", type=int, default=16700)
+soakParser.add_argument("--round-trip", action="store_true",
+                        help="Loop every frame handed to pjsip back as the received frame, so the upstream latency "
+                             "is the tone sender to upstream sink time through both directions of the port")
+soakParser.add_argument("--busy-poll-usec", type=int, default=0)
+soakParser.add_argument("--cpu-affinity", type=int, nargs="+", default=None,
+                        help="CPUs of the downstream, upstream and frame clock threads, see sip_client.py")
+soakParser.add_argument("--rt-priority", type=int, default=0)
+soakParser.set_defaults(run=benchSoak)
+
+eventLoopParser = subparsers.add_parser("eventloop", help="Idle CPU, wake ups and event latency of the sip_client "
+                                                          "main loop, sleep polling against blocking in pjsip, "
+                                                          "on the stand-in endpoint")
+eventLoopParser.add_argument("--modes", nargs="+", choices=EVENT_LOOP_MODES, default=EVENT_LOOP_MODES)
+eventLoopParser.add_argument("--duration-sec", type=float, default=20)
+eventLoopParser.add_argument("--events", type=int, default=20, help="Set up events spread over the run")
+eventLoopParser.add_argument("--max-event-wait-msec", type=int, default=200)
+eventLoopParser.add_argument("--seed", type=int, default=1)
+eventLoopParser.add_argument("--pjsua2", action="store_true",
+                             help="Measure a real pjsua2 endpoint answering OPTIONS instead of the stand-in")
+eventLoopParser.add_argument("--sip-port", type=int, default=15060, help="UDP transport port of --pjsua2")
+eventLoopParser.set_defaults(run=benchEventLoop)
+
+transportParser = subparsers.add_parser("transport", help="Per frame latency and CPU of the downstream PCM over UDP "
+                                                          "loopback against AF_UNIX datagram sockets")
+transportParser.add_argument("--frame-lengths", type=int, nargs="+", default=[10, 20, 40], help="Frame lengths in ms")
+transportParser.add_argument("--duration-sec", type=float, default=20)
+transportParser.add_argument("--sample-rate", type=int, default=16000)
+transportParser.add_argument("--port", type=int, default=16600, help="First UDP port")
+transportParser.add_argument("--socket-dir", default="/tmp", help="Directory of the Unix sockets")
+transportParser.set_defaults(run=benchTransport)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,68 @@
+class CallSpec:
+    """
+    Destination, PCM ports and port format of one call. Parsed from a --call argument like
+    "sip:100@10.20.97.222,downport=6601,upport=6701,rate=16000,frame=40" where every field
+    is optional and defaults to the matching single call option. A port may also be the path of
+    an AF_UNIX datagram socket.
+    """
+    ENDPOINT_FIELDS = ["downport", "upport"]
+    FIELDS = {"dest": "destination", "downport": "downStreamPort", "upport": "upStreamPort",
+              "rate": "sampleRate", "frame": "frameLenMs"}
+
+    def __init__(self, destination="", downStreamPort=0, upStreamPort=0, sampleRate=16000, frameLenMs=40):
+        self.destination = destination
+        self.downStreamPort = downStreamPort
+        self.upStreamPort = upStreamPort
+        self.sampleRate = sampleRate
+        self.frameLenMs = frameLenMs
+
+    @staticmethod
+    def sipUri(destination):
+        if destination and not destination.startswith("sip:"):
+            return "sip:" + destination
+        return destination
+
+    @staticmethod
+    def endpoint(text):
+        """
+        A UDP port number, or a Unix socket path kept as a string
+        """
+        return int(text) if text.isdigit() else text
+
+    @staticmethod
+    def isUnixSocket(endpoint):
+        return isinstance(endpoint, str) and endpoint != ""
+
+    @staticmethod
+    def parse(text, defaults):
+        spec = CallSpec(defaults.destination, defaults.downStreamPort, defaults.upStreamPort,
+                        defaults.sampleRate, defaults.frameLenMs)
+        for field in text.split(","):
+            field = field.strip()
+            if not field:
+                continue
+            key, sep, value = field.partition("=")
+            if not sep:
+                key, value = "dest", field
+            assert key in CallSpec.FIELDS, f"Unknown call spec field '{key}' in '{text}'"
+            if key == "dest":
+                spec.destination = CallSpec.sipUri(value)
+            elif key in CallSpec.ENDPOINT_FIELDS:
+                setattr(spec, CallSpec.FIELDS[key], CallSpec.endpoint(value))
+            else:
+                setattr(spec, CallSpec.FIELDS[key], int(value))
+        return spec
+
+    @staticmethod
+    def parseAll(texts, defaults):
+        specs = [CallSpec.parse(text, defaults) for text in texts] if texts else [defaults]
+        assert all(spec.destination for spec in specs), "Every call needs a destination"
+        downPorts = [spec.downStreamPort for spec in specs if spec.downStreamPort]
+        assert len(downPorts) == len(set(downPorts)), f"Every call needs its own downport: {downPorts}"
+        upPorts = [spec.upStreamPort for spec in specs if spec.upStreamPort]
+        assert len(upPorts) == len(set(upPorts)), f"Every call needs its own upport: {upPorts}"
+        return specs
+
+    def __str__(self):
+        return (f"{self.destination} down {self.downStreamPort} up {self.upStreamPort} "
+                f"{self.sampleRate} Hz {self.frameLenMs} ms")
@@ -17,13 +17,27 @@ import sys
 import time
 
 import pjsua2 as pj
+try:
+    import numpy as np
+except ImportError:
+    np = None
 import application
 from udpsniffer import UdpSniffer
+from jitterbuffer import JitterBuffer
+from reframer import Reframer
+from resampler import Resampler
+from vad import VoiceActivityDetector
+from plc import Concealer
+from upstream import UpstreamSender
+from realtime import ThreadTuning
+from shmring import ShmRing
+from recorder import Recorder
+from recovery import CallRecovery
+from ipcclient import IpcClient
+from metrics import REGISTRY
+from logutil import HotPathLog
 import endpoint as ep
-import json
-import struct
 import queue
-import socket
 import threading
 import logging
 import os
@@ -36,6 +50,35 @@ CHANNEL_COUNT = 1
 BITS_PER_SAMPLE = 16
 FRAME_TIME_USEC = 40000
 SHARED_VOLUME_PATH = "/tmp/du-sip"
+# PCM exchange with the Streamer: UDP datagrams or memory mapped rings in SHARED_VOLUME_PATH
+UDP_TRANSPORT = "udp"
+SHM_TRANSPORT = "shm"
+TRANSPORTS = [UDP_TRANSPORT, SHM_TRANSPORT]
+# The frame callbacks log one of that many frames, at most once per second
+HOT_PATH_LOG_EVERY = 50
+
+
+def toByteVector(data):
+    # A single SWIG call: the vector is filled from the buffer on the C++ side instead of
+    # appending it byte by byte from Python
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    return pj.ByteVector(data)
+
+
+def ringPath(direction, port):
+    # The Streamer maps the same files: down-<downport>.ring it writes, up-<upport>.ring it reads
+    return os.path.join(SHARED_VOLUME_PATH, f"{direction}-{port}.ring")
+
+
+def registerThread(name):
+    """
+    Registers the calling Python thread with pjlib. With pjsip worker threads enabled every thread
+    calling into pjsua2 has to be known to pjlib, the ones it created itself already are
+    """
+    endpoint = ep.Endpoint.instance
+    if endpoint and not endpoint.libIsThreadRegistered():
+        endpoint.libRegisterThread(name)
 
 
 class WatchdogData:
@@ -45,83 +88,115 @@ class WatchdogData:
     INTERNAL_ERROR = "internal_error"
     EXTERNAL_ERROR = "external_error"
 
-    def __init__(self):
+    def __init__(self, name=""):
+        self.name = name
         self.state = WatchdogData.VALID
         self.clientStartTime = time.monotonic()
+        self.callStartTime = self.clientStartTime
         self.lastFrameRequestedTime = 0
         self.lastFrameReceivedTime = 0
         self.qsize = 0
         self.framesRequested = 0
         self.framesReceived = 0
+        # When the first audio frame went to pjsip, after the jitter buffer pre-roll, for the start up profile
+        self.firstFrameTime = 0
+        self.jitterBuffer = None
 
         self.ipcSocketPath = f"{SHARED_VOLUME_PATH}/ipc.sock"
+        self.ipcClient = IpcClient.instance(self.ipcSocketPath)
+
+    def restartCall(self):
+        # The media of a redialed call gets the same start up window as the first call
+        self.callStartTime = time.monotonic()
+        self.lastFrameRequestedTime = 0
+        self.lastFrameReceivedTime = 0
+
+    def setJitterBuffer(self, jitterBuffer):
+        self.jitterBuffer = jitterBuffer
 
     def frameRequested(self, qsize, framesRequested):
         self.lastFrameRequestedTime = time.monotonic()
         self.qsize = qsize
         self.framesRequested = framesRequested
 
-    def notifyExternalApp(self, msg_type, content):
-        message = {'type': msg_type, 'message': content}
-        message_json = json.dumps(message)
-        logging.error(f"Got error: {message_json} it will be sent via {self.ipcSocketPath}")
-
-        if not os.path.exists(self.ipcSocketPath):
-            logging.error(f"cannot send error notification - socket {self.ipcSocketPath} doesn not exist")
-            return
-
-        # Create a Unix domain socket
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
-            try:
-                # Connect to the Unix domain socket
-                sock.connect(self.ipcSocketPath)
+    def audioPlayed(self):
+        # pjsip requests frames from the media start on, the first one answered with audio counts
+        if not self.firstFrameTime:
+            self.firstFrameTime = time.monotonic()
 
-                # Send the JSON message
-                sock.sendall(message_json.encode())
-                logging.info(f"Message sent")
-
-            except Exception as e:
-                logging.error(f"Error on sending error message: {e}")
+    def notifyExternalApp(self, msg_type, content):
+        message = {'type': msg_type, 'message': content, 'call': self.name}
+        logging.error(f"Got error: {message} it will be sent via {self.ipcSocketPath}")
+        # Only queued here - the IPC client thread sends it, so the watchdog never waits for the external app
+        self.ipcClient.send(message)
 
     def frameReceived(self, framesReceived):
         self.lastFrameReceivedTime = time.monotonic()
         self.framesReceived = framesReceived
 
-    def callbacksTimeIsValid(self):
+    def status(self):
+        now = time.monotonic()
+        status = {
+            "call": self.name,
+            "state": "valid" if self.state == WatchdogData.VALID else "erroneous",
+            "runningSec": round(now - self.clientStartTime, 1),
+            "framesRequested": self.framesRequested,
+            "framesReceived": self.framesReceived,
+            "sinceFrameRequestedSec": round(now - self.lastFrameRequestedTime, 3) if self.lastFrameRequestedTime else None,
+            "sinceFrameReceivedSec": round(now - self.lastFrameReceivedTime, 3) if self.lastFrameReceivedTime else None,
+        }
+        if self.jitterBuffer:
+            status["jitterBuffer"] = self.jitterBuffer.stats()
+        return status
+
+    def checkFault(self):
+        """
+        Returns None while the media flows, CallRecovery.PENDING during the call start up window
+        or the fault class
+        """
         now = time.monotonic()
         runningTime = now - self.clientStartTime
         if int(runningTime) % 30 == 0:
             logging.info(f"=========  Watchdog Check State {runningTime}  =========")
             self.notifyExternalApp(WatchdogData.INTERNAL_INFO, f"Client runs {runningTime} sec. "
                                     f"Requested: {self.framesRequested}, Received  {self.framesReceived} frames")
-
-        if runningTime < 10:
-            return True
+            if self.jitterBuffer:
+                logging.info(f"Jitter buffer: {self.jitterBuffer.stats()}")
 
         if self.lastFrameReceivedTime == 0 or self.lastFrameRequestedTime == 0:
-            self.notifyExternalApp(WatchdogData.INTERNAL_ERROR, f"Client runs {runningTime} sec but SIP communication still not started")
-            return False
+            if now - self.callStartTime < 10:
+                return CallRecovery.PENDING
+            return CallRecovery.FAULT_NOT_STARTED
 
         if (now - self.lastFrameReceivedTime) > 1 or (now - self.lastFrameRequestedTime) > 1:
-            self.notifyExternalApp(WatchdogData.INTERNAL_ERROR, "The SIP packets send/receive is timeouted")
-            return False
+            return CallRecovery.FAULT_MEDIA_TIMEOUT
 
-        if self.qsize > 10:
-            self.notifyExternalApp(WatchdogData.EXTERNAL_ERROR, f"The to SIP queue size {self.qsize} exceeds the limit")
-            return False
-        return True
+        return None
 
     def checkState(self):
-        if self.state == WatchdogData.VALID:
-            self.state = WatchdogData.VALID if self.callbacksTimeIsValid() else WatchdogData.ERRONEOUS
-            if self.state == WatchdogData.ERRONEOUS:
-                logging.critical(f"======================== !!!  Watchdog detected a problem. The client is going to restart!")
-            return self.state
-        return self.state
+        """
+        Returns the result of checkFault and notifies the external app when a fault starts
+        """
+        fault = self.checkFault()
+        isFault = fault is not None and fault != CallRecovery.PENDING
+        if isFault and self.state == WatchdogData.VALID:
+            if fault == CallRecovery.FAULT_NOT_STARTED:
+                self.notifyExternalApp(WatchdogData.INTERNAL_ERROR, f"Call runs {time.monotonic() - self.callStartTime:.0f} sec "
+                                                                    f"but SIP communication still not started")
+            else:
+                self.notifyExternalApp(WatchdogData.INTERNAL_ERROR, "The SIP packets send/receive is timeouted")
+            logging.critical(f"======================== !!!  Watchdog detected a problem: {fault}. The call is going to recover!")
+        self.state = WatchdogData.ERRONEOUS if isFault else WatchdogData.VALID
+        return fault
 
 
 class CustomMediaPort(pj.AudioMediaPort):
-    def __init__(self,  watchdogData, upStreamPort, downStreamPort, useSniffer=False, playbackFile=None, echoMode=False):
+    def __init__(self,  watchdogData, upStreamPort, downStreamPort, useSniffer=False, recorder=None, echoMode=False,
+                 frameSize=None, frameTimeMs=FRAME_TIME_USEC // 1000, jitterTargetMs=JitterBuffer.DEFAULT_TARGET_MS,
+                 jitterMaxMs=JitterBuffer.DEFAULT_MAX_MS, jitterPolicy=JitterBuffer.DROP_OLDEST,
+                 recvBatchSize=16, recvTimeoutMs=1000, recvBufSize=0, snifferBackend=UdpSniffer.RECVFROM_BACKEND,
+                 resampler=None, upstreamVad=None, downstreamVad=None, concealer=None, upRing=None, downRing=None,
+                 busyPollUsec=0, threadTuning=None):
         logging.info(f"CustomMediaPort constructor {id(self)}")
         pj.AudioMediaPort.__init__(self)
         self.watchdogData = watchdogData
@@ -129,92 +204,239 @@ class CustomMediaPort(pj.AudioMediaPort):
         self.frameCount = 0
         self.framesSentCount = 0
         self.frameBuffer = None
-        self.framesToSip = queue.Queue()
+        self.framesAddedLog = HotPathLog(logging.DEBUG, HOT_PATH_LOG_EVERY, 1.0)
+        self.framesSentLog = HotPathLog(logging.DEBUG, HOT_PATH_LOG_EVERY, 1.0)
+        self.framesReceivedLog = HotPathLog(logging.DEBUG, HOT_PATH_LOG_EVERY, 1.0)
+        if frameSize is None:
+            frameSize = Reframer.frameSizeOf(CLOCK_RATE, FRAME_TIME_USEC, CHANNEL_COUNT, BITS_PER_SAMPLE)
+        self.reframer = Reframer(frameSize)
+        # Converts the downstream rate, channels and sample format to the port format when they differ
+        self.resampler = resampler
+        # Silent downstream frames are queued without audio, so pjsip sees the silence periods
+        self.downstreamVad = downstreamVad
+        self.upstreamVad = upstreamVad
+        # Synthesizes the frames missing on a jitter buffer underrun
+        self.concealer = concealer
+        self.framesToSip = JitterBuffer(frameTimeMs, jitterTargetMs, jitterMaxMs, jitterPolicy)
+        self.watchdogData.setJitterBuffer(self.framesToSip)
         self.echoFrames = queue.Queue()
         self.count = 0
         self.downStreamPort = downStreamPort
         self.upStreamPort = upStreamPort
         self.useSniffer = useSniffer
-        self.playbackFile = None
+        self.snifferBackend = snifferBackend
+        self.recorder = recorder
         self.echoMode = echoMode
-        if playbackFile:
-            playbackFile = os.path.join("/tmp/du-sip",playbackFile)
-            self.playbackFile = open(playbackFile, "wb")
-
-        self.upStreamSocket = None
-        if self.upStreamPort > 0:
-            self.upStreamSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            logging.info(f"Created upstream socket. Port {self.upStreamPort}")
-        if self.downStreamPort:
-            self.downStreamSniffer = UdpSniffer(downStreamPort)
+        # Shared memory rings replacing the UDP sockets, see ShmRing
+        self.upRing = upRing
+        self.downRing = downRing
+        # CPU affinity and real time priority of the downstream, upstream and pjsip media threads
+        self.threadTuning = threadTuning
+        # Histogram copies of the previous latency report
+        self.latencySnapshots = {}
+
+        self.initMetrics()
+
+        self.upStream = None
+        if self.upStreamPort:
+            self.upStream = UpstreamSender(self.upStreamPort, latencyHistogram=self.upstreamLatency, vad=upstreamVad,
+                                           ring=upRing, threadTuning=threadTuning, pollMs=max(1, frameTimeMs // 5))
+            self.registerUpstreamMetrics()
+        if self.downRing:
+            # Read by onFrameRequested itself, no listener thread
+            logging.info(f"Downstream initialized in shared memory mode, {downRing.path}")
+        elif self.downStreamPort:
+            self.downStreamSniffer = UdpSniffer(downStreamPort, batchSize=recvBatchSize, timeoutMs=recvTimeoutMs,
+                                                rcvBufSize=recvBufSize, busyPollUsec=busyPollUsec)
             self.downStreamThread = threading.Thread(target=self.listenForDownStream, daemon=True)
             self.downStreamThread.start()
 
-    def processStreamAsIs(self, data):
-        frameBuffer = pj.ByteVector()
-        for i in range(len(data)):
-            frameBuffer.append(data[i])
-        self.framesToSip.put(frameBuffer)
-        if self.frameFromDuCount % 50 == 0:
-            logging.debug(f"{time.time()} ---- Added Frame As Is {self.frameFromDuCount} qsize: {self.framesToSip.qsize()}")
-        self.frameFromDuCount += 1
+    def initMetrics(self):
+        labels = {"port": str(self.downStreamPort)}
+        self.metricsLabels = labels
+        self.receiveLatency = REGISTRY.histogram("du_downstream_receive_us", "Kernel receive to jitter buffer enqueue", labels)
+        self.jitterWait = REGISTRY.histogram("du_jitter_buffer_wait_us", "Jitter buffer enqueue to hand off to pjsip", labels)
+        self.downstreamLatency = REGISTRY.histogram("du_downstream_latency_us", "Kernel receive to hand off to pjsip", labels)
+        self.upstreamLatency = REGISTRY.histogram("du_upstream_latency_us", "onFrameReceived to the upstream send", labels)
+        self.frameRequestedDuration = REGISTRY.histogram("du_frame_requested_callback_us",
+                                                         "Time spent in onFrameRequested", labels)
+        self.frameReceivedDuration = REGISTRY.histogram("du_frame_received_callback_us",
+                                                        "Time spent in onFrameReceived", labels)
+        jitterBuffer = self.framesToSip
+        REGISTRY.gaugeFunc("du_jitter_buffer_depth_ms", "Jitter buffer depth", labels, jitterBuffer.depthMs)
+        REGISTRY.counterFunc("du_jitter_buffer_underruns_total", "Frame requests finding the jitter buffer empty",
+                             labels, lambda: jitterBuffer.underruns)
+        REGISTRY.counterFunc("du_jitter_buffer_overflow_drops_total", "Frames dropped at the jitter buffer cap",
+                             labels, lambda: jitterBuffer.overflowDrops)
+        REGISTRY.counterFunc("du_jitter_buffer_compress_drops_total", "Frames skipped by the time compression",
+                             labels, lambda: jitterBuffer.compressDrops)
+        REGISTRY.counterFunc("du_frames_from_streamer_total", "Frames added to the jitter buffer",
+                             labels, lambda: self.frameFromDuCount)
+        REGISTRY.counterFunc("du_frames_to_sip_total", "Frames passed to pjsip", labels, lambda: self.framesSentCount)
+        REGISTRY.counterFunc("du_frames_from_sip_total", "Frames received from pjsip", labels, lambda: self.frameCount)
+        for direction, vad in (("up", self.upstreamVad), ("down", self.downstreamVad)):
+            if vad:
+                REGISTRY.counterFunc("du_vad_bytes_saved_total", "Bytes of the silent frames not sent",
+                                     dict(labels, direction=direction), lambda vad=vad: vad.bytesSaved)
+        if self.concealer:
+            REGISTRY.counterFunc("du_concealed_frames_total", "Frames synthesized on jitter buffer underruns", labels,
+                                 lambda: self.concealer.concealedFrames)
+        for direction, ring in (("up", self.upRing), ("down", self.downRing)):
+            if ring:
+                REGISTRY.gaugeFunc("du_shm_ring_depth_frames", "Frames waiting in the shared memory ring",
+                                   dict(labels, direction=direction), ring.depth)
+        if self.recorder:
+            REGISTRY.counterFunc("du_recorder_drops_total", "Frames dropped by the recorder", labels,
+                                 lambda: self.recorder.framesDropped)
+
+    def registerUpstreamMetrics(self):
+        upStream = self.upStream
+        REGISTRY.gaugeFunc("du_upstream_queue_frames", "Frames waiting for the upstream sender", self.metricsLabels,
+                           upStream.queuedFrames)
+        REGISTRY.counterFunc("du_upstream_drops_total", "Frames dropped by the upstream sender", self.metricsLabels,
+                             lambda: upStream.framesDropped)
+        REGISTRY.counterFunc("du_upstream_send_errors_total", "Failed upstream sends", self.metricsLabels,
+                             lambda: upStream.sendErrors)
+
+    def reset(self):
+        self.framesToSip.flush()
+        self.reframer.reset()
+        if self.concealer:
+            self.concealer.reset()
+        if self.resampler:
+            self.resampler.reset()
+
+    def processStreamAsIs(self, data, rxTimeNs=None):
+        enqueueTimeNs = time.time_ns()
+        if rxTimeNs:
+            self.receiveLatency.record((enqueueTimeNs - rxTimeNs) // 1000)
+        else:
+            rxTimeNs = enqueueTimeNs
+        if self.resampler:
+            data = self.resampler.push(data)
+        # Datagrams of any size are sliced into frames matching the port format
+        for frameData in self.reframer.push(data):
+            if self.downstreamVad and not self.downstreamVad.keep(frameData):
+                frameBuffer = None
+            elif self.concealer:
+                # Converted when played, after the concealer has seen and possibly cross-faded the frame
+                frameBuffer = frameData
+            else:
+                frameBuffer = toByteVector(frameData)
+            self.framesToSip.put((frameBuffer, rxTimeNs, enqueueTimeNs))
+            self.framesAddedLog.log("Frames added: %d, jitter buffer depth: %d ms", self.frameFromDuCount,
+                                    self.framesToSip.depthMs())
+            self.frameFromDuCount += 1
+
+    def processStreamBatch(self, frames, timestamps):
+        if self.resampler and len(frames) > 1:
+            # One conversion for the whole batch, the latency is accounted from its oldest datagram
+            self.processStreamAsIs(b"".join(frames), timestamps[0] if timestamps else None)
+            return
+        for i, data in enumerate(frames):
+            self.processStreamAsIs(data, timestamps[i] if timestamps else None)
 
     def listenForDownStream(self):
         logging.info(f"Downstream listener thread is started")
+        registerThread(f"downstream-{self.downStreamPort}")
+        if self.threadTuning:
+            self.threadTuning.apply(f"downstream-{self.downStreamPort}", ThreadTuning.DOWNSTREAM)
         self.frameBuffer = pj.ByteVector()
         if self.useSniffer:
-            logging.info("Downstream initialized in sniffing mode")
-            self.downStreamSniffer.sniff(self.processStreamAsIs)
+            logging.info(f"Downstream initialized in sniffing mode, {self.snifferBackend} backend")
+            if self.snifferBackend == UdpSniffer.MMAP_BACKEND:
+                self.downStreamSniffer.sniffRing(self.processStreamAsIs)
+            else:
+                self.downStreamSniffer.sniff(self.processStreamAsIs)
         else:
             logging.info("Downstream initialized in reading mode")
-            self.downStreamSniffer.read(self.processStreamAsIs)
+            self.downStreamSniffer.readBatched(self.processStreamBatch)
 
+    def readDownRing(self):
+        # Takes whatever the Streamer has published since the previous frame request - plain memory reads
+        while True:
+            item = self.downRing.poll()
+            if item is None:
+                return
+            data, publishTimeNs = item
+            self.processStreamAsIs(data, publishTimeNs)
 
     def onFrameRequested(self, frame):
-        qsize = self.framesToSip.qsize()
-        self.watchdogData.frameRequested(qsize, self.framesSentCount)
-        if qsize > 0:
-            frame.type = pj.PJMEDIA_TYPE_AUDIO
-            # Get a frame from the queue and pass it to PJSIP
-            frame.buf = self.framesToSip.get()
-            frame.size = frame.buf.size()
-
-            if self.echoMode:
-                barr = bytes(frame.buf)
-                self.upStreamSocket.sendto(barr, ("0.0.0.0", self.upStreamPort))
-            if self.framesSentCount % 50 == 0:
-                logging.debug(f"{time.time()}-------- Frames sent: {self.framesSentCount}, size: {frame.buf.size()}")
+        callbackStart = time.perf_counter_ns()
+        if self.threadTuning:
+            self.threadTuning.ensure("pjsip-media", ThreadTuning.MEDIA)
+        if self.downRing:
+            self.readDownRing()
+        # Get a frame from the jitter buffer and pass it to PJSIP
+        item = self.framesToSip.get()
+        self.watchdogData.frameRequested(self.framesToSip.depth(), self.framesSentCount)
+        if item is not None:
+            frameBuffer, rxTimeNs, enqueueTimeNs = item
+            now = time.time_ns()
+            self.jitterWait.record((now - enqueueTimeNs) // 1000)
+            self.downstreamLatency.record((now - rxTimeNs) // 1000)
+            if frameBuffer is None:
+                # Suppressed silence - no audio, so the stream can stop sending or send comfort noise
+                frame.type = pj.PJMEDIA_TYPE_NONE
+                frame.size = 0
+                if self.concealer:
+                    # Nothing to conceal or cross-fade from after real silence
+                    self.concealer.reset()
+            else:
+                if self.concealer:
+                    frameBuffer = toByteVector(self.concealer.played(frameBuffer))
+                frame.type = pj.PJMEDIA_TYPE_AUDIO
+                frame.buf = frameBuffer
+                frame.size = len(frameBuffer)
+                self.watchdogData.audioPlayed()
+
+            if self.recorder:
+                self.recorder.record(Recorder.TX, frameBuffer)
+            if self.echoMode and frameBuffer is not None:
+                self.upStream.send(frameBuffer)
+            self.framesSentLog.log("Frames sent: %d, size: %d", self.framesSentCount, frame.size)
             self.framesSentCount += 1
         else:
-            frame.type = pj.PJMEDIA_TYPE_NONE
-            frame.size = 0
+            concealed = self.concealer.conceal() if self.concealer else None
+            if concealed is None:
+                frame.type = pj.PJMEDIA_TYPE_NONE
+                frame.size = 0
+            else:
+                frame.type = pj.PJMEDIA_TYPE_AUDIO
+                frame.buf = toByteVector(concealed)
+                frame.size = len(concealed)
+            if self.recorder:
+                self.recorder.record(Recorder.TX, concealed)
             # self.setEmptyFrame(frame)
+        self.frameRequestedDuration.record((time.perf_counter_ns() - callbackStart) // 1000)
+
+    def latencyReport(self):
+        """
+        Percentiles of the frame latencies measured since the previous report
+        """
+        histograms = {"downstream": self.downstreamLatency, "jitterWait": self.jitterWait,
+                      "upstream": self.upstreamLatency, "frameRequestedCallback": self.frameRequestedDuration}
+        report = {}
+        for name, histogram in histograms.items():
+            previous = self.latencySnapshots.get(name)
+            interval = histogram.since(previous) if previous else histogram
+            report[name] = {"p50": interval.percentile(50), "p99": interval.percentile(99), "max": interval.max}
+        self.latencySnapshots = {name: histogram.snapshot() for name, histogram in histograms.items()}
+        return report
+
+    def vadStats(self):
+        return {direction: vad.stats() for direction, vad in (("up", self.upstreamVad), ("down", self.downstreamVad))
+                if vad}
 
     def setEmptyFrame(self, frame):
-        frame.buf = pj.ByteVector()
-        for i in range(frame.size):
-            frame.buf.append(0)
+        frame.buf = pj.ByteVector(frame.size)
 
     def createDummyFrameBuffer(self, frameSize):
-        frame_ = pj.ByteVector()
-        for i in range(frameSize):
-            if (i % 2 == 1):
-                x = int(np.sin((self.count / 10) % 6) * 10000)
-                if (x > 32767):
-                    x = 32767
-                else:
-                    if (x < -32768):
-                        x = -32768
-
-                # Convert it to unsigned 16-bit integer
-                x = struct.unpack('<H', struct.pack('<h', x))[0]
-
-                # Put it back in the vector in little endian order
-                frame_.append(x & 0xff)
-                frame_.append((x & 0xff00) >> 8)
-                self.count += 1
-
-        return frame_
+        # A test tone of frameSize bytes, 16 bit little endian samples continuing the phase of the previous frame
+        samples = frameSize // 2
+        phase = ((self.count + np.arange(samples)) / 10) % 6
+        self.count += samples
+        return toByteVector((np.sin(phase) * 10000).astype("<i2").tobytes())
 
     def createDummyFrame(self, frame):
         frame.type = pj.PJMEDIA_TYPE_AUDIO
@@ -223,20 +445,17 @@ class CustomMediaPort(pj.AudioMediaPort):
 
 
     def onFrameReceived(self, frame):
+        callbackStart = time.perf_counter_ns()
         self.frameCount += 1
         self.watchdogData.frameReceived(self.frameCount)
-        if self.upStreamSocket:
-            if self.echoMode:
-                    return
-            barr = bytes(frame.buf)
-            self.upStreamSocket.sendto(barr, ("0.0.0.0", self.upStreamPort))
-            # self.playbackFile.write(barr)
-            if self.frameCount % 50 == 0:
-                logging.debug(f"{time.time()}+++++  on frame received and sent to playback device: {self.frameCount}")
-            if self.playbackFile:
-                self.playbackFile.write(barr)
-
-        return
+        if self.upStream and not self.echoMode:
+            # The frame buffer is reused by pjsip - hand a C++ side copy to the sender and recorder threads
+            frameBuffer = pj.ByteVector(frame.buf)
+            self.upStream.send(frameBuffer)
+            if self.recorder:
+                self.recorder.record(Recorder.RX, frameBuffer)
+            self.framesReceivedLog.log("Frames received and sent upstream: %d", self.frameCount)
+        self.frameReceivedDuration.record((time.perf_counter_ns() - callbackStart) // 1000)
 
 
 
@@ -247,11 +466,27 @@ class Call(pj.Call):
     High level Python Call object, derived from pjsua2's Call object.
     """
     def __init__(self, acc, peer_uri='', chat=None, call_id=pj.PJSUA_INVALID_ID, downStreamPort=0,
-                 upStreamPort=0, useSniffer=None, playbackFile=None, sampleRate=None, frameLen=None, echoMode=False):
-        global CLOCK_RATE
-        global FRAME_TIME_USEC
+                 upStreamPort=0, useSniffer=None, playbackFile=None, sampleRate=None, frameLen=None, echoMode=False,
+                 jitterTargetMs=JitterBuffer.DEFAULT_TARGET_MS, jitterMaxMs=JitterBuffer.DEFAULT_MAX_MS,
+                 jitterPolicy=JitterBuffer.DROP_OLDEST, recvBatchSize=16, recvTimeoutMs=1000, recvBufSize=0,
+                 snifferBackend=UdpSniffer.RECVFROM_BACKEND, recordingStereo=False, recordingMaxBytes=0,
+                 recordingMaxSec=0, inputSampleRate=0, inputChannels=1, inputFormat=Resampler.S16,
+                 vadMode=VoiceActivityDetector.OFF, vadThresholdDb=VoiceActivityDetector.DEFAULT_THRESHOLD_DB,
+                 vadHangoverMs=VoiceActivityDetector.DEFAULT_HANGOVER_MS, vadKeepEvery=0, concealment=False,
+                 concealRepeatMs=Concealer.DEFAULT_REPEAT_MS, transport=UDP_TRANSPORT, shmSlots=ShmRing.DEFAULT_SLOTS,
+                 busyPollUsec=0, threadTuning=None, startWatchdog=True, recoveryHandler=None, previousCall=None):
         pj.Call.__init__(self, acc, call_id)
-        self.watchdogData = WatchdogData()
+        name = f"{peer_uri} down {downStreamPort} up {upStreamPort}"
+        # A redialed call takes over the watchdog state, the recovery statistics and the media port of
+        # the previous call - the downstream port stays bound and the queued frames are kept
+        if previousCall:
+            self.watchdogData = previousCall.watchdogData
+            self.watchdogData.restartCall()
+            self.recovery = previousCall.recovery
+        else:
+            self.watchdogData = WatchdogData(name=name)
+            self.recovery = CallRecovery(name)
+        self.recoveryHandler = recoveryHandler
         self.acc = acc
         self.peerUri = peer_uri
         self.chat = chat
@@ -261,23 +496,100 @@ class Call(pj.Call):
         self.secondTime = False
         self.downStreamPort = downStreamPort
         self.upStreamPort = upStreamPort
-        self.med_port = None
+        self.med_port = previousCall.med_port if previousCall else None
+        self.audioMedia = None
         self.useSniffer = useSniffer
+        self.snifferBackend = snifferBackend
         self.playbackFile = playbackFile
-        if sampleRate:
-            CLOCK_RATE = sampleRate
-        if frameLen:
-            FRAME_TIME_USEC = frameLen * 1000
-        self.watchdogThread = threading.Thread(target=self.watchdog, daemon=True)
-        self.watchdogThread.start()
+        self.recordingStereo = recordingStereo
+        self.recordingMaxBytes = recordingMaxBytes
+        self.recordingMaxSec = recordingMaxSec
+        # Format of the downstream PCM, 0 rate means it already matches the port
+        self.inputSampleRate = inputSampleRate
+        self.inputChannels = inputChannels
+        self.inputFormat = inputFormat
+        self.vadMode = vadMode
+        self.vadThresholdDb = vadThresholdDb
+        self.vadHangoverMs = vadHangoverMs
+        self.vadKeepEvery = vadKeepEvery
+        self.concealment = concealment
+        self.concealRepeatMs = concealRepeatMs
+        self.transport = transport
+        self.shmSlots = shmSlots
+        self.busyPollUsec = busyPollUsec
+        self.threadTuning = threadTuning
+        # The port format is kept per call, so calls with different formats can share the process
+        self.clockRate = sampleRate if sampleRate else CLOCK_RATE
+        self.frameTimeUsec = frameLen * 1000 if frameLen else FRAME_TIME_USEC
+        # Without its own watchdog thread the owner has to call checkWatchdog periodically
+        if startWatchdog:
+            self.watchdogThread = threading.Thread(target=self.watchdog, daemon=True)
+            self.watchdogThread.start()
         self.echoMode = echoMode
+        self.jitterTargetMs = jitterTargetMs
+        self.jitterMaxMs = jitterMaxMs
+        self.jitterPolicy = jitterPolicy
+        self.recvBatchSize = recvBatchSize
+        self.recvTimeoutMs = recvTimeoutMs
+        self.recvBufSize = recvBufSize
+        # Call setup latency: from dialing until the call is confirmed and until its media is connected
+        self.dialTime = 0
+        self.setupMs = None
+        self.mediaSetupMs = None
+        # Negotiated codec of the audio stream, see checkStreamFormat
+        self.codec = None
+        self.setupLatency = REGISTRY.histogram("du_call_setup_us", "Dialing to the call confirmation",
+                                               {"port": str(downStreamPort)})
+
+    def dial(self, uri, prm):
+        self.dialTime = time.monotonic()
+        self.makeCall(uri, prm)
 
     def watchdog(self):
+        registerThread(f"watchdog-{self.downStreamPort}")
         while True:
-            if (self.watchdogData.checkState() != WatchdogData.VALID):
-                os._exit(-1)
+            self.checkWatchdog()
             time.sleep(1)
 
+    def checkWatchdog(self):
+        wasFaulty = self.recovery.fault is not None
+        action = self.recovery.update(self.watchdogData.checkState())
+        if wasFaulty and self.recovery.fault is None:
+            self.watchdogData.notifyExternalApp(WatchdogData.INTERNAL_INFO, f"Call recovered: {self.recovery.stats}")
+        if not action:
+            return
+        if action == CallRecovery.EXIT or not self.recoveryHandler:
+            logging.critical(f"======================== !!!  Recovery failed. The client is going to restart!")
+            os._exit(-1)
+        self.recoveryHandler(self, action)
+
+    def latencyReport(self):
+        return self.med_port.latencyReport() if self.med_port else None
+
+    def status(self):
+        return dict(self.watchdogData.status(), recovery=self.recovery.stats, setupMs=self.setupMs,
+                    mediaSetupMs=self.mediaSetupMs, codec=self.codec, vad=self.med_port.vadStats() if self.med_port else {},
+                    concealment=self.med_port.concealer.stats() if self.med_port and self.med_port.concealer else None)
+
+    def resetMedia(self):
+        """
+        Flushes the media port and reconnects it to the call audio in the conference bridge
+        """
+        if not self.med_port:
+            return
+        self.med_port.reset()
+        if self.audioMedia:
+            self.audioMedia.stopTransmit(self.med_port)
+            self.med_port.stopTransmit(self.audioMedia)
+            self.audioMedia.startTransmit(self.med_port)
+            self.med_port.startTransmit(self.audioMedia)
+
+    def reinviteMedia(self):
+        prm = pj.CallOpParam(True)
+        prm.opt.audioCount = 1
+        prm.opt.videoCount = 0
+        self.reinvite(prm)
+
     def getAudioMedia(self):
         ci = self.getInfo()
         for mi in ci.media:
@@ -292,6 +604,11 @@ class Call(pj.Call):
         logging.info(f'XXXX   Call state')
         ci = self.getInfo()
         self.connected = ci.state == pj.PJSIP_INV_STATE_CONFIRMED
+        if self.connected and self.dialTime and self.setupMs is None:
+            setupUs = int((time.monotonic() - self.dialTime) * 1000000)
+            self.setupMs = round(setupUs / 1000, 1)
+            self.setupLatency.record(setupUs)
+            logging.info(f"Call {self.watchdogData.name} confirmed {self.setupMs} ms after dialing")
         if self.chat:
             self.chat.updateCallState(self, ci)
 
@@ -300,14 +617,48 @@ class Call(pj.Call):
             return
         fmt = pj.MediaFormatAudio()
         fmt.type = pj.PJMEDIA_TYPE_AUDIO
-        fmt.clockRate = CLOCK_RATE
+        fmt.clockRate = self.clockRate
         fmt.channelCount = CHANNEL_COUNT
         fmt.bitsPerSample = BITS_PER_SAMPLE
-        fmt.frameTimeUsec = FRAME_TIME_USEC
-
+        fmt.frameTimeUsec = self.frameTimeUsec
+
+        frameSize = Reframer.frameSizeOf(fmt.clockRate, fmt.frameTimeUsec, fmt.channelCount, fmt.bitsPerSample)
+        recorder = None
+        if self.playbackFile:
+            recorder = Recorder(os.path.join(SHARED_VOLUME_PATH, self.playbackFile), fmt.clockRate, fmt.bitsPerSample,
+                                frameSize, stereo=self.recordingStereo, maxBytes=self.recordingMaxBytes,
+                                maxSeconds=self.recordingMaxSec)
+        resampler = None
+        inputRate = self.inputSampleRate or fmt.clockRate
+        if inputRate != fmt.clockRate or self.inputChannels != CHANNEL_COUNT or self.inputFormat != Resampler.S16:
+            resampler = Resampler(inputRate, fmt.clockRate, self.inputChannels, self.inputFormat, fmt.frameTimeUsec)
+            logging.info(f"Downstream PCM is adapted from {inputRate} Hz, {self.inputChannels} channel(s), "
+                         f"{self.inputFormat} to {fmt.clockRate} Hz mono s16")
+        concealer = Concealer(fmt.clockRate, frameSize, self.concealRepeatMs) if self.concealment else None
+        vads = {}
+        for direction in (VoiceActivityDetector.UPSTREAM, VoiceActivityDetector.DOWNSTREAM):
+            if VoiceActivityDetector.applies(self.vadMode, direction):
+                # Thinning only makes sense upstream, pjsip handles the silence periods of the call itself
+                keepEvery = self.vadKeepEvery if direction == VoiceActivityDetector.UPSTREAM else 0
+                vads[direction] = VoiceActivityDetector(self.vadThresholdDb, self.vadHangoverMs,
+                                                        self.frameTimeUsec // 1000, keepEvery)
+        upRing = downRing = None
+        if self.transport == SHM_TRANSPORT:
+            downRing = ShmRing(ringPath("down", self.downStreamPort), self.shmSlots, consumer=True)
+            if self.upStreamPort:
+                upRing = ShmRing(ringPath("up", self.upStreamPort), self.shmSlots)
         self.med_port = CustomMediaPort(watchdogData=self.watchdogData, upStreamPort=self.upStreamPort,
                                         downStreamPort=self.downStreamPort, useSniffer=self.useSniffer,
-                                        playbackFile=self.playbackFile, echoMode=self.echoMode)
+                                        recorder=recorder, echoMode=self.echoMode, frameSize=frameSize,
+                                        frameTimeMs=self.frameTimeUsec // 1000, jitterTargetMs=self.jitterTargetMs,
+                                        jitterMaxMs=self.jitterMaxMs, jitterPolicy=self.jitterPolicy,
+                                        recvBatchSize=self.recvBatchSize, recvTimeoutMs=self.recvTimeoutMs,
+                                        recvBufSize=self.recvBufSize, snifferBackend=self.snifferBackend,
+                                        resampler=resampler,
+                                        upstreamVad=vads.get(VoiceActivityDetector.UPSTREAM),
+                                        downstreamVad=vads.get(VoiceActivityDetector.DOWNSTREAM),
+                                        concealer=concealer, upRing=upRing, downRing=downRing,
+                                        busyPollUsec=self.busyPollUsec, threadTuning=self.threadTuning)
         self.med_port.createPort("med_port", fmt)
 
 
@@ -349,8 +700,13 @@ class Call(pj.Call):
                 if USE_CUSTOM_MEDIA:
                     # self.setCustomMedia(am)
                     self.createCustomMediaPort()
+                    self.checkStreamFormat(mi.index)
+                    self.audioMedia = am
                     am.startTransmit(self.med_port)
                     self.med_port.startTransmit(am)
+                    if self.dialTime and self.mediaSetupMs is None:
+                        self.mediaSetupMs = round((time.monotonic() - self.dialTime) * 1000, 1)
+                        logging.info(f"Call {self.watchdogData.name} media connected {self.mediaSetupMs} ms after dialing")
 
                 if not USE_CUSTOM_MEDIA:
                     ep.Endpoint.instance.audDevManager().getCaptureDevMedia().startTransmit(am)
@@ -367,6 +723,33 @@ class Call(pj.Call):
             self.chat.updateCallMediaState(self, ci)
             logging.info(f'Call Media state updateCallMediaState {ci}')
 
+    def checkStreamFormat(self, mediaIndex):
+        """
+        Logs the negotiated codec and warns when its clock rate, channels or ptime differ from the media
+        port format - the conference bridge then resamples or rebuffers every frame between the two
+        """
+        try:
+            info = self.getStreamInfo(mediaIndex)
+        except pj.Error as e:
+            logging.warning(f"Call {self.watchdogData.name}: no stream info: {e.info()}")
+            return
+        # The RTP clock rate of G.722 is 8000, the codec parameters have the real one
+        codec = info.codecParam.info
+        ptimeMs = codec.frameLen * info.codecParam.setting.frmPerPkt
+        self.codec = {"name": info.codecName, "clockRate": codec.clockRate, "channels": codec.channelCnt,
+                      "ptimeMs": ptimeMs}
+        logging.info(f"Call {self.watchdogData.name} negotiated {self.codec}")
+        conversions = []
+        if codec.clockRate != self.clockRate:
+            conversions.append(f"resampled from {codec.clockRate} Hz to {self.clockRate} Hz")
+        if codec.channelCnt != CHANNEL_COUNT:
+            conversions.append(f"mixed from {codec.channelCnt} channels to {CHANNEL_COUNT}")
+        if ptimeMs != self.frameTimeUsec // 1000:
+            conversions.append(f"rebuffered from {ptimeMs} ms to {self.frameTimeUsec // 1000} ms frames")
+        if conversions:
+            logging.warning(f"Call {self.watchdogData.name}: the media is " + ", ".join(conversions) +
+                            " by the conference bridge. Set --codecs and --codec-ptime-msec to match the port")
+
     def onInstantMessage(self, prm):
         # chat instance should have been initalized
         if not self.chat: return
@@ -0,0 +1,100 @@
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+
+class IpcClient:
+    """
+    Long lived connection to the external app socket. Messages are queued without blocking (the oldest
+    ones are dropped when the queue is full) and a dedicated thread sends them as newline delimited
+    JSON, batching whatever is queued and reconnecting with exponential backoff.
+    """
+    _instances = {}
+    _instancesLock = threading.Lock()
+
+    def __init__(self, path, maxQueued=200, maxBatch=50, minBackoffSec=0.5, maxBackoffSec=30, sendTimeoutSec=2):
+        self.path = path
+        self.maxBatch = maxBatch
+        self.minBackoffSec = minBackoffSec
+        self.maxBackoffSec = maxBackoffSec
+        self.sendTimeoutSec = sendTimeoutSec
+        self._messages = collections.deque(maxlen=maxQueued)
+        self._wakeup = threading.Event()
+        self._sock = None
+        self._backoffSec = minBackoffSec
+        self.messagesSent = 0
+        self.messagesDropped = 0
+        self.connects = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def instance(path):
+        """
+        Returns the client shared by all the calls of the process for that socket path
+        """
+        with IpcClient._instancesLock:
+            if path not in IpcClient._instances:
+                IpcClient._instances[path] = IpcClient(path)
+            return IpcClient._instances[path]
+
+    def send(self, message):
+        if len(self._messages) == self._messages.maxlen:
+            self.messagesDropped += 1
+        self._messages.append(json.dumps(message))
+        self._wakeup.set()
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            raise ConnectionError(f"socket {self.path} does not exist")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.sendTimeoutSec)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self.connects += 1
+        self._backoffSec = self.minBackoffSec
+        logging.info(f"Connected to the external app socket {self.path}")
+
+    def disconnect(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def run(self):
+        while True:
+            if not self._messages:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            if not self._sock:
+                try:
+                    self.connect()
+                except OSError as e:
+                    logging.error(f"Cannot connect to {self.path}: {e}. Retry in {self._backoffSec} sec, "
+                                  f"{len(self._messages)} messages queued")
+                    time.sleep(self._backoffSec)
+                    self._backoffSec = min(self._backoffSec * 2, self.maxBackoffSec)
+                    continue
+            batch = []
+            while self._messages and len(batch) < self.maxBatch:
+                batch.append(self._messages.popleft())
+            try:
+                self._sock.sendall(("\n".join(batch) + "\n").encode())
+                self.messagesSent += len(batch)
+            except OSError as e:
+                logging.error(f"Error on sending {len(batch)} messages to {self.path}: {e}")
+                self.disconnect()
+                # Sent again after reconnecting, unless newer messages pushed them out meanwhile
+                for message in reversed(batch):
+                    if len(self._messages) < self._messages.maxlen:
+                        self._messages.appendleft(message)
+                    else:
+                        self.messagesDropped += 1
@@ -0,0 +1,104 @@
+import collections
+import math
+import threading
+
+
+class JitterBuffer:
+    """
+    Bounded playout buffer between the downstream listener and the pjsip frame requests.
+    Playout starts once the target depth is reached (pre-roll) and starts over after an underrun.
+    """
+    DROP_OLDEST = "drop-oldest"
+    TIME_COMPRESS = "time-compress"
+    POLICIES = [DROP_OLDEST, TIME_COMPRESS]
+
+    DEFAULT_TARGET_MS = 80
+    DEFAULT_MAX_MS = 400
+    # With time compression a frame is skipped once the depth stayed above the target for that many requests
+    COMPRESS_AFTER_FRAMES = 25
+
+    def __init__(self, frameTimeMs, targetMs=DEFAULT_TARGET_MS, maxMs=DEFAULT_MAX_MS, policy=DROP_OLDEST):
+        assert policy in JitterBuffer.POLICIES, f"Unknown jitter buffer policy {policy}"
+        self.frameTimeMs = frameTimeMs
+        self.targetFrames = max(1, math.ceil(targetMs / frameTimeMs))
+        self.maxFrames = max(self.targetFrames + 1, math.ceil(maxMs / frameTimeMs))
+        self.policy = policy
+        self._frames = collections.deque()
+        self._lock = threading.Lock()
+        self._playing = False
+        self._aboveTargetCount = 0
+
+        self.framesIn = 0
+        self.framesOut = 0
+        self.overflowDrops = 0
+        self.compressDrops = 0
+        self.underruns = 0
+        self.maxDepth = 0
+
+    def put(self, frame):
+        with self._lock:
+            if len(self._frames) >= self.maxFrames:
+                self._frames.popleft()
+                self.overflowDrops += 1
+            self._frames.append(frame)
+            self.framesIn += 1
+            depth = len(self._frames)
+            if depth > self.maxDepth:
+                self.maxDepth = depth
+            if not self._playing and depth >= self.targetFrames:
+                self._playing = True
+
+    def get(self):
+        """
+        Returns the next frame to play or None while pre-rolling or on underrun
+        """
+        with self._lock:
+            if not self._playing:
+                return None
+            if not self._frames:
+                self.underruns += 1
+                self._playing = False
+                self._aboveTargetCount = 0
+                return None
+            if self.policy == JitterBuffer.TIME_COMPRESS:
+                self.compress()
+            self.framesOut += 1
+            return self._frames.popleft()
+
+    def compress(self):
+        if len(self._frames) <= self.targetFrames:
+            self._aboveTargetCount = 0
+            return
+        self._aboveTargetCount += 1
+        if self._aboveTargetCount >= JitterBuffer.COMPRESS_AFTER_FRAMES:
+            self._frames.popleft()
+            self.compressDrops += 1
+            self._aboveTargetCount = 0
+
+    def flush(self):
+        with self._lock:
+            self._frames.clear()
+            self._playing = False
+            self._aboveTargetCount = 0
+
+    def depth(self):
+        return len(self._frames)
+
+    def depthMs(self):
+        return len(self._frames) * self.frameTimeMs
+
+    def isPlaying(self):
+        return self._playing
+
+    def stats(self):
+        return {
+            "depthMs": self.depthMs(),
+            "targetMs": self.targetFrames * self.frameTimeMs,
+            "maxMs": self.maxFrames * self.frameTimeMs,
+            "maxDepthMs": self.maxDepth * self.frameTimeMs,
+            "framesIn": self.framesIn,
+            "framesOut": self.framesOut,
+            "overflowDrops": self.overflowDrops,
+            "compressDrops": self.compressDrops,
+            "underruns": self.underruns,
+        }
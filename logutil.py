@@ -0,0 +1,76 @@
+import atexit
+import logging
+import queue
+import time
+from logging import handlers
+
+
+class DroppingQueueHandler(handlers.QueueHandler):
+    """
+    Hands the records to the listener thread without blocking and without formatting them: the message
+    is only built by the listener, off the thread that logged it. Records are dropped when the queue is full.
+    """
+
+    def __init__(self, maxRecords):
+        super().__init__(queue.Queue(maxRecords))
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def startQueueLogging(level, logHandlers, maxRecords=10000):
+    """
+    Routes the root logger through a DroppingQueueHandler to the given handlers, served by a QueueListener thread
+    """
+    queueHandler = DroppingQueueHandler(maxRecords)
+    listener = handlers.QueueListener(queueHandler.queue, *logHandlers, respect_handler_level=True)
+    root = logging.getLogger('')
+    root.setLevel(level)
+    root.addHandler(queueHandler)
+    listener.start()
+    # Flushes the queued records on exit
+    atexit.register(listener.stop)
+    return queueHandler
+
+
+class HotPathLog:
+    """
+    Logging from the media callbacks: a disabled level costs one isEnabledFor call, only every Nth event
+    is logged and at most one per interval, with a count of the events skipped since the last one.
+    The message is formatted lazily from its arguments.
+    """
+
+    def __init__(self, level=logging.DEBUG, every=1, minIntervalSec=0.0, logger=None):
+        self.logger = logger or logging.getLogger('')
+        self.level = level
+        self.every = max(1, every)
+        self.minIntervalSec = minIntervalSec
+        self._count = 0
+        self._skipped = 0
+        self._lastTime = 0.0
+
+    def log(self, msg, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self._count += 1
+        if self._count % self.every:
+            self._skipped += 1
+            return
+        if self.minIntervalSec:
+            now = time.monotonic()
+            if now - self._lastTime < self.minIntervalSec:
+                self._skipped += 1
+                return
+            self._lastTime = now
+        if self._skipped:
+            msg += " (%d skipped)"
+            args += (self._skipped,)
+            self._skipped = 0
+        self.logger.log(self.level, msg, *args)
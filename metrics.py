@@ -0,0 +1,164 @@
+import http.server
+import logging
+import threading
+
+
+class Histogram:
+    """
+    HDR style log-linear histogram of integer values (microseconds by convention). Every power of two
+    is split into 2^SUB_BUCKET_BITS buckets, which keeps the relative error under 25% with a recording
+    cost of a bit_length call and a list increment.
+    """
+    SUB_BUCKET_BITS = 2
+    # Values up to 2^OCTAVES - about 67 seconds in microseconds
+    OCTAVES = 26
+    # The exported le bounds: the octave boundaries, where the HDR buckets end exactly. Always the same set,
+    # so the series stay continuous for rate() and histogram_quantile()
+    EXPORT_BOUNDS = [(1 << octave) - 1 for octave in range(4, OCTAVES + 1)]
+
+    def __init__(self):
+        self.subBuckets = 1 << Histogram.SUB_BUCKET_BITS
+        self.counts = [0] * ((Histogram.OCTAVES + 1) * self.subBuckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def bucketIndex(self, value):
+        if value < self.subBuckets:
+            return max(0, value)
+        octave = value.bit_length() - Histogram.SUB_BUCKET_BITS
+        index = (octave * self.subBuckets) + ((value >> (octave - 1)) - self.subBuckets)
+        return min(index, len(self.counts) - 1)
+
+    def bucketUpperBound(self, index):
+        if index < self.subBuckets:
+            return index
+        octave, sub = divmod(index, self.subBuckets)
+        return ((self.subBuckets + sub + 1) << (octave - 1)) - 1
+
+    def record(self, value):
+        value = int(value)
+        self.counts[self.bucketIndex(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bucketUpperBound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        A copy of the histogram, to get the values recorded after it from since()
+        """
+        copy = Histogram()
+        copy.counts = list(self.counts)
+        copy.count = self.count
+        copy.sum = self.sum
+        copy.max = self.max
+        return copy
+
+    def since(self, snapshot):
+        """
+        Histogram of the values recorded after the snapshot. Its max is the upper bound of their highest bucket.
+        """
+        delta = Histogram()
+        delta.counts = [count - previous for count, previous in zip(self.counts, snapshot.counts)]
+        delta.count = self.count - snapshot.count
+        delta.sum = self.sum - snapshot.sum
+        highest = max((index for index, count in enumerate(delta.counts) if count), default=None)
+        delta.max = min(self.bucketUpperBound(highest), self.max) if highest is not None else 0
+        return delta
+
+    def summary(self):
+        return {"count": self.count, "mean": round(self.sum / self.count, 1) if self.count else 0,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "p999": self.percentile(99.9), "max": self.max}
+
+
+class Registry:
+    """
+    Holds the metric series of the process and renders them in the Prometheus text format.
+    Counters and gauges are read through callables at scrape time, so the audio path only updates
+    the plain attributes it already has.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _series(self, name, kind, help, labels, value):
+        with self._lock:
+            metric = self._metrics.setdefault(name, {"kind": kind, "help": help, "series": {}})
+            key = tuple(sorted(labels.items()))
+            return metric["series"].setdefault(key, value)
+
+    def histogram(self, name, help, labels):
+        return self._series(name, "histogram", help, labels, Histogram())
+
+    def counterFunc(self, name, help, labels, func):
+        self._series(name, "counter", help, labels, func)
+
+    def gaugeFunc(self, name, help, labels, func):
+        self._series(name, "gauge", help, labels, func)
+
+    @staticmethod
+    def formatLabels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = [(name, dict(metric, series=dict(metric["series"]))) for name, metric in self._metrics.items()]
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for key, value in metric["series"].items():
+                if metric["kind"] == "histogram":
+                    cumulative = 0
+                    index = 0
+                    for bound in Histogram.EXPORT_BOUNDS:
+                        while index < len(value.counts) and value.bucketUpperBound(index) <= bound:
+                            cumulative += value.counts[index]
+                            index += 1
+                        lines.append(f"{name}_bucket{Registry.formatLabels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{Registry.formatLabels(key, [('le', '+Inf')])} {value.count}")
+                    lines.append(f"{name}_sum{Registry.formatLabels(key)} {value.sum}")
+                    lines.append(f"{name}_count{Registry.formatLabels(key)} {value.count}")
+                else:
+                    lines.append(f"{name}{Registry.formatLabels(key)} {value()}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Metrics are served on http://{host}:{port}/metrics")
+        return server
+
+
+REGISTRY = Registry()
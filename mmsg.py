@@ -0,0 +1,198 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+
+MSG_WAITFORONE = 0x10000
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+# Room for one cmsghdr with a struct timespec
+CONTROL_BUFFER_SIZE = 64
+CMSG_HEADER = struct.Struct("Nii")
+TIMESPEC = struct.Struct("qq")
+
+
+class IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(IoVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+def _loadLibc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.recvmmsg.restype = ctypes.c_int
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _loadLibc()
+
+
+def isSupported():
+    return _libc is not None
+
+
+class MMsgReceiver:
+    """
+    Receives up to batchSize datagrams per syscall into a ring of preallocated buffers.
+    The returned memoryviews point into the ring: they stay valid for ringBatches - 1 further
+    receive calls, so a consumer has to copy whatever it keeps longer.
+    When recvmmsg is not available, recv_into on the same buffers is used instead.
+    With timestamps the kernel receive time (SO_TIMESTAMPNS, CLOCK_REALTIME nanoseconds) of every
+    datagram is returned along with it.
+    """
+
+    def __init__(self, sock, batchSize, bufferSize, ringBatches=2, timestamps=False):
+        self.sock = sock
+        self.timestamps = timestamps
+        if timestamps:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        self.batchSize = batchSize
+        self.bufferSize = bufferSize
+        self._buffers = [bytearray(bufferSize) for i in range(batchSize * ringBatches)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        self._batches = []
+        self._cBuffers = []
+        self._nextBatch = 0
+        if isSupported():
+            for batch in range(ringBatches):
+                buffers = self._buffers[batch * batchSize:(batch + 1) * batchSize]
+                iovecs = (IoVec * batchSize)()
+                msgs = (MMsgHdr * batchSize)()
+                controls = (ctypes.c_char * (CONTROL_BUFFER_SIZE * batchSize))() if timestamps else None
+                for i, buffer in enumerate(buffers):
+                    cBuffer = (ctypes.c_char * bufferSize).from_buffer(buffer)
+                    self._cBuffers.append(cBuffer)
+                    iovecs[i].iov_base = ctypes.addressof(cBuffer)
+                    iovecs[i].iov_len = bufferSize
+                    msgs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+                    msgs[i].msg_hdr.msg_iovlen = 1
+                    if timestamps:
+                        msgs[i].msg_hdr.msg_control = ctypes.addressof(controls) + i * CONTROL_BUFFER_SIZE
+                self._batches.append((iovecs, msgs, controls))
+
+    def receive(self, flags=MSG_WAITFORONE):
+        """
+        Returns the list of the received datagrams and the list of their receive timestamps
+        (None without timestamps)
+        """
+        batch = self._nextBatch
+        self._nextBatch = (batch + 1) % (len(self._buffers) // self.batchSize)
+        views = self._views[batch * self.batchSize:(batch + 1) * self.batchSize]
+        if not self._batches:
+            return self._receiveInto(views)
+
+        iovecs, msgs, controls = self._batches[batch]
+        if controls is not None:
+            for i in range(self.batchSize):
+                msgs[i].msg_hdr.msg_controllen = CONTROL_BUFFER_SIZE
+        count = _libc.recvmmsg(self.sock.fileno(), msgs, self.batchSize, flags, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EINTR):
+                return [], None
+            raise OSError(err, f"recvmmsg failed: {errno.errorcode.get(err, err)}")
+        frames = [views[i][:msgs[i].msg_len] for i in range(count)]
+        if controls is None:
+            return frames, None
+        return frames, [MMsgReceiver.controlTimestamp(controls, i * CONTROL_BUFFER_SIZE, msgs[i].msg_hdr.msg_controllen)
+                        for i in range(count)]
+
+    @staticmethod
+    def controlTimestamp(control, offset, length):
+        if length < CMSG_HEADER.size + TIMESPEC.size:
+            return None
+        cmsgLen, level, cmsgType = CMSG_HEADER.unpack_from(control, offset)
+        if level != socket.SOL_SOCKET or cmsgType != SCM_TIMESTAMPNS:
+            return None
+        sec, nsec = TIMESPEC.unpack_from(control, offset + CMSG_HEADER.size)
+        return sec * 1000000000 + nsec
+
+    def _receiveInto(self, views):
+        frames = []
+        timestamps = [] if self.timestamps else None
+        try:
+            flags = 0
+            for view in views:
+                if self.timestamps:
+                    size, ancdata, msgFlags, addr = self.sock.recvmsg_into([view], CONTROL_BUFFER_SIZE, flags)
+                    timestamps.append(next((TIMESPEC.unpack_from(data)[0] * 1000000000 + TIMESPEC.unpack_from(data)[1]
+                                            for level, cmsgType, data in ancdata
+                                            if level == socket.SOL_SOCKET and cmsgType == SCM_TIMESTAMPNS), None))
+                else:
+                    size = self.sock.recv_into(view, 0, flags)
+                frames.append(view[:size])
+                # Only the first datagram is waited for
+                flags = socket.MSG_DONTWAIT
+        except BlockingIOError:
+            pass
+        return frames, timestamps
+
+
+class MMsgSender:
+    """
+    Sends a batch of bytes objects on a connected datagram socket with one sendmmsg call,
+    or with a send per datagram when sendmmsg is not available.
+    """
+
+    def __init__(self, sock, batchSize):
+        self.sock = sock
+        self.batchSize = batchSize
+        self._iovecs = (IoVec * batchSize)()
+        self._msgs = (MMsgHdr * batchSize)()
+        for i in range(batchSize):
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+
+    def send(self, datagrams):
+        """
+        Returns the number of the sent datagrams, fewer than given when the socket buffer of a non
+        blocking socket filled up after part of them went out. Errors before anything was sent raise.
+        """
+        if not isSupported():
+            for i, data in enumerate(datagrams):
+                try:
+                    self.sock.send(data)
+                except BlockingIOError:
+                    if i:
+                        return i
+                    raise
+            return len(datagrams)
+
+        sent = 0
+        while sent < len(datagrams):
+            batch = datagrams[sent:sent + self.batchSize]
+            for i, data in enumerate(batch):
+                # c_char_p points to the internal buffer of the bytes object, no copy is made
+                self._iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+                self._iovecs[i].iov_len = len(data)
+            count = _libc.sendmmsg(self.sock.fileno(), self._msgs, len(batch), 0)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if sent and err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return sent
+                raise OSError(err, f"sendmmsg failed: {errno.errorcode.get(err, err)}")
+            sent += count
+        return sent
@@ -0,0 +1,74 @@
+import logging
+import mmap
+import select
+import struct
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_block_desc / tpacket_hdr_v1 offsets
+BLOCK_STATUS_OFFSET = 8
+BLOCK_NUM_PKTS_OFFSET = 12
+BLOCK_FIRST_PKT_OFFSET = 16
+# struct tpacket3_hdr offsets
+PKT_NEXT_OFFSET = 0
+PKT_SEC_OFFSET = 4
+PKT_MAC_OFFSET = 24
+# struct sockaddr_ll follows the aligned tpacket3_hdr, sll_pkttype is its 11th byte
+PKT_SLL_PKTTYPE_OFFSET = 48 + 10
+
+
+class PacketRing:
+    """
+    PACKET_MMAP (TPACKET_V3) receive ring. The kernel fills blocks of packets in a memory
+    region shared with the process, which walks the ready blocks without a syscall per packet
+    and only polls when it caught up with the kernel.
+    """
+
+    def __init__(self, sock, blockSize=1 << 17, blockCount=16, frameSize=2048, retireTimeoutMs=2):
+        self.sock = sock
+        self.blockSize = blockSize
+        self.blockCount = blockCount
+        self.retireTimeoutMs = retireTimeoutMs
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        frameCount = blockSize * blockCount // frameSize
+        req = struct.pack("IIIIIII", blockSize, blockCount, frameSize, frameCount, retireTimeoutMs, 0, 0)
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+        self.ring = mmap.mmap(sock.fileno(), blockSize * blockCount, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.view = memoryview(self.ring)
+        self.poller = select.poll()
+        self.poller.register(sock, select.POLLIN | select.POLLERR)
+        logging.info(f"Created TPACKET_V3 ring: {blockCount} blocks of {blockSize} bytes, "
+                     f"block retire timeout {retireTimeoutMs} ms")
+
+    def run(self, packetProcessor, pollTimeoutMs=1000):
+        """
+        Passes every captured packet to packetProcessor(packet, pktType, timestampNs) as a memoryview into
+        the ring, with the kernel capture time in CLOCK_REALTIME nanoseconds.
+        The view is only valid during the call - the block is returned to the kernel right after.
+        """
+        ring = self.ring
+        view = self.view
+        block = 0
+        while True:
+            blockOffset = block * self.blockSize
+            status, = struct.unpack_from("I", ring, blockOffset + BLOCK_STATUS_OFFSET)
+            if not status & TP_STATUS_USER:
+                self.poller.poll(pollTimeoutMs)
+                continue
+            numPackets, packetOffset = struct.unpack_from("II", ring, blockOffset + BLOCK_NUM_PKTS_OFFSET)
+            packetOffset += blockOffset
+            for i in range(numPackets):
+                nextOffset, = struct.unpack_from("I", ring, packetOffset + PKT_NEXT_OFFSET)
+                sec, nsec, snapLen = struct.unpack_from("III", ring, packetOffset + PKT_SEC_OFFSET)
+                macOffset, = struct.unpack_from("H", ring, packetOffset + PKT_MAC_OFFSET)
+                pktType = ring[packetOffset + PKT_SLL_PKTTYPE_OFFSET]
+                start = packetOffset + macOffset
+                packetProcessor(view[start:start + snapLen], pktType, sec * 1000000000 + nsec)
+                packetOffset += nextOffset
+            struct.pack_into("I", ring, blockOffset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            block = (block + 1) % self.blockCount
@@ -0,0 +1,122 @@
+"""
+Local stand-in for the parts of pjsua2 (and of the pygui application/endpoint modules) that the media
+port uses, so CustomMediaPort can be benchmarked and soak tested without pjsip or a SIP server.
+Only the Python side is exercised: the benchmark drives the port callbacks itself.
+"""
+import collections
+import sys
+import threading
+import types
+
+PJSUA_INVALID_ID = -1
+PJMEDIA_TYPE_NONE = 0
+PJMEDIA_TYPE_AUDIO = 1
+PJSIP_INV_STATE_CONFIRMED = 5
+PJSUA_CALL_MEDIA_NONE = 0
+PJSUA_CALL_MEDIA_ACTIVE = 1
+PJSUA_CALL_MEDIA_REMOTE_HOLD = 2
+PJSUA_CALL_MEDIA_ERROR = 4
+
+
+class Error(Exception):
+    def info(self):
+        return str(self)
+
+
+class ByteVector(bytearray):
+    """
+    std::vector<unsigned char>: built empty, with a size or from a buffer, appended to byte by byte
+    """
+
+
+class MediaFrame:
+    def __init__(self):
+        self.type = PJMEDIA_TYPE_NONE
+        self.buf = ByteVector()
+        self.size = 0
+
+
+class MediaFormatAudio:
+    def __init__(self):
+        self.type = PJMEDIA_TYPE_NONE
+        self.clockRate = 0
+        self.channelCount = 0
+        self.bitsPerSample = 0
+        self.frameTimeUsec = 0
+
+
+class AudioMedia:
+    def startTransmit(self, sink):
+        pass
+
+    def stopTransmit(self, sink):
+        pass
+
+
+class AudioMediaPort(AudioMedia):
+    def __init__(self):
+        self.name = None
+        self.format = None
+
+    def createPort(self, name, fmt):
+        self.name = name
+        self.format = fmt
+
+
+class Call:
+    def __init__(self, acc=None, callId=PJSUA_INVALID_ID):
+        self.acc = acc
+        self.callId = callId
+
+
+class PendingJob:
+    def execute(self, isPending):
+        pass
+
+
+class Endpoint:
+    """
+    The event handling of the pjsua2 endpoint without worker threads: libHandleEvents runs the jobs
+    posted by other threads first, then waits for network events up to the timeout - a job posted
+    during the wait runs on the next call. deliverEvent stands in for a SIP message arriving, which
+    ends the wait at once.
+    """
+    instance = None
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = collections.deque()
+        self._jobs = collections.deque()
+
+    def utilAddPendingJob(self, job):
+        self._jobs.append(job)
+
+    def deliverEvent(self, callback):
+        with self._condition:
+            self._events.append(callback)
+            self._condition.notify()
+
+    def libHandleEvents(self, msecTimeout):
+        while self._jobs:
+            self._jobs.popleft().execute(False)
+        with self._condition:
+            if not self._events and msecTimeout > 0:
+                self._condition.wait(msecTimeout / 1000)
+            events = list(self._events)
+            self._events.clear()
+        for callback in events:
+            callback()
+        return len(events)
+
+
+def install():
+    """
+    Registers the stand-in modules, so the following imports of pjsua2, application and endpoint get them
+    """
+    sys.modules["pjsua2"] = sys.modules[__name__]
+    application = types.ModuleType("application")
+    application.main = lambda: None
+    sys.modules["application"] = application
+    endpoint = types.ModuleType("endpoint")
+    endpoint.Endpoint = Endpoint
+    sys.modules["endpoint"] = endpoint
@@ -60,26 +60,7 @@ def processData(data):
     print(f"{time.time()} Got data. Len is {len(data)}")
 
 
-def playFile(fileName, frameSize, framePeriod):
-    data = []
-    f = open(fileName, "rb")
-    data.append(f.read(frameSize))
-    chunk = f.read(frameSize)
-    while chunk:
-        data.append(chunk)
-        chunk = f.read(frameSize)
-    port = 6700
-    upStreamSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    print(f"Created upstream socket. Port {port}")
-    i = 0
-    for frame in data:
-        upStreamSocket.sendto(frame, ("0.0.0.0", port))
-        time.sleep(framePeriod - 0.001)
-        print(f"Sent packet {i}")
-        i += 1
-    print ("============= Done ===============")
-# playFile("/home/me/work/du-sip-client/playback")
-playFile("/home/me/Downloads/playback", 640 * 2, 0.040)
+# Test streams are sent with trafficgen.py, e.g. python3 trafficgen.py --file playback --ports 6700 --frame-length-msec 40
 # sniffer = UdpSniffer(6600)
 # sniffer.read(processData)
 # sniffer.sniff(processData)
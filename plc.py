@@ -0,0 +1,111 @@
+import collections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Concealer:
+    """
+    Packet loss concealment of the 16 bit mono frames handed to pjsip. When the jitter buffer runs dry
+    the last pitch period of the played audio is repeated while fading out into comfort noise at the
+    level of the recent noise floor, and the first real frame afterwards is cross-faded with the
+    continuation of the concealment, so an underrun is heard as a short smear instead of a dropout.
+    """
+    DEFAULT_REPEAT_MS = 60
+    MIN_PITCH_HZ = 60
+    MAX_PITCH_HZ = 400
+    CROSS_FADE_MS = 5
+    # Frame levels kept for the noise floor estimate
+    NOISE_FLOOR_FRAMES = 50
+    MAX_NOISE_RMS = 300.0
+
+    def __init__(self, clockRate, frameSize, repeatMs=DEFAULT_REPEAT_MS):
+        if np is None:
+            raise RuntimeError("The packet loss concealment needs numpy")
+        self.frameSamples = frameSize // 2
+        self.minLag = clockRate // Concealer.MAX_PITCH_HZ
+        self.maxLag = clockRate // Concealer.MIN_PITCH_HZ
+        self.historySamples = max(self.frameSamples, 2 * self.maxLag)
+        self.repeatSamples = clockRate * repeatMs // 1000
+        self.crossFadeSamples = min(self.frameSamples, clockRate * Concealer.CROSS_FADE_MS // 1000)
+        self._rng = np.random.default_rng()
+        self._levels = collections.deque(maxlen=Concealer.NOISE_FLOOR_FRAMES)
+        self.concealedFrames = 0
+        self.noiseFrames = 0
+        self.crossFades = 0
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(0, dtype=np.float32)
+        self._period = None
+        self._position = 0
+        self._concealedSamples = 0
+
+    def played(self, frame):
+        """
+        Takes the bytes of a real frame about to be played and returns them, cross-faded when they follow
+        concealed frames
+        """
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        if self._period is not None:
+            fade = self.crossFadeSamples
+            ramp = np.linspace(0.0, 1.0, fade, endpoint=False, dtype=np.float32)
+            synthesized = self.synthesize(fade, advance=False)
+            samples[:fade] = samples[:fade] * ramp + synthesized * (1.0 - ramp)
+            frame = np.clip(np.rint(samples), -32768, 32767).astype("<i2").tobytes()
+            self._period = None
+            self._concealedSamples = 0
+            self.crossFades += 1
+        self._levels.append(float(np.sqrt(np.dot(samples, samples) / len(samples))) if len(samples) else 0.0)
+        self._history = np.concatenate((self._history, samples))[-self.historySamples:]
+        return frame
+
+    def conceal(self):
+        """
+        Returns the bytes of a replacement frame, or None when nothing was played yet to conceal from
+        """
+        if len(self._history) < self.historySamples:
+            return None
+        if self._period is None:
+            self._period = self.lastPitchPeriod()
+            self._position = 0
+        if self._concealedSamples >= self.repeatSamples:
+            self.noiseFrames += 1
+        self.concealedFrames += 1
+        samples = self.synthesize(self.frameSamples, advance=True)
+        return np.clip(np.rint(samples), -32768, 32767).astype("<i2").tobytes()
+
+    def lastPitchPeriod(self):
+        """
+        The last period of the history, the lag with the highest normalized autocorrelation
+        """
+        maxLag = self.maxLag
+        segment = self._history[-2 * maxLag:]
+        window = segment[maxLag:]
+        # correlations[k] and energies[k] belong to the lag maxLag - k
+        correlations = np.correlate(segment, window, mode="valid")
+        squares = np.concatenate(([0.0], np.cumsum(segment.astype(np.float64) ** 2)))
+        energies = squares[maxLag:] - squares[:-maxLag]
+        candidates = slice(0, maxLag - self.minLag + 1)
+        scores = correlations[candidates] / np.sqrt(np.maximum(energies[candidates], 1.0))
+        bestLag = maxLag - int(np.argmax(scores))
+        return self._history[-bestLag:].copy()
+
+    def synthesize(self, count, advance):
+        period = self._period
+        indexes = (self._position + np.arange(count)) % len(period)
+        # Gain of the repetition falls linearly to zero over the repeat time, the comfort noise fills the rest
+        elapsed = self._concealedSamples + np.arange(count, dtype=np.float32)
+        gain = np.clip(1.0 - elapsed / self.repeatSamples, 0.0, 1.0)
+        noiseRms = min(min(self._levels) if self._levels else 0.0, Concealer.MAX_NOISE_RMS)
+        noise = self._rng.standard_normal(count).astype(np.float32) * noiseRms
+        samples = period[indexes] * gain + noise * (1.0 - gain)
+        if advance:
+            self._position = (self._position + count) % len(period)
+            self._concealedSamples += count
+        return samples
+
+    def stats(self):
+        return {"concealedFrames": self.concealedFrames, "noiseFrames": self.noiseFrames, "crossFades": self.crossFades}
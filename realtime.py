@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+
+
+class ThreadTuning:
+    """
+    CPU affinity and SCHED_FIFO priority of the latency critical threads. Every thread applies it to
+    itself - on Linux pid 0 of sched_setaffinity and sched_setscheduler is the calling thread - so the
+    pjsip media thread is tuned from its first frame callback. Without CAP_SYS_NICE or an RLIMIT_RTPRIO
+    the threads keep the default scheduling, which is logged once.
+
+    The threads do not share a CPU when there are enough of them: the media thread gets the first CPU
+    to itself and the downstream and upstream threads take turns on the others. With a single CPU a
+    downstream thread busy polling its socket is left unpinned, so it never spins on the media CPU.
+    """
+    MEDIA = "media"
+    DOWNSTREAM = "downstream"
+    UPSTREAM = "upstream"
+
+    def __init__(self, cpus=None, priority=0, busyPoll=False):
+        self.cpus = []
+        if cpus:
+            # A supervisor pins its workers, the CPUs outside that set cannot be used
+            allowed = os.sched_getaffinity(0)
+            self.cpus = [cpu for cpu in dict.fromkeys(cpus) if cpu in allowed]
+            skipped = sorted(set(cpus) - allowed)
+            if not self.cpus:
+                logging.warning(f"Thread pinning skipped: none of the CPUs {sorted(set(cpus))} is available "
+                                f"to the process, which may run on {sorted(allowed)}")
+            elif skipped:
+                logging.warning(f"Thread pinning skips the CPUs {skipped}, not available to the process")
+        self.priority = priority
+        self.busyPoll = busyPoll
+        self.tunedThreads = {}
+        self._warned = set()
+        self._nextCpu = 0
+        self._lock = threading.Lock()
+
+    def cpuFor(self, role):
+        if not self.cpus:
+            return None
+        if len(self.cpus) == 1:
+            if role == ThreadTuning.DOWNSTREAM and self.busyPoll:
+                return None
+            return self.cpus[0]
+        if role == ThreadTuning.MEDIA:
+            return self.cpus[0]
+        with self._lock:
+            cpu = self.cpus[1 + self._nextCpu % (len(self.cpus) - 1)]
+            self._nextCpu += 1
+        return cpu
+
+    def ensure(self, name, role):
+        # Cheap enough for the frame callbacks - a dict lookup once the thread is tuned
+        if threading.get_ident() not in self.tunedThreads:
+            self.apply(name, role)
+
+    def apply(self, name, role):
+        applied = []
+        cpu = self.cpuFor(role)
+        if cpu is not None:
+            try:
+                os.sched_setaffinity(0, {cpu})
+                applied.append(f"CPU {cpu}")
+            except OSError as e:
+                self.warnOnce("affinity", f"Cannot pin thread {name} to CPU {cpu}: {e}")
+        elif self.cpus:
+            logging.info(f"Thread {name} is not pinned, its busy polling would compete with the media thread "
+                         f"on CPU {self.cpus[0]}")
+        if self.priority:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+                applied.append(f"SCHED_FIFO {self.priority}")
+            except OSError as e:
+                self.warnOnce("priority", f"Cannot set SCHED_FIFO {self.priority} for thread {name}, "
+                                          f"it needs CAP_SYS_NICE: {e}")
+        self.tunedThreads[threading.get_ident()] = name
+        if applied:
+            logging.info(f"Thread {name} (tid {threading.get_native_id()}): {', '.join(applied)}")
+
+    def warnOnce(self, kind, message):
+        if kind not in self._warned:
+            self._warned.add(kind)
+            logging.warning(message)
@@ -0,0 +1,152 @@
+import collections
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+
+
+class Recorder:
+    """
+    Records the call audio to WAV files from a background thread. The media callbacks only append
+    frames to a bounded deque; the writer thread converts them, collects them in a large buffer and
+    writes it with a single call, so a slow disk never delays the audio path. Frames are dropped
+    (and counted) when the writer falls too far behind.
+    Mono recording holds the received (SIP to Streamer) direction, stereo recording holds the received
+    direction in the left channel and the sent (Streamer to SIP) direction in the right one.
+    """
+    RX = 0
+    TX = 1
+
+    WAV_HEADER_SIZE = 44
+    # Frames of one direction waiting for the other one before silence is recorded instead
+    MAX_DIRECTION_SKEW = 5
+
+    def __init__(self, path, clockRate, bitsPerSample, frameSize, stereo=False, maxBytes=0, maxSeconds=0,
+                 bufferSize=1 << 20, maxPendingFrames=500):
+        assert not stereo or bitsPerSample == 16, "Stereo recording supports only 16 bit samples"
+        base, ext = os.path.splitext(path)
+        self.base = base
+        self.ext = ext if ext else ".wav"
+        self.clockRate = clockRate
+        self.bitsPerSample = bitsPerSample
+        self.frameSize = frameSize
+        self.channels = 2 if stereo else 1
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.bufferSize = bufferSize
+        self.silence = bytes(frameSize)
+        self._frames = collections.deque(maxlen=maxPendingFrames)
+        self._rx = collections.deque()
+        self._tx = collections.deque()
+        self._buffer = bytearray()
+        self._wakeup = threading.Event()
+        self._sleeping = False
+        self._file = None
+        self._fileIndex = 0
+        self._fileStartTime = 0
+        self._dataBytes = 0
+        self.framesDropped = 0
+        self.filesWritten = 0
+        self.openFile()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, frame):
+        """
+        Called from the media callbacks - never blocks. frame is bytes, a pj.ByteVector copy owned by the
+        caller or None for a frame of silence.
+        """
+        if self.channels == 1 and direction == Recorder.TX:
+            # Not recorded in mono, so not queued either
+            return
+        if len(self._frames) == self._frames.maxlen:
+            self.framesDropped += 1
+        self._frames.append((direction, frame))
+        if self._sleeping:
+            self._wakeup.set()
+
+    def fileName(self):
+        if self.maxBytes or self.maxSeconds:
+            return f"{self.base}-{time.strftime('%Y%m%d-%H%M%S')}-{self._fileIndex:04d}{self.ext}"
+        return f"{self.base}{self.ext}"
+
+    def openFile(self):
+        fileName = self.fileName()
+        self._file = open(fileName, "wb", buffering=0)
+        self._file.write(self.wavHeader(0))
+        self._dataBytes = 0
+        self._fileStartTime = time.monotonic()
+        self._fileIndex += 1
+        logging.info(f"Recording to {fileName}, {self.clockRate} Hz, {self.channels} channel(s)")
+
+    def closeFile(self):
+        self.flush()
+        self._file.close()
+        self.filesWritten += 1
+
+    def wavHeader(self, dataBytes):
+        blockAlign = self.channels * self.bitsPerSample // 8
+        return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + dataBytes, b"WAVE", b"fmt ", 16, 1, self.channels,
+                           self.clockRate, self.clockRate * blockAlign, blockAlign, self.bitsPerSample,
+                           b"data", dataBytes)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._file.write(self._buffer)
+        self._dataBytes += len(self._buffer)
+        self._buffer.clear()
+        # Keep the header valid after every flush, so the file is playable even if the client is killed
+        self._file.seek(0)
+        self._file.write(self.wavHeader(self._dataBytes))
+        self._file.seek(0, os.SEEK_END)
+
+    def rotateIfNeeded(self):
+        tooBig = self.maxBytes and self._dataBytes + len(self._buffer) >= self.maxBytes
+        tooOld = self.maxSeconds and time.monotonic() - self._fileStartTime >= self.maxSeconds
+        if tooBig or tooOld:
+            self.closeFile()
+            self.openFile()
+
+    def run(self):
+        while True:
+            if not self._frames:
+                self._sleeping = True
+                self._wakeup.clear()
+                if not self._frames and not self._wakeup.wait(1):
+                    # Idle - write out what was collected so far
+                    self.flush()
+                    self.rotateIfNeeded()
+                self._sleeping = False
+                continue
+            while self._frames:
+                direction, frame = self._frames.popleft()
+                data = self.silence if frame is None else (frame if isinstance(frame, bytes) else bytes(frame))
+                if self.channels == 1:
+                    if direction == Recorder.RX:
+                        self._buffer += data
+                else:
+                    (self._rx if direction == Recorder.RX else self._tx).append(data)
+                    self.interleave()
+            if len(self._buffer) >= self.bufferSize:
+                self.flush()
+            # Checked after every batch, a low bit rate would take long to fill the buffer
+            self.rotateIfNeeded()
+
+    def interleave(self):
+        while self._rx or self._tx:
+            if not self._rx or not self._tx:
+                waiting = self._rx or self._tx
+                if len(waiting) <= Recorder.MAX_DIRECTION_SKEW:
+                    return
+            left = array("h", self._rx.popleft() if self._rx else self.silence)
+            right = array("h", self._tx.popleft() if self._tx else self.silence)
+            samples = max(len(left), len(right))
+            left.extend(array("h", bytes(2 * (samples - len(left)))))
+            right.extend(array("h", bytes(2 * (samples - len(right)))))
+            stereo = array("h", bytes(4 * samples))
+            stereo[0::2] = left
+            stereo[1::2] = right
+            self._buffer += stereo.tobytes()
@@ -0,0 +1,83 @@
+import logging
+import time
+
+
+class CallRecovery:
+    """
+    Graded recovery of one call. Every fault episode walks the ladder of its fault class: each step
+    gets a grace period to bring the media back before the next, heavier step is taken. Process exit
+    is the last step. The time from the fault detection until the media flows again is recorded per
+    fault class.
+    """
+    FAULT_NOT_STARTED = "not_started"
+    FAULT_MEDIA_TIMEOUT = "media_timeout"
+    # Not a fault yet - the call is still within its start up window
+    PENDING = "pending"
+
+    RESET_MEDIA = "reset_media"
+    REINVITE = "reinvite"
+    REDIAL = "redial"
+    EXIT = "exit"
+
+    LADDERS = {
+        FAULT_NOT_STARTED: [REDIAL, REDIAL, EXIT],
+        FAULT_MEDIA_TIMEOUT: [RESET_MEDIA, REINVITE, REDIAL, REDIAL, EXIT],
+    }
+    STEP_GRACE_SEC = {RESET_MEDIA: 2, REINVITE: 5, REDIAL: 15, EXIT: 0}
+
+    def __init__(self, name=""):
+        self.name = name
+        self.fault = None
+        self.faultStartTime = 0
+        self.step = 0
+        self.nextActionTime = 0
+        self.actionsTaken = []
+        self.stats = {}
+
+    def update(self, fault, now=None):
+        """
+        Takes the current health check result (None when healthy) and returns the recovery action to run or None
+        """
+        now = time.monotonic() if now is None else now
+        if fault is None:
+            if self.fault:
+                self.recovered(now)
+            return None
+        if self.fault is None:
+            if fault == CallRecovery.PENDING:
+                return None
+            self.fault = fault
+            self.faultStartTime = now
+            self.step = 0
+            self.nextActionTime = now
+            self.actionsTaken = []
+            self.faultStats()["faults"] += 1
+        if now < self.nextActionTime:
+            return None
+        ladder = CallRecovery.LADDERS[self.fault]
+        action = ladder[min(self.step, len(ladder) - 1)]
+        self.step += 1
+        self.nextActionTime = now + CallRecovery.STEP_GRACE_SEC[action]
+        self.actionsTaken.append(action)
+        logging.warning(f"Call {self.name}: {self.fault} for {now - self.faultStartTime:.1f} sec, recovery step {self.step}: {action}")
+        return action
+
+    def faultStats(self):
+        if self.fault not in self.stats:
+            self.stats[self.fault] = {"faults": 0, "recovered": 0, "lastRecoverSec": None, "minRecoverSec": None,
+                                      "maxRecoverSec": None, "totalRecoverSec": 0.0, "recoveredBy": {}}
+        return self.stats[self.fault]
+
+    def recovered(self, now):
+        recoverSec = now - self.faultStartTime
+        stats = self.faultStats()
+        stats["recovered"] += 1
+        stats["lastRecoverSec"] = round(recoverSec, 3)
+        stats["totalRecoverSec"] += recoverSec
+        stats["minRecoverSec"] = round(min(recoverSec, stats["minRecoverSec"] or recoverSec), 3)
+        stats["maxRecoverSec"] = round(max(recoverSec, stats["maxRecoverSec"] or 0), 3)
+        lastAction = self.actionsTaken[-1] if self.actionsTaken else "none"
+        stats["recoveredBy"][lastAction] = stats["recoveredBy"].get(lastAction, 0) + 1
+        logging.info(f"Call {self.name}: recovered from {self.fault} in {recoverSec:.2f} sec after {self.actionsTaken}")
+        self.fault = None
+        return recoverSec
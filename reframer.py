@@ -0,0 +1,37 @@
+class Reframer:
+    """
+    Slices a PCM byte stream of arbitrary datagram sizes into frames of exactly frameSize bytes.
+    The remainder of a datagram is carried over and prepended to the next one.
+    """
+
+    def __init__(self, frameSize):
+        assert frameSize > 0, f"Invalid frame size {frameSize}"
+        self.frameSize = frameSize
+        self._pending = bytearray()
+
+    @staticmethod
+    def frameSizeOf(clockRate, frameTimeUsec, channelCount, bitsPerSample):
+        return clockRate * frameTimeUsec // 1000000 * channelCount * bitsPerSample // 8
+
+    def push(self, data):
+        """
+        Adds a datagram and returns the list of the completed frames as bytes
+        """
+        frameSize = self.frameSize
+        if not self._pending and len(data) == frameSize:
+            # The Streamer already sends exact frames - no accumulation needed
+            return [bytes(data)]
+        self._pending += data
+        count = len(self._pending) // frameSize
+        if count == 0:
+            return []
+        with memoryview(self._pending) as view:
+            frames = [bytes(view[i * frameSize:(i + 1) * frameSize]) for i in range(count)]
+        del self._pending[:count * frameSize]
+        return frames
+
+    def pendingBytes(self):
+        return len(self._pending)
+
+    def reset(self):
+        self._pending.clear()
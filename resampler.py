@@ -0,0 +1,85 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Resampler:
+    """
+    Adapts the downstream PCM to the port format: 16 bit signed mono at the port clock rate.
+    The input sample format and channel count are converted and the rate is changed by linear
+    interpolation, preceded by a windowed sinc low pass filter when downsampling. The stream is
+    converted in batches of whole input frames, carrying the filter and interpolation state over
+    from batch to batch, so the output is continuous whatever the datagram sizes are.
+    """
+    S16 = "s16"
+    S32 = "s32"
+    F32 = "f32"
+    U8 = "u8"
+    FORMATS = [S16, S32, F32, U8]
+    FILTER_TAPS = 31
+
+    def __init__(self, inRate, outRate, inChannels=1, inFormat=S16, frameTimeUsec=40000):
+        if np is None:
+            raise RuntimeError("The downstream format adaptation needs numpy")
+        assert inFormat in Resampler.FORMATS, f"Unknown sample format {inFormat}"
+        self.inRate = inRate
+        self.outRate = outRate
+        self.inChannels = inChannels
+        self.inFormat = inFormat
+        self.dtype, self.scale, self.offset = {
+            Resampler.S16: (np.dtype("<i2"), 1.0, 0.0),
+            Resampler.S32: (np.dtype("<i4"), 1.0 / 65536, 0.0),
+            Resampler.F32: (np.dtype("<f4"), 32768.0, 0.0),
+            Resampler.U8: (np.dtype("u1"), 256.0, -128.0),
+        }[inFormat]
+        # Bytes of one input frame - the unit of the conversion batches
+        self.inFrameBytes = inRate * frameTimeUsec // 1000000 * inChannels * self.dtype.itemsize
+        self.step = inRate / outRate
+        self.filter = None
+        if outRate < inRate:
+            taps = np.arange(Resampler.FILTER_TAPS) - (Resampler.FILTER_TAPS - 1) / 2
+            cutoff = 0.5 * outRate / inRate
+            lowPass = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(Resampler.FILTER_TAPS)
+            self.filter = lowPass / lowPass.sum()
+        self.reset()
+
+    def reset(self):
+        self._pending = bytearray()
+        # Input samples kept for the filter of the next batch
+        self._filterHistory = np.zeros(Resampler.FILTER_TAPS - 1) if self.filter is not None else np.zeros(0)
+        # The last sample of the previous batch and the position of the next output sample relative to it
+        self._lastSample = np.zeros(1)
+        self._phase = 0.0
+
+    def push(self, data):
+        """
+        Adds downstream bytes and returns the converted PCM of the whole input frames received so far
+        """
+        self._pending += data
+        batchBytes = len(self._pending) // self.inFrameBytes * self.inFrameBytes
+        if batchBytes == 0:
+            return b""
+        samples = np.frombuffer(self._pending, dtype=self.dtype, count=batchBytes // self.dtype.itemsize)
+        samples = (samples.astype(np.float64) + self.offset) * self.scale
+        # The view into the pending bytes is released above, so the buffer can be resized
+        del self._pending[:batchBytes]
+        if self.inChannels > 1:
+            samples = samples.reshape(-1, self.inChannels).mean(axis=1)
+        if self.inRate != self.outRate:
+            samples = self.resample(samples)
+        return np.clip(np.rint(samples), -32768, 32767).astype("<i2").tobytes()
+
+    def resample(self, samples):
+        if self.filter is not None:
+            history = np.concatenate((self._filterHistory, samples))
+            self._filterHistory = history[-(Resampler.FILTER_TAPS - 1):]
+            # Delayed by half the filter length, which is constant and continuous over the batches
+            samples = np.convolve(history, self.filter, mode="valid")
+        buffer = np.concatenate((self._lastSample, samples))
+        last = len(buffer) - 1
+        count = int((last - self._phase) // self.step) + 1 if last >= self._phase else 0
+        positions = self._phase + np.arange(count) * self.step
+        self._phase = self._phase + count * self.step - last
+        self._lastSample = buffer[-1:]
+        return np.interp(positions, np.arange(len(buffer)), buffer)
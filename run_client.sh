@@ -1,6 +1,5 @@
 #!/bin/bash
-while true; do
-  echo "===============================  Starting sip client with the following parameters $@  ==============================="
-  PYTHONPATH=:/root/pjproject-master/pjsip-apps/src/pygui python3 ./sip_client.py $@
-  sleep 1
-done
\ No newline at end of file
+# The supervisor restarts the sip client workers that exit. Its own options (--workers, --cpus, ...)
+# are consumed, all the other parameters are passed to every sip_client.py worker
+echo "===============================  Starting sip client supervisor with the following parameters $@  ==============================="
+PYTHONPATH=:/root/pjproject-master/pjsip-apps/src/pygui exec python3 ./supervisor.py "$@"
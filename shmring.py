@@ -0,0 +1,180 @@
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+import platform
+import struct
+import time
+
+# Futex word operations are shared between processes, so no FUTEX_PRIVATE_FLAG
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+# The ring relies on the x86-64 memory order and atomic aligned 8 byte stores, see ShmRing
+SUPPORTED_MACHINES = {"x86_64": 202}
+SYS_FUTEX = SUPPORTED_MACHINES.get(platform.machine())
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long),
+                ("tv_nsec", ctypes.c_long)]
+
+
+def _loadSyscall():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.syscall
+    except (OSError, AttributeError):
+        return None
+
+
+_syscall = _loadSyscall()
+
+
+class ShmRing:
+    """
+    Single producer, single consumer ring of PCM frames in a memory mapped file, shared by the Streamer
+    and the client. Frames are copied into and out of the mapping without syscalls; only a consumer that
+    went to sleep on the futex word costs the producer a FUTEX_WAKE.
+
+    File layout, little endian, every field on its own 64 byte cache line:
+        0    magic "PCMR", version, slot count, slot size         (u32 x 4)
+        64   write index - frames published by the producer      (u64)
+        128  read index - frames taken by the consumer           (u64)
+        192  futex word incremented on every publish, waiting flag of the consumer (u32 x 2)
+        256  slots: frame length (u32), padding (u32), producer time_ns (u64), frame bytes
+    The indexes only grow, the slot of index i is i % slot count. A frame is written before the write
+    index is advanced, and read before the read index is, which the x86-64 store order keeps visible
+    to the other process in that order. Python has no memory fences, so weaker ordered machines are
+    refused rather than risking a torn frame or index.
+    """
+    MAGIC = b"PCMR"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIII")
+    INDEX = struct.Struct("<Q")
+    WORD = struct.Struct("<I")
+    SLOT_HEADER = struct.Struct("<IIQ")
+    WRITE_INDEX_OFFSET = 64
+    READ_INDEX_OFFSET = 128
+    FUTEX_OFFSET = 192
+    WAITING_OFFSET = 196
+    SLOTS_OFFSET = 256
+
+    DEFAULT_SLOTS = 64
+    DEFAULT_SLOT_SIZE = 16384
+
+    def __init__(self, path, slotCount=DEFAULT_SLOTS, slotSize=DEFAULT_SLOT_SIZE, consumer=False):
+        if not ShmRing.isSupported():
+            raise RuntimeError(f"The shared memory ring needs an x86-64 machine, not {platform.machine()}")
+        self.path = path
+        if not os.path.exists(path):
+            ShmRing.create(path, slotCount, slotSize)
+        with open(path, "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), 0)
+        magic, version, self.slotCount, self.slotSize = ShmRing.HEADER.unpack_from(self.map, 0)
+        assert magic == ShmRing.MAGIC and version == ShmRing.VERSION, f"{path} is not a PCM ring"
+        self.maxFrameSize = self.slotSize - ShmRing.SLOT_HEADER.size
+        self._futexWord = ctypes.c_uint32.from_buffer(self.map, ShmRing.FUTEX_OFFSET)
+        self.framesWritten = 0
+        self.framesRead = 0
+        self.framesDropped = 0
+        self.wakeups = 0
+        if consumer:
+            # Frames left from before this consumer attached are stale
+            self.storeIndex(ShmRing.READ_INDEX_OFFSET, self.loadIndex(ShmRing.WRITE_INDEX_OFFSET))
+
+    @staticmethod
+    def isSupported():
+        return SYS_FUTEX is not None and _syscall is not None
+
+    @staticmethod
+    def create(path, slotCount, slotSize):
+        # Created under a temporary name and linked into place, so the other side never maps a partial file
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath, "wb") as f:
+            f.truncate(ShmRing.SLOTS_OFFSET + slotCount * slotSize)
+            f.write(ShmRing.HEADER.pack(ShmRing.MAGIC, ShmRing.VERSION, slotCount, slotSize))
+        try:
+            os.link(tmpPath, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmpPath)
+
+    def loadIndex(self, offset):
+        return ShmRing.INDEX.unpack_from(self.map, offset)[0]
+
+    def storeIndex(self, offset, value):
+        ShmRing.INDEX.pack_into(self.map, offset, value)
+
+    def depth(self):
+        return self.loadIndex(ShmRing.WRITE_INDEX_OFFSET) - self.loadIndex(ShmRing.READ_INDEX_OFFSET)
+
+    def write(self, frame, timeNs=None):
+        """
+        Publishes a frame, returns False when the ring is full and the frame is dropped - the backpressure
+        """
+        writeIndex = self.loadIndex(ShmRing.WRITE_INDEX_OFFSET)
+        if writeIndex - self.loadIndex(ShmRing.READ_INDEX_OFFSET) >= self.slotCount or len(frame) > self.maxFrameSize:
+            self.framesDropped += 1
+            return False
+        slot = ShmRing.SLOTS_OFFSET + (writeIndex % self.slotCount) * self.slotSize
+        ShmRing.SLOT_HEADER.pack_into(self.map, slot, len(frame), 0, time.time_ns() if timeNs is None else timeNs)
+        start = slot + ShmRing.SLOT_HEADER.size
+        self.map[start:start + len(frame)] = frame
+        self.storeIndex(ShmRing.WRITE_INDEX_OFFSET, writeIndex + 1)
+        self._futexWord.value = (self._futexWord.value + 1) & 0xffffffff
+        self.framesWritten += 1
+        if ShmRing.WORD.unpack_from(self.map, ShmRing.WAITING_OFFSET)[0]:
+            self.wake()
+        return True
+
+    def poll(self):
+        """
+        Returns the next frame as (bytes, producer time_ns) or None when the ring is empty. Never blocks.
+        """
+        readIndex = self.loadIndex(ShmRing.READ_INDEX_OFFSET)
+        if readIndex == self.loadIndex(ShmRing.WRITE_INDEX_OFFSET):
+            return None
+        slot = ShmRing.SLOTS_OFFSET + (readIndex % self.slotCount) * self.slotSize
+        length, pad, timeNs = ShmRing.SLOT_HEADER.unpack_from(self.map, slot)
+        start = slot + ShmRing.SLOT_HEADER.size
+        frame = self.map[start:start + length]
+        self.storeIndex(ShmRing.READ_INDEX_OFFSET, readIndex + 1)
+        self.framesRead += 1
+        return frame, timeNs
+
+    def read(self, timeoutMs=1000):
+        """
+        Returns the next frame as poll does, sleeping on the futex word while the ring is empty.
+        None after the timeout.
+        """
+        deadline = time.monotonic() + timeoutMs / 1000
+        while True:
+            item = self.poll()
+            if item is not None:
+                return item
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            sequence = self._futexWord.value
+            ShmRing.WORD.pack_into(self.map, ShmRing.WAITING_OFFSET, 1)
+            # A frame published in between changes the futex word, and the wait returns at once
+            if self.depth() == 0:
+                self.wait(sequence, remaining)
+            ShmRing.WORD.pack_into(self.map, ShmRing.WAITING_OFFSET, 0)
+
+    def wait(self, sequence, timeoutSec):
+        timeout = Timespec(int(timeoutSec), int((timeoutSec % 1) * 1e9))
+        result = _syscall(SYS_FUTEX, ctypes.byref(self._futexWord), FUTEX_WAIT, ctypes.c_uint32(sequence),
+                          ctypes.byref(timeout), None, 0)
+        if result < 0 and ctypes.get_errno() not in (errno.EAGAIN, errno.ETIMEDOUT, errno.EINTR):
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def wake(self):
+        self.wakeups += 1
+        _syscall(SYS_FUTEX, ctypes.byref(self._futexWord), FUTEX_WAKE, 1, None, None, 0)
+
+    def stats(self):
+        return {"depth": self.depth(), "framesWritten": self.framesWritten, "framesRead": self.framesRead,
+                "framesDropped": self.framesDropped, "wakeups": self.wakeups}
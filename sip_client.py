@@ -1,7 +1,9 @@
 import pjsua2 as pj
 import time
-import socket
-from array import array
+import threading
+import resource
+import json
+import queue
 import argparse
 import sys
 import os
@@ -11,6 +13,22 @@ from logging import handlers
 import settings
 import ducall
 from ducall import SHARED_VOLUME_PATH
+from jitterbuffer import JitterBuffer
+from udpsniffer import UdpSniffer
+from callspec import CallSpec
+from shmring import ShmRing
+import resampler
+from resampler import Resampler
+import vad
+from vad import VoiceActivityDetector
+import plc
+from plc import Concealer
+from recovery import CallRecovery
+from metrics import REGISTRY
+import logutil
+from standby import HeartbeatSender, HeartbeatMonitor
+from startup import StartupProfile
+from realtime import ThreadTuning
 import log
 import endpoint as ep
 
@@ -22,6 +40,27 @@ CUSTOM = "custom"
 # write=sys.stdout.write
 write = logging.info
 
+# Defaults of the options tuned by --low-latency: (default, low latency). Options given explicitly are kept.
+LATENCY_DEFAULTS = {
+    "frame_length_msec": (40, 10),
+    "jitter_target_msec": (JitterBuffer.DEFAULT_TARGET_MS, 20),
+    "jitter_max_msec": (JitterBuffer.DEFAULT_MAX_MS, 80),
+    "busy_poll_usec": (0, 50),
+    "latency_report_sec": (0, 10),
+}
+
+
+def parseCpuList(text):
+    """
+    '2,3' or '2-5'
+    """
+    cpus = []
+    for part in text.split(","):
+        first, sep, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument("--profile", choices=[MOBOTIX, TS, CUSTOM], default=MOBOTIX)
@@ -31,18 +70,137 @@ parser.add_argument("--sip-uri", default="")
 parser.add_argument("--password", default="")
 parser.add_argument("--registrar-uri", default="")
 parser.add_argument("--proxy", default="")
-parser.add_argument("--recording-file", default=None)
-parser.add_argument("--downport", type=int, default=6600, help="UDP port for PCM stream from Streamer to SIP server")
-parser.add_argument("--upport", type=int, default=6700, help="UDP port for PCM stream from SIP server to Streamer")
+parser.add_argument("--recording-file", default=None, help=f"WAV file in {SHARED_VOLUME_PATH} to record the call to")
+parser.add_argument("--recording-stereo", action="store_true",
+                    help="Record the received audio to the left and the sent audio to the right channel")
+parser.add_argument("--recording-max-mb", type=int, default=0, help="Start a new recording file after that many MB")
+parser.add_argument("--recording-max-minutes", type=int, default=0, help="Start a new recording file after that many minutes")
+parser.add_argument("--downport", type=CallSpec.endpoint, default=6600,
+                    help="UDP port, or AF_UNIX datagram socket path, for PCM stream from Streamer to SIP server")
+parser.add_argument("--upport", type=CallSpec.endpoint, default=6700,
+                    help="UDP port, or AF_UNIX datagram socket path, for PCM stream from SIP server to Streamer")
+parser.add_argument("--transport", choices=ducall.TRANSPORTS, default=ducall.UDP_TRANSPORT,
+                    help=f"PCM exchange with the Streamer: UDP on the ports, or shared memory rings "
+                         f"{SHARED_VOLUME_PATH}/down-<downport>.ring and up-<upport>.ring")
+parser.add_argument("--shm-slots", type=int, default=ShmRing.DEFAULT_SLOTS,
+                    help="Frames per shared memory ring of --transport shm")
 parser.add_argument("--use-sniffer", action="store_true", help="When defined the downstream socket will work in sniffing mode. "
                                                                "It allows to read the data when the port is used by another application")
+parser.add_argument("--sniffer-backend", choices=UdpSniffer.SNIFFER_BACKENDS, default=UdpSniffer.RECVFROM_BACKEND,
+                    help="Capture backend of --use-sniffer: recvfrom per packet or a PACKET_MMAP (TPACKET_V3) ring")
 parser.add_argument("--echo", action="store_true", help="Will send obtained packets back instead of sip server")
 parser.add_argument("--sample-rate", type=int, default=16000)
-parser.add_argument("--frame-length-msec", type=int, default=40)
+parser.add_argument("--frame-length-msec", type=int, default=None, help="40, 10 with --low-latency")
+parser.add_argument("--input-sample-rate", type=int, default=0,
+                    help="Sample rate of the downstream PCM when it differs from the call rate, converted with numpy")
+parser.add_argument("--input-channels", type=int, default=1,
+                    help="Channels of the downstream PCM, downmixed to mono")
+parser.add_argument("--input-format", choices=Resampler.FORMATS, default=Resampler.S16,
+                    help="Sample format of the downstream PCM, converted to 16 bit signed")
+parser.add_argument("--vad", choices=VoiceActivityDetector.MODES, default=VoiceActivityDetector.OFF,
+                    help="Silence suppression: up skips the silent frames sent to the Streamer, down passes the silent "
+                         "downstream frames to pjsip as no audio and enables its VAD, so the call can use DTX/comfort noise")
+parser.add_argument("--vad-threshold-db", type=float, default=VoiceActivityDetector.DEFAULT_THRESHOLD_DB,
+                    help="Frame power in dBFS below which the frame is silent")
+parser.add_argument("--vad-hangover-msec", type=int, default=VoiceActivityDetector.DEFAULT_HANGOVER_MS,
+                    help="Time the speech state is held after the last loud frame")
+parser.add_argument("--vad-keep-every", type=int, default=0,
+                    help="Send one of every N silent upstream frames instead of none, 0 suppresses them all")
+parser.add_argument("--jitter-target-msec", type=int, default=None,
+                    help=f"Downstream jitter buffer depth reached before the playout starts, "
+                         f"{JitterBuffer.DEFAULT_TARGET_MS} or 20 with --low-latency")
+parser.add_argument("--jitter-max-msec", type=int, default=None,
+                    help=f"Hard cap of the downstream jitter buffer depth, {JitterBuffer.DEFAULT_MAX_MS} or 80 with --low-latency")
+parser.add_argument("--jitter-policy", choices=JitterBuffer.POLICIES, default=JitterBuffer.DROP_OLDEST,
+                    help="drop-oldest drops frames only at the hard cap, time-compress also drains "
+                         "the buffer back to its target by skipping frames")
+parser.add_argument("--plc", action="store_true",
+                    help="Conceal jitter buffer underruns by repeating the last pitch period fading into comfort noise, "
+                         "which allows a lower --jitter-target-msec without audible gaps")
+parser.add_argument("--plc-repeat-msec", type=int, default=Concealer.DEFAULT_REPEAT_MS,
+                    help="Time the waveform repetition takes to fade into comfort noise")
+parser.add_argument("--recv-batch-size", type=int, default=16,
+                    help="Max number of downstream datagrams read with one recvmmsg call")
+parser.add_argument("--recv-timeout-msec", type=int, default=1000,
+                    help="Downstream reader wake up period when no data arrives")
+parser.add_argument("--recv-buffer-size", type=int, default=0,
+                    help="SO_RCVBUF of the downstream socket in bytes, 0 keeps the system default")
+parser.add_argument("--call", action="append", default=[],
+                    help="Call spec 'dest,downport=N,upport=N,rate=N,frame=N' - may be repeated to run several calls "
+                         "on one endpoint. Omitted fields default to --sip-number, --downport, --upport, "
+                         "--sample-rate and --frame-length-msec")
+parser.add_argument("--instance-name", default="",
+                    help="Distinguishes the log files of several clients sharing the volume, e.g. supervisor workers")
+parser.add_argument("--metrics-port", type=int, default=0,
+                    help="Serve the audio pipeline metrics in the Prometheus text format on 127.0.0.1:<port>/metrics")
+parser.add_argument("--codecs", nargs="+", default=[], metavar="CODEC",
+                    help="Codec ids in priority order, matched by prefix, e.g. 'G722 L16/16000 opus'. Prefer the codecs "
+                         "at the port clock rate, the bridge resamples the others on every frame")
+parser.add_argument("--codecs-exclusive", action="store_true", help="Disable the codecs not listed in --codecs")
+parser.add_argument("--codec-ptime-msec", type=int, default=0,
+                    help="Packetization of every codec, by default --frame-length-msec so the stream frames match the port")
+parser.add_argument("--low-latency", action="store_true",
+                    help="Latency budget profile: 10 ms frames, a 20 ms jitter target, busy polling downstream socket, "
+                         "latency reports every 10 sec. Thread pinning and SCHED_FIFO stay opt-in, see --cpu-affinity "
+                         "and --rt-priority")
+parser.add_argument("--busy-poll-usec", type=int, default=None,
+                    help="SO_BUSY_POLL of the downstream UDP socket, 0 disables, 50 with --low-latency")
+parser.add_argument("--cpu-affinity", type=parseCpuList, default=None,
+                    help="CPUs of the downstream, upstream and media threads, e.g. '2,3' or '2-3'. The media thread "
+                         "gets the first CPU to itself and the other threads take turns on the rest. Off by default")
+parser.add_argument("--rt-priority", type=int, default=0,
+                    help="SCHED_FIFO priority of the downstream, upstream and media threads, needs CAP_SYS_NICE. "
+                         "0 keeps the default scheduling, the default")
+parser.add_argument("--latency-report-sec", type=int, default=None,
+                    help="Log the frame latency percentiles that often, 0 disables, 10 with --low-latency")
+parser.add_argument("--pjsip-threads", type=int, default=0,
+                    help="Number of pjsip worker threads handling the SIP events. 0 handles them in the main thread, "
+                         "which blocks in pjsip until an event arrives or the watchdog is due")
+parser.add_argument("--max-event-wait-msec", type=int, default=200,
+                    help="Longest wait in pjsip event handling without worker threads. pjsua2 callbacks fired on other "
+                         "threads (media events, DTMF digits) are posted to the main thread and only run between "
+                         "the waits, so they are delayed up to that long. Lower costs more idle wake ups")
+parser.add_argument("--production-logging", action="store_true",
+                    help="Log through a non-blocking queue served by a background thread, at INFO and pjsip level 3 "
+                         "unless the levels below are given")
+parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=None,
+                    help="Level of the Python logging, DEBUG by default")
+parser.add_argument("--pjsip-log-level", type=int, choices=range(7), default=None,
+                    help="Level of the pjsip log file, 5 by default")
+parser.add_argument("--pjsip-console-level", type=int, choices=range(7), default=None,
+                    help="Level of the pjsip log passed to the Python log, 5 by default")
+parser.add_argument("--standby-socket", default="",
+                    help="Unix datagram socket the instance sends its heartbeats to, where a --standby instance listens")
+parser.add_argument("--standby", action="store_true",
+                    help="Warm standby: initialize pjsip and register, then wait until the heartbeats on "
+                         "--standby-socket stop, take over the ports of the silent instance and dial at once")
+parser.add_argument("--standby-timeout-msec", type=int, default=1500,
+                    help="Heartbeat silence after which the standby takes over")
+parser.add_argument("--status-file", default="",
+                    help="JSON file rewritten every second with the health of the calls of this process")
 
 
 
 args = parser.parse_args()
+if args.standby and not args.standby_socket:
+    parser.error("--standby needs --standby-socket")
+if args.transport == ducall.SHM_TRANSPORT and not ShmRing.isSupported():
+    parser.error("--transport shm needs an x86-64 machine")
+for name, (default, lowLatency) in LATENCY_DEFAULTS.items():
+    if getattr(args, name) is None:
+        setattr(args, name, lowLatency if args.low_latency else default)
+if args.log_level is None:
+    args.log_level = "INFO" if args.production_logging else "DEBUG"
+if args.pjsip_log_level is None:
+    args.pjsip_log_level = 3 if args.production_logging else 5
+if args.pjsip_console_level is None:
+    args.pjsip_console_level = 3 if args.production_logging else 5
+if (args.input_sample_rate or args.input_channels != 1 or args.input_format != Resampler.S16) and resampler.np is None:
+    parser.error("--input-sample-rate, --input-channels and --input-format need numpy")
+if args.vad != VoiceActivityDetector.OFF and vad.np is None:
+    parser.error("--vad needs numpy")
+if args.plc and plc.np is None:
+    parser.error("--plc needs numpy")
 
 
 # Create a custom account class to handle account events
@@ -55,30 +213,69 @@ class MyAccount(pj.Account):
             write("Registration successful")
 
 
+class PjsipLogWriter(pj.LogWriter):
+    """
+    Passes the pjsip log to the Python logging, so it goes through the logging queue as well
+    """
+    LEVELS = {1: logging.ERROR, 2: logging.WARNING, 3: logging.INFO}
+
+    def __init__(self):
+        pj.LogWriter.__init__(self)
+
+    def write(self, entry):
+        logging.log(PjsipLogWriter.LEVELS.get(entry.level, logging.DEBUG), "pjsip: %s", entry.msg.rstrip())
+
+
 class SipCall:
+    WATCHDOG_PERIOD_SEC = 1
+    # The main loop wakes up that long after the watchdog is due, to pick up the actions it requested
+    WATCHDOG_MARGIN_MS = 20
+    STANDBY_EVENT_WAIT_MS = 50
+    # PJMEDIA_CODEC_PRIO_HIGHEST
+    CODEC_TOP_PRIORITY = 255
+
     def __init__(self, profile):
         self.custom_audio_media = None
-        self.logger = log.Logger()
+        self.logger = PjsipLogWriter() if args.production_logging else log.Logger()
         self.profile = profile
         self.sipNumber = None
         self.upStreamPort = 0
         self.downStreamPort = 0
+        self.callSpecs = []
+        self.calls = []
+        # Hung up calls are kept referenced until pjsip is done with them
+        self.retiredCalls = []
+        # Recovery actions requested by the watchdog thread, run by the thread handling the pjsip events
+        self.recoveryActions = queue.Queue()
+        self.nextWatchdogTime = 0
+        self.eventLoopWakeups = 0
+        self.lastUsage = (time.monotonic(), time.process_time(), 0)
+        self.startupProfile = StartupProfile(StartupProfile.processStartTime())
+        self.threadTuning = ThreadTuning(args.cpu_affinity, args.rt_priority, busyPoll=bool(args.busy_poll_usec)) \
+            if args.cpu_affinity or args.rt_priority else None
+        if args.low_latency and not self.threadTuning:
+            logging.info("Low latency profile without thread tuning, see --cpu-affinity and --rt-priority")
+        self.startupProfile.mark("interpreter and imports")
 
     def initAppConfig(self):
-        USE_THREADS = False
         self.appConfig = settings.AppConfig()
-        if USE_THREADS:
-            self.appConfig.epConfig.uaConfig.threadCnt = 1
-            self.appConfig.epConfig.uaConfig.mainThreadOnly = False
-        else:
-            self.appConfig.epConfig.uaConfig.threadCnt = 0
-            self.appConfig.epConfig.uaConfig.mainThreadOnly = True
+        # With worker threads pjsip handles its events and calls back from its own threads,
+        # the main thread only runs the recovery actions
+        self.appConfig.epConfig.uaConfig.threadCnt = args.pjsip_threads
+        self.appConfig.epConfig.uaConfig.mainThreadOnly = args.pjsip_threads == 0
+        # The stream detects the silence periods of the call audio and stops sending or sends comfort noise
+        self.appConfig.epConfig.medConfig.noVad = not VoiceActivityDetector.applies(args.vad, VoiceActivityDetector.DOWNSTREAM)
+        # The conference bridge runs at the port clock rate and frame length, so the port frames pass it
+        # without resampling or rebuffering
+        self.appConfig.epConfig.medConfig.clockRate = args.sample_rate
+        self.appConfig.epConfig.medConfig.audioFramePtime = args.frame_length_msec
         self.appConfig.epConfig.logConfig.writer = self.logger
-        self.appConfig.epConfig.logConfig.filename = f"{SHARED_VOLUME_PATH}/sip_cpp.log"
+        self.appConfig.epConfig.logConfig.filename = f"{SHARED_VOLUME_PATH}/sip_cpp{instanceSuffix()}.log"
         self.appConfig.epConfig.logConfig.fileFlags = pj.PJ_O_APPEND
-        self.appConfig.epConfig.logConfig.level = 5
-        self.appConfig.epConfig.logConfig.consoleLevel = 5
+        self.appConfig.epConfig.logConfig.level = args.pjsip_log_level
+        self.appConfig.epConfig.logConfig.consoleLevel = args.pjsip_console_level
         self.appConfig.epConfig.uaConfig.userAgent = "pygui-" + self.ep.libVersion().full
+        self.appConfig.epConfig.uaConfig.maxCalls = max(4, len(args.call))
         return self.appConfig
 
     def initLib(self):
@@ -91,6 +288,34 @@ class SipCall:
         # Initialize the endpoint library
         self.initAppConfig()
         self.ep.libInit(self.appConfig.epConfig)
+        self.setCodecs()
+        self.startupProfile.mark("library init")
+
+    def setCodecs(self):
+        """
+        Codec priorities from --codecs, and the packetization of every codec set to the port frame length
+        """
+        ptimeMs = args.codec_ptime_msec or args.frame_length_msec
+        for info in self.ep.codecEnum2():
+            codecId = info.codecId
+            rank = next((i for i, prefix in enumerate(args.codecs) if codecId.lower().startswith(prefix.lower())), None)
+            if rank is not None:
+                self.ep.codecSetPriority(codecId, SipCall.CODEC_TOP_PRIORITY - rank)
+            elif args.codecs and args.codecs_exclusive:
+                self.ep.codecSetPriority(codecId, 0)
+            try:
+                param = self.ep.codecGetParam(codecId)
+                frameLen = param.info.frameLen
+                if frameLen and ptimeMs % frameLen == 0:
+                    param.setting.frmPerPkt = ptimeMs // frameLen
+                    self.ep.codecSetParam(codecId, param)
+                else:
+                    logging.warning(f"Codec {codecId}: {ptimeMs} ms ptime is not a multiple of its {frameLen} ms frame")
+            except pj.Error as e:
+                logging.warning(f"Codec {codecId}: cannot set the packetization: {e.info()}")
+        enabled = sorted((info for info in self.ep.codecEnum2() if info.priority), key=lambda info: -info.priority)
+        write(f"Codecs by priority, ptime {ptimeMs} ms:\n\t" +
+              "\n\t".join(f"{info.codecId} {info.priority}" for info in enabled))
 
     def listDevices(self):
         audio_dev_man = self.ep.audDevManager()
@@ -105,7 +330,8 @@ class SipCall:
             self.sipNumber = defaultSipNumber
         else:
             self.sipNumber = "sip:" + args.sip_number
-        assert args.sip_number != "", f"SIP number is not defined"
+        # Call specs may define their own destinations, CallSpec.parseAll checks them
+        assert args.sip_number != "" or args.call, f"SIP number is not defined"
         write(f"Sip number is: {self.sipNumber}")
 
     def createAccount(self, idUri, user, password, registrarUri, proxy):
@@ -151,14 +377,18 @@ class SipCall:
 
 
     def start(self):
+        if args.metrics_port:
+            REGISTRY.serve(args.metrics_port)
         self.initLib()
         # Create UDP transport
         self.transport_cfg = pj.TransportConfig()
         self.transport_cfg.port = 5060  # Change this port as needed
         transport = self.ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, callTest.appConfig.udp.config)
         # transport.create(transport_cfg)
+        self.startupProfile.mark("transport")
 
         self.ep.libStart()
+        self.startupProfile.mark("library start")
         if self.profile == TS:
             self.createTsAccount()
             self.setSipNumber(defaultSipNumber="sip:echoTest@localhost")
@@ -168,82 +398,260 @@ class SipCall:
         elif self.profile == CUSTOM:
             self.createCustomAccount()
             self.setSipNumber(defaultSipNumber="")
+        self.startupProfile.mark("account")
 
        # self.listDevices()
         self.downStreamPort = args.downport
         self.upStreamPort = args.upport
+        defaults = CallSpec(self.sipNumber, self.downStreamPort, self.upStreamPort, args.sample_rate,
+                            args.frame_length_msec)
+        self.callSpecs = CallSpec.parseAll(args.call, defaults)
+        ports = [port for spec in self.callSpecs for port in (spec.downStreamPort, spec.upStreamPort)]
+        if any(CallSpec.isUnixSocket(port) for port in ports):
+            assert args.transport == ducall.UDP_TRANSPORT, "Unix socket ports need --transport udp"
+        if any(CallSpec.isUnixSocket(spec.downStreamPort) for spec in self.callSpecs):
+            assert not args.use_sniffer, "A Unix socket downport cannot be sniffed"
+        for spec in self.callSpecs:
+            if spec.sampleRate != args.sample_rate or spec.frameLenMs != args.frame_length_msec:
+                logging.warning(f"Call {spec}: the conference bridge runs at {args.sample_rate} Hz "
+                                f"{args.frame_length_msec} ms and converts the frames of this call")
         write(f"Set SIP {self.profile} profile:  "
               f"\n\tnumber {self.sipNumber}"
               f"\n\tdown stream port {self.downStreamPort}"
-              f"\n\tup stream port {self.upStreamPort}")
+              f"\n\tup stream port {self.upStreamPort}"
+              f"\n\tcalls:\n\t\t" + "\n\t\t".join(str(spec) for spec in self.callSpecs))
 
         audio_dev_man = self.ep.audDevManager()
         audio_dev_man.setNullDev()
 
-    def call(self):
-        self.start()
+    def recordingFile(self, spec):
+        if not args.recording_file or len(self.callSpecs) == 1:
+            return args.recording_file
+        base, ext = os.path.splitext(args.recording_file)
+        suffix = os.path.splitext(os.path.basename(str(spec.downStreamPort)))[0]
+        return f"{base}-{suffix}{ext}"
+
+    def makeCall(self, index, previousCall=None):
         # Make an outgoing call
+        spec = self.callSpecs[index]
         try:
-            callUri = self.sipNumber
-            self.myCall = ducall.Call(acc=self.acc, peer_uri=callUri, upStreamPort=self.upStreamPort,
-                                      downStreamPort=self.downStreamPort, useSniffer=args.use_sniffer,
-                                      playbackFile=args.recording_file, sampleRate=args.sample_rate,
-                                      frameLen=args.frame_length_msec, echoMode=args.echo)
+            callUri = spec.destination
+            call = ducall.Call(acc=self.acc, peer_uri=callUri, upStreamPort=spec.upStreamPort,
+                               downStreamPort=spec.downStreamPort, useSniffer=args.use_sniffer,
+                               playbackFile=self.recordingFile(spec), sampleRate=spec.sampleRate,
+                               frameLen=spec.frameLenMs, echoMode=args.echo,
+                               jitterTargetMs=args.jitter_target_msec, jitterMaxMs=args.jitter_max_msec,
+                               jitterPolicy=args.jitter_policy, recvBatchSize=args.recv_batch_size,
+                               recvTimeoutMs=args.recv_timeout_msec, recvBufSize=args.recv_buffer_size,
+                               snifferBackend=args.sniffer_backend, recordingStereo=args.recording_stereo,
+                               recordingMaxBytes=args.recording_max_mb * 1048576,
+                               recordingMaxSec=args.recording_max_minutes * 60,
+                               inputSampleRate=args.input_sample_rate, inputChannels=args.input_channels,
+                               inputFormat=args.input_format, vadMode=args.vad, vadThresholdDb=args.vad_threshold_db,
+                               vadHangoverMs=args.vad_hangover_msec, vadKeepEvery=args.vad_keep_every,
+                               concealment=args.plc, concealRepeatMs=args.plc_repeat_msec,
+                               transport=args.transport, shmSlots=args.shm_slots,
+                               busyPollUsec=args.busy_poll_usec, threadTuning=self.threadTuning,
+                               startWatchdog=False,
+                               recoveryHandler=self.requestRecovery, previousCall=previousCall)
+            if previousCall:
+                self.calls[index] = call
+            else:
+                self.calls.append(call)
             self.call_param = pj.CallOpParam()
             self.call_param.opt.audioCount = 1
             self.call_param.opt.videoCount = 0
-            self.myCall.makeCall(callUri, self.call_param)
-            # Time for async procedures before running event loop
-            time.sleep(1)
+            call.dial(callUri, self.call_param)
         except pj.Error as e:
             write("Error making the call:", str(e))
 
-        # Run events loop
+    def watchdog(self):
+        # A single watchdog thread serves all the calls of the process
+        ducall.registerThread("watchdog")
+        lastUsageLog = 0
+        lastLatencyReport = time.monotonic()
         while True:
-            # Checks for events once per 10 Ms
-            time.sleep(0.01)
-            self.ep.libHandleEvents(10)
+            self.nextWatchdogTime = time.monotonic() + SipCall.WATCHDOG_PERIOD_SEC
+            for call in list(self.calls):
+                call.checkWatchdog()
+            if time.monotonic() - lastUsageLog >= 30:
+                lastUsageLog = time.monotonic()
+                self.logResourceUsage()
+            if args.latency_report_sec and time.monotonic() - lastLatencyReport >= args.latency_report_sec:
+                lastLatencyReport = time.monotonic()
+                self.logLatency()
+            if not self.startupProfile.reported:
+                self.checkFirstAudioFrame()
+            if args.status_file:
+                self.writeStatus(args.status_file)
+            time.sleep(max(0.0, self.nextWatchdogTime - time.monotonic()))
+
+    def checkFirstAudioFrame(self):
+        # The phases of the first call are marked with the times it recorded, once its audio flows
+        call = self.calls[0] if self.calls else None
+        if not call or not call.watchdogData.firstFrameTime:
+            return
+        if call.setupMs is not None:
+            self.startupProfile.mark("call confirmed", call.dialTime + call.setupMs / 1000)
+        if call.mediaSetupMs is not None:
+            self.startupProfile.mark("media connected", call.dialTime + call.mediaSetupMs / 1000)
+        self.startupProfile.mark("first audio frame", call.watchdogData.firstFrameTime)
+        self.startupProfile.report()
+
+    @staticmethod
+    def rssBytes():
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+
+    def writeStatus(self, statusFile):
+        status = {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "rssBytes": SipCall.rssBytes(),
+            "cpuSec": time.process_time(),
+            "eventLoopWakeups": self.eventLoopWakeups,
+            "startup": self.startupProfile.phases,
+            "calls": [call.status() for call in self.calls],
+        }
+        # Replaced atomically, so the readers never see a partial file
+        tmpFile = statusFile + ".tmp"
+        with open(tmpFile, "w") as f:
+            json.dump(status, f)
+        os.replace(tmpFile, statusFile)
+
+    def logResourceUsage(self):
+        rssBytes = SipCall.rssBytes()
+        cpuSec = time.process_time()
+        callCount = max(1, len(self.calls))
+        # CPU load and main loop wake ups since the previous report - the idle cost of the process
+        now = time.monotonic()
+        lastTime, lastCpuSec, lastWakeups = self.lastUsage
+        self.lastUsage = (now, cpuSec, self.eventLoopWakeups)
+        elapsedSec = max(now - lastTime, 1e-3)
+        write(f"Resource usage of {len(self.calls)} call(s): RSS {rssBytes / 1048576:.1f} MB "
+              f"({rssBytes / callCount / 1048576:.1f} MB per call), CPU {cpuSec:.1f} sec "
+              f"({cpuSec / callCount:.1f} sec per call), load {100 * (cpuSec - lastCpuSec) / elapsedSec:.1f}%, "
+              f"event loop wake ups {(self.eventLoopWakeups - lastWakeups) / elapsedSec:.1f}/sec, "
+              f"threads {threading.active_count()}")
+
+    def logLatency(self):
+        # Measured inside the client: the pjsip bridge and stream add about one frame and the codec ptime
+        for call in list(self.calls):
+            report = call.latencyReport()
+            if report:
+                write(f"Latency of call {call.watchdogData.name} over the last {args.latency_report_sec} sec, usec: " +
+                      ", ".join(f"{name} p50 {value['p50']} p99 {value['p99']} max {value['max']}"
+                                for name, value in report.items()))
+
+    def requestRecovery(self, call, action):
+        self.recoveryActions.put((call, action))
+
+    def runRecoveryAction(self, call, action):
+        if call not in self.calls:
+            return
+        write(f"Running recovery action {action} for call {call.watchdogData.name}")
+        try:
+            if action == CallRecovery.RESET_MEDIA:
+                call.resetMedia()
+            elif action == CallRecovery.REINVITE:
+                call.reinviteMedia()
+            elif action == CallRecovery.REDIAL:
+                self.redial(call)
+        except pj.Error as e:
+            logging.error(f"Recovery action {action} failed: {e.info()}")
+
+    def runRecoveryActions(self):
+        while not self.recoveryActions.empty():
+            self.runRecoveryAction(*self.recoveryActions.get())
+
+    def handleEvents(self):
+        """
+        Blocks in pjsip until an event arrives or the watchdog is due, so the recovery actions it
+        requests run right after its check without polling in between. SIP messages end the wait at
+        once; the jobs other threads post to the main thread (mainThreadOnly) wait for the next call,
+        which --max-event-wait-msec bounds. "benchmark.py eventloop" measures both against the sleep poll.
+        """
+        timeoutMs = (self.nextWatchdogTime - time.monotonic()) * 1000 + SipCall.WATCHDOG_MARGIN_MS
+        self.ep.libHandleEvents(int(min(max(timeoutMs, SipCall.WATCHDOG_MARGIN_MS), args.max_event_wait_msec)))
+        self.eventLoopWakeups += 1
+        self.runRecoveryActions()
+
+    def redial(self, call):
+        try:
+            call.hangup(pj.CallOpParam(True))
+        except pj.Error as e:
+            logging.error(f"Hangup before redial failed: {e.info()}")
+        self.retiredCalls = [retired for retired in self.retiredCalls if retired.isActive()]
+        self.retiredCalls.append(call)
+        self.makeCall(self.calls.index(call), previousCall=call)
+
+    def waitForFailover(self):
+        monitor = HeartbeatMonitor(args.standby_socket, args.standby_timeout_msec / 1000)
+        self.startupProfile.mark("standby ready")
+        while not monitor.failed.is_set():
+            if args.pjsip_threads:
+                monitor.failed.wait(1)
+            else:
+                # Keeps the registration refreshed while waiting
+                self.ep.libHandleEvents(SipCall.STANDBY_EVENT_WAIT_MS)
+        # The phases from here on add up to the failover time
+        self.startupProfile.mark("standby wait")
+        monitor.fenceActive()
+        self.startupProfile.mark("active fenced")
+
+    def call(self):
+        self.start()
+        if args.standby:
+            self.waitForFailover()
+        if args.standby_socket:
+            self.heartbeatSender = HeartbeatSender(args.standby_socket)
+        for index in range(len(self.callSpecs)):
+            self.makeCall(index)
+        self.startupProfile.mark("dial")
+        self.watchdogThread = threading.Thread(target=self.watchdog, daemon=True)
+        self.watchdogThread.start()
+
+        while True:
+            if args.pjsip_threads:
+                # pjsip handles the events, the main thread sleeps until a recovery action is requested
+                self.runRecoveryAction(*self.recoveryActions.get())
+                self.eventLoopWakeups += 1
+            else:
+                self.handleEvents()
 
     def end(self):
         self.ep.libDestroy()
 
 
-# This method is for testing and debugging purposes only. FileName has to be a full path to the
-# recorded PCM stream like: "/home/me/work/pjproject/pjsip-apps/src/pygui/playfile"
-def sendTestFile(fileName, frameLengthMS=40):
-    audioData = array('B')
-    with open(fileName, "rb") as f:
-        audioData.fromfile(f, 96000)
-    shift = 0
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    frameLength = frameLengthMS * 0.001
-    while True:
-        barr = bytes(audioData[shift:shift + 640])
-        sock.sendto(barr, ("0.0.0.0", 6700))
-        shift += 640
-        if shift >= 96000:
-            shift = 0
-        time.sleep(frameLength)
+def instanceSuffix():
+    return f"_{args.instance_name}" if args.instance_name else ""
+
 
 def initLogger(logPath):
     os.makedirs(SHARED_VOLUME_PATH, mode=0o666, exist_ok=True)
  
-    log = logging.getLogger('')
-    log.setLevel(logging.DEBUG)
     format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
     ch = logging.StreamHandler(sys.stdout)
     ch.setFormatter(format)
-    log.addHandler(ch)
 
     fh = handlers.RotatingFileHandler(logPath, maxBytes=(1048576 * 20), backupCount=7)
     fh.setFormatter(format)
+
+    if args.production_logging:
+        # The logging threads only queue the records, the writes and the formatting happen on the listener thread
+        queueHandler = logutil.startQueueLogging(args.log_level, [ch, fh])
+        REGISTRY.counterFunc("du_log_records_dropped_total", "Log records dropped by the full logging queue", {},
+                             lambda: queueHandler.dropped)
+        return
+    log = logging.getLogger('')
+    log.setLevel(args.log_level)
+    log.addHandler(ch)
     log.addHandler(fh)
 
 # Run the main loop
 try:
-    # sendTestFile()
-    initLogger(f"{SHARED_VOLUME_PATH}/sip_py.log")
+    initLogger(f"{SHARED_VOLUME_PATH}/sip_py{instanceSuffix()}.log")
     callTest = SipCall(args.profile)
     callTest.call()
 except KeyboardInterrupt:
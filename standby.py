@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+
+class HeartbeatSender:
+    """
+    Sends a heartbeat datagram to the standby socket periodically, from its own thread. Nobody may be
+    listening - the send errors are ignored.
+    """
+
+    def __init__(self, path, periodSec=0.25):
+        self.path = path
+        self.periodSec = periodSec
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.heartbeats = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info(f"Sending heartbeats to {path} every {periodSec} sec")
+
+    def run(self):
+        while True:
+            message = json.dumps({"pid": os.getpid(), "time": time.time(), "heartbeat": self.heartbeats})
+            try:
+                self.sock.sendto(message.encode(), self.path)
+                self.heartbeats += 1
+            except OSError:
+                pass
+            time.sleep(self.periodSec)
+
+
+class HeartbeatMonitor:
+    """
+    Listens on the standby socket for the heartbeats of the active instance and sets the failed event
+    once they stop for timeoutSec, or when none arrived within startGraceSec.
+    """
+
+    def __init__(self, path, timeoutSec=1.5, startGraceSec=10.0):
+        self.path = path
+        self.timeoutSec = timeoutSec
+        self.startGraceSec = startGraceSec
+        self.activePid = None
+        self.lastHeartbeatTime = None
+        self.failed = threading.Event()
+        if os.path.exists(path):
+            if HeartbeatMonitor.isListening(path):
+                raise RuntimeError(f"Another standby listens on {path}")
+            # Left by a monitor that died
+            os.remove(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        # The path may be bound again by another monitor later, only this socket file is removed
+        self.boundInode = os.stat(path).st_ino
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info(f"Standby: watching the active instance on {path}")
+
+    def run(self):
+        startTime = time.monotonic()
+        self.sock.settimeout(min(self.timeoutSec / 4, 0.5))
+        while True:
+            try:
+                message = json.loads(self.sock.recv(4096))
+                if self.activePid != message["pid"]:
+                    logging.info(f"Standby: active instance pid {message['pid']}")
+                self.activePid = message["pid"]
+                self.lastHeartbeatTime = time.monotonic()
+            except socket.timeout:
+                pass
+            except (ValueError, KeyError) as e:
+                logging.error(f"Standby: invalid heartbeat: {e}")
+            now = time.monotonic()
+            if self.lastHeartbeatTime is None:
+                if now - startTime >= self.startGraceSec:
+                    logging.error(f"Standby: no active instance for {self.startGraceSec} sec")
+                    break
+            elif now - self.lastHeartbeatTime >= self.timeoutSec:
+                logging.error(f"Standby: no heartbeat of pid {self.activePid} for {now - self.lastHeartbeatTime:.2f} sec")
+                break
+        self.sock.close()
+        try:
+            if os.stat(self.path).st_ino == self.boundInode:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.failed.set()
+
+    def fenceActive(self, waitSec=2.0):
+        """
+        Kills the silent active instance if it still runs, so its ports are free for the takeover. A
+        supervisor restarts its worker with --standby after that, see supervisor.Worker.
+        """
+        if not self.activePid:
+            return
+        try:
+            os.kill(self.activePid, signal.SIGKILL)
+            logging.warning(f"Standby: killed the active instance pid {self.activePid}")
+        except ProcessLookupError:
+            return
+        except PermissionError as e:
+            logging.error(f"Standby: cannot kill pid {self.activePid}: {e}")
+            return
+        deadline = time.monotonic() + waitSec
+        while time.monotonic() < deadline and HeartbeatMonitor.isRunning(self.activePid):
+            time.sleep(0.01)
+
+    @staticmethod
+    def isListening(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(path)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    @staticmethod
+    def isRunning(pid):
+        # A zombie has released its sockets already
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except OSError:
+            return False
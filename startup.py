@@ -0,0 +1,41 @@
+import logging
+import os
+import time
+
+
+class StartupProfile:
+    """
+    Time of every start up phase, from the process start until the first audio frame
+    """
+
+    def __init__(self, startTime):
+        self.startTime = startTime
+        self.lastTime = startTime
+        self.phases = []
+        self.reported = False
+
+    @staticmethod
+    def processStartTime():
+        """
+        The process start on the time.monotonic clock, so the interpreter start up is profiled too
+        """
+        try:
+            with open("/proc/self/stat") as stat:
+                startTicks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        except (OSError, ValueError, IndexError):
+            return time.monotonic()
+        sinceStartSec = time.clock_gettime(time.CLOCK_BOOTTIME) - startTicks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - sinceStartSec
+
+    def mark(self, phase, at=None):
+        at = time.monotonic() if at is None else at
+        self.phases.append({"phase": phase, "durationMs": round((at - self.lastTime) * 1000, 1),
+                            "sinceStartMs": round((at - self.startTime) * 1000, 1)})
+        self.lastTime = at
+
+    def report(self):
+        self.reported = True
+        logging.info("Start up profile:\n\t" + "\n\t".join(
+            f"{phase['phase']:24} {phase['durationMs']:9.1f} ms  (at {phase['sinceStartMs']:9.1f} ms)"
+            for phase in self.phases))
+        return self.phases
@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from callspec import CallSpec
+from metrics import Registry
+
+
+# Kept in sync with ducall.SHARED_VOLUME_PATH - the supervisor does not import pjsua2
+SHARED_VOLUME_PATH = "/tmp/du-sip"
+CLIENT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sip_client.py")
+# Kept in sync with the sip_client.py defaults, which the calls without their own ports inherit
+DEFAULT_DOWNPORT = 6600
+DEFAULT_UPPORT = 6700
+
+parser = argparse.ArgumentParser(description="Runs sip_client.py workers, each pinned to a CPU and serving "
+                                             "a share of the --call specs. All the unknown arguments are "
+                                             "passed to every worker.",
+                                 # A worker option must not be taken for the abbreviation of a supervisor option
+                                 allow_abbrev=False)
+parser.add_argument("--workers", type=int, default=0,
+                    help="Number of worker processes, by default one per call spec up to the number of CPUs")
+parser.add_argument("--cpus", default="", help="Comma separated CPUs to pin the workers to, round robin. "
+                                               "By default all the CPUs available to the supervisor")
+parser.add_argument("--restart-delay-sec", type=float, default=1.0)
+parser.add_argument("--status-period-sec", type=float, default=10.0)
+parser.add_argument("--metrics-base-port", type=int, default=0,
+                    help="Worker N serves its metrics on --metrics-port <base port + N>, its standby peer "
+                         "on <base port + workers + N>")
+parser.add_argument("--metrics-port", type=int, default=0,
+                    help="Serve the metrics of all the workers, labeled by worker, on 127.0.0.1:<port>/metrics. "
+                         "Needs --metrics-base-port")
+parser.add_argument("--call", action="append", default=[], help="Call spec, see sip_client.py --call")
+parser.add_argument("--standby-socket", default="",
+                    help="Run every worker as an active/standby pair watching each other on <path>.worker<N>, "
+                         "see sip_client.py --standby")
+
+# The worker options the supervisor has to know about, they are still passed to the workers
+portParser = argparse.ArgumentParser(add_help=False)
+portParser.add_argument("--downport", type=CallSpec.endpoint, default=DEFAULT_DOWNPORT)
+portParser.add_argument("--upport", type=CallSpec.endpoint, default=DEFAULT_UPPORT)
+
+
+def checkCallPorts(calls, clientArgs):
+    """
+    Every call of every worker needs its own ports - a call spec without ports inherits --downport and
+    --upport, and the second worker binding the same port would fail inside its downstream thread
+    """
+    portArgs, unknown = portParser.parse_known_args(clientArgs)
+    defaults = CallSpec("", portArgs.downport, portArgs.upport)
+    specs = [CallSpec.parse(call, defaults) for call in calls] or [defaults]
+    for field, option in (("downStreamPort", "downport"), ("upStreamPort", "upport")):
+        ports = [getattr(spec, field) for spec in specs if getattr(spec, field)]
+        shared = sorted({str(port) for port in ports if ports.count(port) > 1})
+        if shared:
+            parser.error(f"Calls share the {option} {', '.join(shared)}, give every --call its own {option}")
+
+
+class Worker:
+    def __init__(self, index, cpu, calls, clientArgs, metricsPort=0, standbySocket="", peer=False):
+        self.index = index
+        self.metricsPort = metricsPort
+        self.cpu = cpu
+        self.calls = calls
+        self.clientArgs = clientArgs
+        # The two instances of a pair serve the same calls, the peer starts as the standby
+        self.name = f"worker{index}-peer" if peer else f"worker{index}"
+        self.standbySocket = standbySocket
+        self.statusFile = os.path.join(SHARED_VOLUME_PATH, f"status_{self.name}.json")
+        self.process = None
+        self.startTime = 0
+        self.restarts = 0
+        self.lastExitCode = None
+        self.restartAt = 0
+        # The metrics endpoint answered the last scrape of the supervisor
+        self.scrapeOk = False
+        # An instance of an active/standby pair exits when it is fenced, or fails and gets fenced, after the
+        # other instance took over its calls - it comes back as the standby instead of dialing the calls again
+        self.paired = bool(standbySocket)
+        self.standby = peer
+
+    def command(self):
+        command = [sys.executable, CLIENT_SCRIPT] + self.clientArgs
+        if self.standbySocket:
+            command += ["--standby-socket", self.standbySocket]
+        if self.standby:
+            command.append("--standby")
+        for call in self.calls:
+            command += ["--call", call]
+        if self.metricsPort:
+            command += ["--metrics-port", str(self.metricsPort)]
+        return command + ["--instance-name", self.name, "--status-file", self.statusFile]
+
+    def start(self):
+        cpu = self.cpu
+
+        def pin():
+            if cpu is not None:
+                os.sched_setaffinity(0, {cpu})
+
+        if os.path.exists(self.statusFile):
+            os.remove(self.statusFile)
+        self.process = subprocess.Popen(self.command(), preexec_fn=pin)
+        self.startTime = time.monotonic()
+        logging.info(f"Started {self.name} pid {self.process.pid} on CPU {cpu} with calls {self.calls}")
+
+    def check(self, restartDelaySec):
+        """
+        Restarts the worker once its process exited and the restart delay passed
+        """
+        now = time.monotonic()
+        if self.process and self.process.poll() is not None:
+            self.lastExitCode = self.process.returncode
+            logging.error(f"{self.name} pid {self.process.pid} exited with {self.lastExitCode} "
+                          f"after {now - self.startTime:.1f} sec")
+            self.process = None
+            self.restartAt = now + restartDelaySec
+        if self.process is None and now >= self.restartAt:
+            self.restarts += 1
+            if self.paired and not self.standby:
+                self.standby = True
+                logging.warning(f"{self.name} restarts as the standby of the instance that took over its calls")
+            self.start()
+
+    def status(self):
+        status = {
+            "name": self.name,
+            "pid": self.process.pid if self.process else None,
+            "cpu": self.cpu,
+            "running": self.process is not None,
+            "uptimeSec": round(time.monotonic() - self.startTime, 1) if self.process else 0,
+            "restarts": self.restarts,
+            "standby": self.standby,
+            "lastExitCode": self.lastExitCode,
+            "metricsPort": self.metricsPort or None,
+        }
+        status["client"] = None
+        if self.process:
+            # The status file of a worker that exited describes calls that are gone
+            try:
+                with open(self.statusFile) as f:
+                    status["client"] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return status
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class MetricsAggregator(Registry):
+    """
+    Serves the metrics of the supervisor along with the ones scraped from every worker at request time,
+    with a worker label added to the worker series. A worker that does not answer is left out.
+    """
+
+    def __init__(self, workers, timeoutSec=1.0):
+        super().__init__()
+        self.workers = workers
+        self.timeoutSec = timeoutSec
+        for worker in workers:
+            labels = {"worker": worker.name}
+            self.gaugeFunc("du_worker_up", "Worker process running", labels,
+                           lambda worker=worker: int(worker.process is not None))
+            self.counterFunc("du_worker_restarts_total", "Worker process restarts", labels,
+                             lambda worker=worker: worker.restarts)
+            self.gaugeFunc("du_worker_scrape_ok", "Worker metrics answered at the last scrape", labels,
+                           lambda worker=worker: int(worker.scrapeOk))
+
+    def scrape(self, worker):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{worker.metricsPort}/metrics",
+                                        timeout=self.timeoutSec) as response:
+                worker.scrapeOk = True
+                return response.read().decode()
+        except OSError:
+            worker.scrapeOk = False
+            return ""
+
+    @staticmethod
+    def withLabel(sample, name, value):
+        brace = sample.find("{")
+        space = sample.find(" ")
+        if 0 <= brace < space:
+            return f'{sample[:brace + 1]}{name}="{value}",{sample[brace + 1:]}'
+        return f'{sample[:space]}{{{name}="{value}"}}{sample[space:]}'
+
+    def render(self):
+        # Samples grouped by metric family, so every family has a single HELP and TYPE
+        families = {}
+        for worker in self.workers:
+            if not worker.metricsPort:
+                continue
+            family = None
+            for line in self.scrape(worker).splitlines():
+                if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                    family = families.setdefault(line.split(" ")[2], {"meta": {}, "samples": []})
+                    family["meta"].setdefault(line.split(" ")[1], line)
+                elif line.strip() and family is not None:
+                    family["samples"].append(MetricsAggregator.withLabel(line, "worker", worker.name))
+        lines = [line for family in families.values() for line in
+                 [family["meta"][kind] for kind in ("HELP", "TYPE") if kind in family["meta"]] + family["samples"]]
+        return super().render() + "\n".join(lines) + ("\n" if lines else "")
+
+
+class Supervisor:
+    def __init__(self, args, clientArgs):
+        self.args = args
+        cpus = [int(cpu) for cpu in args.cpus.split(",")] if args.cpus else sorted(os.sched_getaffinity(0))
+        calls = args.call
+        workerCount = args.workers if args.workers > 0 else max(1, min(len(calls), len(cpus)))
+        workerCount = min(workerCount, max(1, len(calls)))
+        self.workers = []
+        for i in range(workerCount):
+            workerCalls = calls[i::workerCount]
+            cpu = cpus[i % len(cpus)] if cpus else None
+            metricsPort = args.metrics_base_port + i if args.metrics_base_port else 0
+            # Every pair has its own socket, so a standby only hears and fences the active of its own calls
+            standbySocket = f"{args.standby_socket}.worker{i}" if args.standby_socket else ""
+            self.workers.append(Worker(i, cpu, workerCalls, clientArgs, metricsPort, standbySocket))
+            if standbySocket:
+                peerMetricsPort = args.metrics_base_port + workerCount + i if args.metrics_base_port else 0
+                self.workers.append(Worker(i, cpu, workerCalls, clientArgs, peerMetricsPort, standbySocket, peer=True))
+        self.statusFile = os.path.join(SHARED_VOLUME_PATH, "supervisor_status.json")
+        self.metrics = MetricsAggregator(self.workers)
+        self.running = True
+
+    def status(self):
+        workers = [worker.status() for worker in self.workers]
+        calls = [call for worker in workers if worker["client"] for call in worker["client"]["calls"]]
+        return {
+            "time": time.time(),
+            "workers": workers,
+            "totals": {
+                "workersRunning": sum(1 for worker in workers if worker["running"]),
+                "restarts": sum(worker["restarts"] for worker in workers),
+                "calls": len(calls),
+                "callsValid": sum(1 for call in calls if call["state"] == "valid"),
+                "rssBytes": sum(worker["client"]["rssBytes"] for worker in workers if worker["client"]),
+                "cpuSec": round(sum(worker["client"]["cpuSec"] for worker in workers if worker["client"]), 1),
+            },
+        }
+
+    def writeStatus(self):
+        status = self.status()
+        tmpFile = self.statusFile + ".tmp"
+        with open(tmpFile, "w") as f:
+            json.dump(status, f, indent=1)
+        os.replace(tmpFile, self.statusFile)
+        totals = status["totals"]
+        logging.info(f"Workers running {totals['workersRunning']}/{len(self.workers)}, restarts {totals['restarts']}, "
+                     f"calls valid {totals['callsValid']}/{totals['calls']}, RSS {totals['rssBytes'] / 1048576:.1f} MB, "
+                     f"CPU {totals['cpuSec']} sec")
+
+    def stop(self, signum, frame):
+        logging.info(f"Got signal {signum}, stopping the workers")
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if self.args.metrics_port:
+            self.metrics.serve(self.args.metrics_port)
+        for worker in self.workers:
+            worker.start()
+        lastStatus = 0
+        while self.running:
+            for worker in self.workers:
+                worker.check(self.args.restart_delay_sec)
+            if time.monotonic() - lastStatus >= self.args.status_period_sec:
+                lastStatus = time.monotonic()
+                self.writeStatus()
+            time.sleep(0.2)
+        for worker in self.workers:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    os.makedirs(SHARED_VOLUME_PATH, mode=0o666, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - supervisor - %(levelname)s - %(message)s")
+    supervisorArgs, clientArgs = parser.parse_known_args()
+    checkCallPorts(supervisorArgs.call, clientArgs)
+    if "--standby" in clientArgs:
+        parser.error("The supervisor pairs the workers itself, give it --standby-socket instead of --standby")
+    if supervisorArgs.metrics_port and not supervisorArgs.metrics_base_port:
+        parser.error("--metrics-port needs --metrics-base-port")
+    Supervisor(supervisorArgs, clientArgs).run()
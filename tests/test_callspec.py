@@ -0,0 +1,46 @@
+import pytest
+
+from callspec import CallSpec
+
+DEFAULTS = CallSpec("sip:100@10.0.0.1", 6600, 6700, 16000, 40)
+
+
+def test_fields_override_the_defaults():
+    spec = CallSpec.parse("200@10.0.0.2,downport=6601,upport=6701,rate=8000,frame=20", DEFAULTS)
+    assert spec.destination == "sip:200@10.0.0.2"
+    assert (spec.downStreamPort, spec.upStreamPort, spec.sampleRate, spec.frameLenMs) == (6601, 6701, 8000, 20)
+
+
+def test_omitted_fields_keep_the_defaults():
+    spec = CallSpec.parse("downport=6602", DEFAULTS)
+    assert spec.destination == "sip:100@10.0.0.1"
+    assert (spec.downStreamPort, spec.upStreamPort, spec.frameLenMs) == (6602, 6700, 40)
+
+
+def test_ports_may_be_unix_socket_paths():
+    spec = CallSpec.parse("sip:1@h,downport=/tmp/du-sip/down.sock", DEFAULTS)
+    assert spec.downStreamPort == "/tmp/du-sip/down.sock"
+    assert CallSpec.isUnixSocket(spec.downStreamPort)
+    assert not CallSpec.isUnixSocket(spec.upStreamPort)
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(AssertionError, match="Unknown call spec field"):
+        CallSpec.parse("sip:1@h,codec=opus", DEFAULTS)
+
+
+def test_invalid_number_is_rejected():
+    with pytest.raises(ValueError):
+        CallSpec.parse("sip:1@h,rate=fast", DEFAULTS)
+
+
+def test_calls_need_their_own_ports():
+    with pytest.raises(AssertionError, match="downport"):
+        CallSpec.parseAll(["sip:1@h,upport=1", "sip:2@h,upport=2"], DEFAULTS)
+    specs = CallSpec.parseAll(["sip:1@h,downport=1,upport=3", "sip:2@h,downport=2,upport=4"], DEFAULTS)
+    assert [spec.downStreamPort for spec in specs] == [1, 2]
+
+
+def test_calls_need_a_destination():
+    with pytest.raises(AssertionError, match="destination"):
+        CallSpec.parseAll(["downport=1"], CallSpec("", 6600, 6700))
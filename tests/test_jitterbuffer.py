@@ -0,0 +1,53 @@
+from jitterbuffer import JitterBuffer
+
+
+def test_pre_roll_until_target_depth():
+    buffer = JitterBuffer(frameTimeMs=20, targetMs=60)
+    buffer.put("a")
+    buffer.put("b")
+    assert buffer.get() is None
+    assert not buffer.isPlaying()
+    buffer.put("c")
+    assert buffer.isPlaying()
+    assert [buffer.get(), buffer.get(), buffer.get()] == ["a", "b", "c"]
+
+
+def test_underrun_restarts_the_pre_roll():
+    buffer = JitterBuffer(frameTimeMs=20, targetMs=40)
+    buffer.put("a")
+    buffer.put("b")
+    assert buffer.get() == "a"
+    assert buffer.get() == "b"
+    assert buffer.get() is None
+    assert buffer.underruns == 1
+    buffer.put("c")
+    assert buffer.get() is None
+    buffer.put("d")
+    assert buffer.get() == "c"
+
+
+def test_drop_oldest_at_the_cap():
+    buffer = JitterBuffer(frameTimeMs=20, targetMs=20, maxMs=60)
+    for frame in "abcde":
+        buffer.put(frame)
+    assert buffer.depth() == 3
+    assert buffer.overflowDrops == 2
+    assert buffer.get() == "c"
+
+
+def test_time_compression_skips_a_frame_above_target():
+    buffer = JitterBuffer(frameTimeMs=20, targetMs=20, maxMs=2000, policy=JitterBuffer.TIME_COMPRESS)
+    for i in range(JitterBuffer.COMPRESS_AFTER_FRAMES + 10):
+        buffer.put(i)
+    played = [buffer.get() for _ in range(JitterBuffer.COMPRESS_AFTER_FRAMES)]
+    assert buffer.compressDrops == 1
+    assert played[-1] == JitterBuffer.COMPRESS_AFTER_FRAMES
+
+
+def test_flush_empties_and_stops_playout():
+    buffer = JitterBuffer(frameTimeMs=20, targetMs=20)
+    buffer.put("a")
+    buffer.flush()
+    assert buffer.depth() == 0
+    assert buffer.get() is None
+    assert buffer.stats()["underruns"] == 0
@@ -0,0 +1,77 @@
+import re
+
+from metrics import Histogram, Registry
+
+
+def test_percentiles_within_the_bucket_error():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.count == 1000
+    assert histogram.max == 1000
+    for percent, exact in ((50, 500), (90, 900), (99, 990)):
+        assert exact <= histogram.percentile(percent) <= exact * 1.25
+    assert histogram.percentile(100) == 1000
+
+
+def test_small_values_are_exact():
+    histogram = Histogram()
+    for value in (0, 1, 2, 3):
+        histogram.record(value)
+    assert [histogram.percentile(percent) for percent in (25, 50, 75, 100)] == [0, 1, 2, 3]
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(99) == 0
+    assert histogram.summary()["mean"] == 0
+
+
+def test_since_snapshot_holds_only_the_new_values():
+    histogram = Histogram()
+    for value in range(100):
+        histogram.record(value)
+    snapshot = histogram.snapshot()
+    histogram.record(5000)
+    delta = histogram.since(snapshot)
+    assert delta.count == 1
+    assert 5000 <= delta.percentile(50) <= 5000 * 1.25
+    assert histogram.since(histogram.snapshot()).count == 0
+
+
+def renderedBounds(text, name):
+    return re.findall(rf'{name}_bucket{{.*le="([^"]+)"}}', text)
+
+
+def test_render_emits_the_same_buckets_every_scrape():
+    registry = Registry()
+    histogram = registry.histogram("du_test_us", "Test", {"port": "6600"})
+    empty = registry.render()
+    histogram.record(7)
+    histogram.record(300)
+    histogram.record(300000)
+    filled = registry.render()
+    assert renderedBounds(empty, "du_test_us") == renderedBounds(filled, "du_test_us")
+    assert renderedBounds(filled, "du_test_us")[-1] == "+Inf"
+    assert 'du_test_us_bucket{port="6600",le="15"} 1' in filled
+    assert 'du_test_us_bucket{port="6600",le="511"} 2' in filled
+    assert 'du_test_us_bucket{port="6600",le="+Inf"} 3' in filled
+    assert 'du_test_us_count{port="6600"} 3' in filled
+
+
+def test_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("du_test_us", "Test", {})
+    for value in range(0, 100000, 37):
+        histogram.record(value)
+    counts = [int(count) for count in re.findall(r'du_test_us_bucket\{le="[^"]+"\} (\d+)', registry.render())]
+    assert counts == sorted(counts)
+    assert counts[-1] == histogram.count
+
+
+def test_counters_and_gauges_are_read_at_render_time():
+    registry = Registry()
+    state = {"frames": 1}
+    registry.counterFunc("du_frames_total", "Frames", {"port": "1"}, lambda: state["frames"])
+    state["frames"] = 5
+    assert 'du_frames_total{port="1"} 5' in registry.render()
@@ -0,0 +1,67 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from plc import Concealer
+
+CLOCK_RATE = 16000
+FRAME_SIZE = 640
+
+
+def voiced(hz, frames, amplitude=8000):
+    samples = amplitude * np.sin(2 * np.pi * hz * np.arange(frames * FRAME_SIZE // 2) / CLOCK_RATE)
+    data = np.rint(samples).astype("<i2").tobytes()
+    return [data[i:i + FRAME_SIZE] for i in range(0, len(data), FRAME_SIZE)]
+
+
+def test_nothing_to_conceal_before_audio_was_played():
+    concealer = Concealer(CLOCK_RATE, FRAME_SIZE)
+    assert concealer.conceal() is None
+    assert concealer.concealedFrames == 0
+
+
+def test_pitch_period_of_the_last_frames():
+    concealer = Concealer(CLOCK_RATE, FRAME_SIZE)
+    for frame in voiced(200, 5):
+        concealer.played(frame)
+    # A pure tone repeats after every whole number of periods, any of them continues it seamlessly
+    period = len(concealer.lastPitchPeriod())
+    assert period % (CLOCK_RATE // 200) == 0
+    assert concealer.minLag <= period <= concealer.maxLag
+
+
+def test_concealment_fades_out_into_the_noise_floor():
+    concealer = Concealer(CLOCK_RATE, FRAME_SIZE, repeatMs=60)
+    for frame in voiced(200, 5):
+        concealer.played(frame)
+    frames = [np.frombuffer(concealer.conceal(), dtype="<i2") for _ in range(4)]
+    assert all(len(frame) == FRAME_SIZE // 2 for frame in frames)
+    # The first concealed frame continues the tone, the repetition has faded out after 60 ms
+    assert np.abs(frames[0]).max() > 4000
+    assert np.abs(frames[-1]).max() <= Concealer.MAX_NOISE_RMS * 6
+    assert concealer.concealedFrames == 4
+    assert concealer.noiseFrames == 1
+
+
+def test_real_frame_after_concealment_is_cross_faded():
+    concealer = Concealer(CLOCK_RATE, FRAME_SIZE)
+    frames = voiced(200, 7)
+    for frame in frames[:5]:
+        concealer.played(frame)
+    concealer.conceal()
+    faded = concealer.played(frames[6])
+    assert concealer.crossFades == 1
+    assert faded != frames[6]
+    # Only the cross fade samples change
+    fade = concealer.crossFadeSamples * 2
+    assert faded[fade:] == frames[6][fade:]
+    # The next real frame passes through untouched
+    assert concealer.played(frames[5]) == frames[5]
+
+
+def test_reset_stops_the_concealment():
+    concealer = Concealer(CLOCK_RATE, FRAME_SIZE)
+    for frame in voiced(200, 5):
+        concealer.played(frame)
+    concealer.reset()
+    assert concealer.conceal() is None
@@ -0,0 +1,46 @@
+from recovery import CallRecovery
+
+
+def test_healthy_call_takes_no_action():
+    recovery = CallRecovery("test")
+    assert recovery.update(None, now=0) is None
+    assert recovery.update(CallRecovery.PENDING, now=1) is None
+    assert recovery.stats == {}
+
+
+def test_media_timeout_ladder_escalates_after_each_grace_period():
+    recovery = CallRecovery("test")
+    now = 0
+    actions = []
+    ladder = CallRecovery.LADDERS[CallRecovery.FAULT_MEDIA_TIMEOUT]
+    for _ in ladder:
+        action = recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=now)
+        actions.append(action)
+        if CallRecovery.STEP_GRACE_SEC[action]:
+            # Nothing more within the grace period of the step
+            assert recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=now + 0.5) is None
+        now += CallRecovery.STEP_GRACE_SEC[action] + 0.5
+    assert actions == ladder
+    # The ladder stays on its last step
+    assert recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=now) == CallRecovery.EXIT
+
+
+def test_recovery_is_recorded_and_restarts_the_ladder():
+    recovery = CallRecovery("test")
+    assert recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=10) == CallRecovery.RESET_MEDIA
+    assert recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=12) == CallRecovery.REINVITE
+    assert recovery.update(None, now=13.5) is None
+    stats = recovery.stats[CallRecovery.FAULT_MEDIA_TIMEOUT]
+    assert stats["faults"] == 1 and stats["recovered"] == 1
+    assert stats["lastRecoverSec"] == 3.5
+    assert stats["recoveredBy"] == {CallRecovery.REINVITE: 1}
+    assert recovery.update(CallRecovery.FAULT_MEDIA_TIMEOUT, now=20) == CallRecovery.RESET_MEDIA
+    assert recovery.stats[CallRecovery.FAULT_MEDIA_TIMEOUT]["faults"] == 2
+
+
+def test_not_started_call_is_redialed_then_exits():
+    recovery = CallRecovery("test")
+    first = recovery.update(CallRecovery.FAULT_NOT_STARTED, now=0)
+    second = recovery.update(CallRecovery.FAULT_NOT_STARTED, now=15)
+    third = recovery.update(CallRecovery.FAULT_NOT_STARTED, now=30)
+    assert [first, second, third] == [CallRecovery.REDIAL, CallRecovery.REDIAL, CallRecovery.EXIT]
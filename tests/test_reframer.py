@@ -0,0 +1,35 @@
+from reframer import Reframer
+
+
+def test_frame_size_of_the_port_format():
+    assert Reframer.frameSizeOf(16000, 40000, 1, 16) == 1280
+    assert Reframer.frameSizeOf(48000, 20000, 2, 16) == 3840
+
+
+def test_exact_frames_pass_through():
+    reframer = Reframer(4)
+    assert reframer.push(b"abcd") == [b"abcd"]
+    assert reframer.pendingBytes() == 0
+
+
+def test_remainder_is_carried_to_the_next_datagram():
+    reframer = Reframer(4)
+    assert reframer.push(b"abcdef") == [b"abcd"]
+    assert reframer.pendingBytes() == 2
+    assert reframer.push(b"gh") == [b"efgh"]
+    assert reframer.pendingBytes() == 0
+
+
+def test_short_datagrams_accumulate():
+    reframer = Reframer(4)
+    assert reframer.push(b"a") == []
+    assert reframer.push(b"b") == []
+    assert reframer.push(b"cdefghijk") == [b"abcd", b"efgh"]
+    assert reframer.pendingBytes() == 3
+
+
+def test_reset_drops_the_remainder():
+    reframer = Reframer(4)
+    reframer.push(b"abcdef")
+    reframer.reset()
+    assert reframer.push(b"wxyz") == [b"wxyz"]
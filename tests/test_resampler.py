@@ -0,0 +1,57 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from resampler import Resampler
+
+
+def tone(rate, seconds, hz, amplitude=10000):
+    return amplitude * np.sin(2 * np.pi * hz * np.arange(int(rate * seconds)) / rate)
+
+
+def test_same_rate_s16_passes_through():
+    samples = np.arange(-320, 320, dtype="<i2")
+    resampler = Resampler(16000, 16000, frameTimeUsec=20000)
+    assert resampler.push(samples.tobytes()) == samples.tobytes()
+
+
+def test_partial_frames_wait_for_the_rest():
+    resampler = Resampler(16000, 16000, frameTimeUsec=20000)
+    data = np.zeros(320, dtype="<i2").tobytes()
+    assert resampler.push(data[:100]) == b""
+    assert len(resampler.push(data[100:])) == len(data)
+
+
+def test_formats_and_channels_are_converted_to_s16_mono():
+    left = np.full(160, 0.25, dtype="<f4")
+    right = np.full(160, 0.75, dtype="<f4")
+    stereo = np.column_stack((left, right)).ravel()
+    resampler = Resampler(8000, 8000, inChannels=2, inFormat=Resampler.F32, frameTimeUsec=20000)
+    out = np.frombuffer(resampler.push(stereo.tobytes()), dtype="<i2")
+    assert (out == 16384).all()
+
+    u8 = np.full(160, 192, dtype="u1")
+    resampler = Resampler(8000, 8000, inFormat=Resampler.U8, frameTimeUsec=20000)
+    assert (np.frombuffer(resampler.push(u8.tobytes()), dtype="<i2") == 16384).all()
+
+
+def test_downsampling_keeps_the_duration():
+    resampler = Resampler(48000, 16000, frameTimeUsec=20000)
+    data = np.rint(tone(48000, 1, 440)).astype("<i2").tobytes()
+    out = resampler.push(data)
+    assert abs(len(out) // 2 - 16000) <= 1
+
+
+def test_batches_give_the_output_of_one_push():
+    data = np.rint(tone(44100, 0.5, 300)).astype("<i2").tobytes()
+    whole = Resampler(44100, 16000, frameTimeUsec=20000).push(data)
+    resampler = Resampler(44100, 16000, frameTimeUsec=20000)
+    pieces = b"".join(resampler.push(data[i:i + 1000]) for i in range(0, len(data), 1000))
+    assert pieces == whole
+
+
+def test_downsampling_filters_above_the_new_nyquist_rate():
+    resampler = Resampler(48000, 8000, frameTimeUsec=20000)
+    # 7 kHz folds to 1 kHz at 8 kHz without the low pass filter
+    out = np.frombuffer(resampler.push(np.rint(tone(48000, 1, 7000)).astype("<i2").tobytes()), dtype="<i2")
+    assert np.abs(out[100:]).max() < 1000
@@ -0,0 +1,86 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vad import VoiceActivityDetector
+
+FRAME_TIME_MS = 20
+FRAME_SAMPLES = 320
+
+
+def tone(amplitude=8000):
+    samples = amplitude * np.sin(2 * np.pi * 200 * np.arange(FRAME_SAMPLES) / 16000)
+    return np.rint(samples).astype("<i2").tobytes()
+
+
+def silence():
+    # About -66 dBFS, well below the default threshold
+    return np.random.default_rng(1).normal(0, 15, FRAME_SAMPLES).astype("<i2").tobytes()
+
+
+def test_speech_and_silence_are_told_apart():
+    vad = VoiceActivityDetector(hangoverMs=0, frameTimeMs=FRAME_TIME_MS)
+    assert vad.isSpeech(tone())
+    assert not vad.isSpeech(silence())
+    assert not vad.isSpeech(b"")
+    assert vad.speechFrames == 1
+    assert vad.silentFrames == 2
+
+
+def test_threshold_in_dbfs():
+    # A sine of amplitude A has the power A^2 / 2, -20 dBFS is about amplitude 4634
+    vad = VoiceActivityDetector(thresholdDb=-20, hangoverMs=0, frameTimeMs=FRAME_TIME_MS)
+    assert vad.isSpeech(tone(5000))
+    assert not vad.isSpeech(tone(4000))
+
+
+def test_hangover_keeps_the_speech_state_after_the_last_loud_frame():
+    vad = VoiceActivityDetector(hangoverMs=60, frameTimeMs=FRAME_TIME_MS)
+    assert vad.hangoverFrames == 3
+    assert vad.keep(tone())
+    assert [vad.keep(silence()) for _ in range(5)] == [True, True, True, False, False]
+    # Speech restarts the hangover
+    assert vad.keep(tone())
+    assert vad.keep(silence())
+
+
+def test_silent_frames_are_suppressed_and_counted():
+    vad = VoiceActivityDetector(hangoverMs=0, frameTimeMs=FRAME_TIME_MS)
+    frame = silence()
+    assert not any(vad.keep(frame) for _ in range(4))
+    assert vad.stats()["suppressedFrames"] == 4
+    assert vad.stats()["bytesSaved"] == 4 * len(frame)
+
+
+def test_thinning_keeps_one_of_every_silent_frames():
+    vad = VoiceActivityDetector(hangoverMs=0, frameTimeMs=FRAME_TIME_MS, keepEvery=3)
+    kept = [vad.keep(silence()) for _ in range(7)]
+    assert kept == [True, False, False, True, False, False, True]
+    assert vad.suppressedFrames == 4
+    # A speech frame starts a new silent run
+    assert vad.keep(tone())
+    assert vad.keep(silence())
+
+
+def test_modes_apply_to_their_directions():
+    assert VoiceActivityDetector.applies(VoiceActivityDetector.BOTH, VoiceActivityDetector.UPSTREAM)
+    assert VoiceActivityDetector.applies(VoiceActivityDetector.DOWNSTREAM, VoiceActivityDetector.DOWNSTREAM)
+    assert not VoiceActivityDetector.applies(VoiceActivityDetector.UPSTREAM, VoiceActivityDetector.DOWNSTREAM)
+    assert not VoiceActivityDetector.applies(VoiceActivityDetector.OFF, VoiceActivityDetector.UPSTREAM)
+
+
+def test_suppressed_downstream_frames_go_to_pjsip_without_audio():
+    import pjstandin
+    pjstandin.install()
+    import pjsua2 as pj
+    import ducall
+    vad = VoiceActivityDetector(hangoverMs=0, frameTimeMs=FRAME_TIME_MS)
+    port = ducall.CustomMediaPort(ducall.WatchdogData(name="vad"), None, None, frameSize=2 * FRAME_SAMPLES,
+                                  frameTimeMs=FRAME_TIME_MS, jitterTargetMs=FRAME_TIME_MS, downstreamVad=vad)
+    port.processStreamAsIs(silence() + tone())
+    frames = []
+    for _ in range(2):
+        frame = pj.MediaFrame()
+        port.onFrameRequested(frame)
+        frames.append((frame.type, frame.size))
+    assert frames == [(pj.PJMEDIA_TYPE_NONE, 0), (pj.PJMEDIA_TYPE_AUDIO, 2 * FRAME_SAMPLES)]
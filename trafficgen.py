@@ -0,0 +1,253 @@
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import itertools
+import math
+import mmap
+import random
+import socket
+import time
+from array import array
+
+from metrics import Histogram
+from reframer import Reframer
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long),
+                ("tv_nsec", ctypes.c_long)]
+
+
+def _loadClockNanosleep():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.clock_nanosleep.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(Timespec), ctypes.POINTER(Timespec)]
+        libc.clock_nanosleep.restype = ctypes.c_int
+        return libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+
+
+_clockNanosleep = _loadClockNanosleep()
+
+
+def sleepUntil(deadlineNs):
+    """
+    Sleeps until the CLOCK_MONOTONIC deadline (time.monotonic_ns). An absolute deadline does not
+    accumulate the wake up latency of the previous sleeps the way relative sleeps do.
+    """
+    if _clockNanosleep:
+        deadline = Timespec(deadlineNs // 1000000000, deadlineNs % 1000000000)
+        while _clockNanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(deadline), None) == errno.EINTR:
+            pass
+        return
+    delay = (deadlineNs - time.monotonic_ns()) / 1e9
+    if delay > 0:
+        time.sleep(delay)
+
+
+class PcmSource:
+    """
+    Frames of a raw PCM file, memory mapped so many streams share the pages without reading the file,
+    or of a generated tone when no file is given. The source loops.
+    """
+
+    def __init__(self, frameSize, fileName=None, sampleRate=16000):
+        self.frameSize = frameSize
+        if fileName:
+            with open(fileName, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._map)
+        else:
+            tone = array("h", (int(8000 * math.sin(2 * math.pi * 440 * i / sampleRate)) for i in range(sampleRate)))
+            self._data = memoryview(tone.tobytes())
+        self.frameCount = len(self._data) // frameSize
+        assert self.frameCount > 0, f"The source is shorter than one {frameSize} bytes frame"
+
+    def frame(self, index):
+        start = (index % self.frameCount) * self.frameSize
+        return self._data[start:start + self.frameSize]
+
+
+class Impairment:
+    """
+    Network impairments applied to the send schedule: random loss, bursts (a group of frames held
+    back and sent at once) and random delay of up to jitterMs
+    """
+
+    def __init__(self, periodNs, jitterMs=0, lossPercent=0, burstEvery=0, burstFrames=0, seed=None):
+        self.periodNs = periodNs
+        self.jitterNs = int(jitterMs * 1000000)
+        self.lossPercent = lossPercent
+        self.burstEvery = burstEvery
+        self.burstFrames = min(burstFrames, burstEvery)
+        self._random = random.Random(seed)
+
+    def sendTime(self, index, nominalNs):
+        """
+        Returns the time to send the frame at or None when it is lost
+        """
+        if self.lossPercent and self._random.random() * 100 < self.lossPercent:
+            return None
+        if self.burstFrames > 1:
+            position = index % self.burstEvery
+            if position < self.burstFrames:
+                nominalNs += (self.burstFrames - 1 - position) * self.periodNs
+        if self.jitterNs:
+            nominalNs += self._random.randrange(self.jitterNs)
+        return nominalNs
+
+
+class Stream:
+    def __init__(self, host, port, startNs, firstFrame):
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((host, port))
+        self.startNs = startNs
+        self.firstFrame = firstFrame
+        self.lastSentIndex = -1
+        self.sent = 0
+        self.lost = 0
+        self.reordered = 0
+        self.sendErrors = 0
+
+
+class TrafficGenerator:
+    """
+    Sends PCM frames to many UDP ports at the frame clock from one thread. The frames wait in a heap
+    ordered by their send time, and the thread sleeps until the earliest one. Every frame is scheduled
+    from its own nominal deadline, start + index * period, plus its injected delay, so a frame delayed
+    by the jitter is overtaken by the next ones and arrives reordered. The pacing error - how late a
+    frame left compared with the deadline it slept until - and the injected delay are measured apart.
+    """
+
+    def __init__(self, source, host, ports, frameTimeMs, impairment, stagger=True):
+        self.source = source
+        self.periodNs = int(frameTimeMs * 1000000)
+        self.impairment = impairment
+        startNs = time.monotonic_ns() + self.periodNs
+        # Staggered streams spread the sends over the period instead of sending all at the same instant
+        offsetNs = self.periodNs // len(ports) if stagger else 0
+        # Every stream starts at another place of the source, so the streams are not identical
+        self.streams = [Stream(host, port, startNs + i * offsetNs, i * 7) for i, port in enumerate(ports)]
+        self.pacingError = Histogram()
+        self.totalPacingError = Histogram()
+        self.injectedDelay = Histogram()
+        self.totalInjectedDelay = Histogram()
+        self.runStartNs = time.monotonic_ns()
+        self._queue = []
+        # Orders the frames scheduled for the same nanosecond
+        self._sequence = itertools.count()
+        for stream in self.streams:
+            self.schedule(stream, 0)
+
+    def schedule(self, stream, index):
+        """
+        Queues the frame at its send time, and the scheduling of the next frame at the next nominal deadline.
+        The impairments only delay frames, so a frame is always queued before its send time.
+        """
+        nominalNs = stream.startNs + index * self.periodNs
+        sendNs = self.impairment.sendTime(index, nominalNs)
+        if sendNs is None:
+            stream.lost += 1
+        else:
+            heapq.heappush(self._queue, (sendNs, next(self._sequence), stream, index, sendNs - nominalNs))
+        # An entry without a delay schedules the frame instead of sending it
+        heapq.heappush(self._queue, (nominalNs + self.periodNs, next(self._sequence), stream, index + 1, None))
+
+    def run(self, durationSec=0, reportSec=10):
+        self.runStartNs = startNs = time.monotonic_ns()
+        endNs = startNs + int(durationSec * 1e9) if durationSec else None
+        nextReportNs = startNs + int(reportSec * 1e9)
+        while self._queue:
+            sendNs, sequence, stream, index, delayNs = heapq.heappop(self._queue)
+            if endNs and sendNs >= endNs:
+                break
+            if delayNs is None:
+                self.schedule(stream, index)
+                continue
+            sleepUntil(sendNs)
+            try:
+                stream.sock.send(self.source.frame(stream.firstFrame + index))
+                stream.sent += 1
+            except OSError:
+                # ECONNREFUSED while nobody listens on the port
+                stream.sendErrors += 1
+            now = time.monotonic_ns()
+            if index < stream.lastSentIndex:
+                stream.reordered += 1
+            stream.lastSentIndex = max(stream.lastSentIndex, index)
+            self.pacingError.record((now - sendNs) // 1000)
+            self.totalPacingError.record((now - sendNs) // 1000)
+            self.injectedDelay.record(delayNs // 1000)
+            self.totalInjectedDelay.record(delayNs // 1000)
+            if now >= nextReportNs:
+                nextReportNs += int(reportSec * 1e9)
+                self.report(self.pacingError, self.injectedDelay)
+                self.pacingError = Histogram()
+                self.injectedDelay = Histogram()
+        self.report(self.totalPacingError, self.totalInjectedDelay, "total")
+
+    def report(self, error, delay, label=""):
+        elapsedNs = max(time.monotonic_ns() - self.runStartNs, 1)
+        sent = sum(stream.sent for stream in self.streams)
+        lost = sum(stream.lost for stream in self.streams)
+        reordered = sum(stream.reordered for stream in self.streams)
+        errors = sum(stream.sendErrors for stream in self.streams)
+        print(f"{elapsedNs / 1e9:8.1f} sec {label:5} {len(self.streams)} streams  sent {sent} ({sent / (elapsedNs / 1e9):.0f} pkt/s)  "
+              f"lost {lost}  reordered {reordered}  send errors {errors}  pacing error usec p50 {error.percentile(50)} "
+              f"p99 {error.percentile(99)} p99.9 {error.percentile(99.9)} max {error.max}  "
+              f"injected delay usec p50 {delay.percentile(50)} max {delay.max}", flush=True)
+
+
+def parsePorts(text):
+    """
+    '6600,6602' or '6600-6609'
+    """
+    ports = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            ports.extend(range(int(first), int(last) + 1))
+        else:
+            ports.append(int(part))
+    return ports
+
+
+parser = argparse.ArgumentParser(description="Sends PCM streams to the client downstream ports paced on absolute "
+                                             "deadlines, with optional loss, burst and jitter injection")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--ports", type=parsePorts, default=[6600], help="Comma separated ports or ranges, one stream each")
+parser.add_argument("--file", default=None, help="Raw PCM source, a 440 Hz tone when omitted")
+parser.add_argument("--sample-rate", type=int, default=16000)
+parser.add_argument("--frame-length-msec", type=float, default=40)
+parser.add_argument("--frame-size", type=int, default=0, help="Bytes per frame, by default 16 bit mono of the rate and length")
+parser.add_argument("--duration-sec", type=float, default=0, help="0 runs until interrupted")
+parser.add_argument("--report-sec", type=float, default=10)
+parser.add_argument("--jitter-msec", type=float, default=0, help="Random extra delay of every frame, up to that much")
+parser.add_argument("--loss-percent", type=float, default=0)
+parser.add_argument("--burst-every", type=int, default=0, help="Period of the bursts in frames")
+parser.add_argument("--burst-frames", type=int, default=0, help="Frames held back and sent at once in every burst")
+parser.add_argument("--seed", type=int, default=None, help="Makes the impairments reproducible")
+parser.add_argument("--no-stagger", action="store_true", help="Send the frames of all the streams at the same instant")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    frameSize = args.frame_size or Reframer.frameSizeOf(args.sample_rate, int(args.frame_length_msec * 1000), 1, 16)
+    source = PcmSource(frameSize, args.file, args.sample_rate)
+    periodNs = int(args.frame_length_msec * 1000000)
+    impairment = Impairment(periodNs, args.jitter_msec, args.loss_percent, args.burst_every, args.burst_frames, args.seed)
+    generator = TrafficGenerator(source, args.host, args.ports, args.frame_length_msec, impairment,
+                                 stagger=not args.no_stagger)
+    print(f"Sending {frameSize} bytes frames every {args.frame_length_msec} ms to {args.host} ports {args.ports}, "
+          f"{'clock_nanosleep' if _clockNanosleep else 'sleep'} pacing", flush=True)
+    try:
+        generator.run(args.duration_sec, args.report_sec)
+    except KeyboardInterrupt:
+        generator.report(generator.totalPacingError, generator.totalInjectedDelay, "total")
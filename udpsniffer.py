@@ -1,44 +1,193 @@
+import ctypes
+import logging
+import os
+import select
 import socket
 import struct
 
+from mmsg import MMsgReceiver
+from packetring import PacketRing
+import mmsg
+
 SIZE_OF_BUFFER = 1024 * 4
+# Loopback MTU plus the link layer header
+SIZE_OF_SNIFF_BUFFER = 65536 + 14
+# AF_UNIX datagrams are charged to the sender buffer until read, so both ends get a large one.
+# The receive queue length is capped by net.unix.max_dgram_qlen as well.
+UNIX_SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+SO_ATTACH_FILTER = 26
+ETH_HEADER_LEN = 14
+UDP_HEADER_LEN = 8
+SO_BUSY_POLL = 46
+
+
 class UdpSniffer:
+    RECVFROM_BACKEND = "recvfrom"
+    MMAP_BACKEND = "mmap"
+    SNIFFER_BACKENDS = [RECVFROM_BACKEND, MMAP_BACKEND]
+
     APv4_PROTOCOL = 0x0800
     IP_UDP_PROTOCOL = 17
+    PACKET_HOST = 0
 
-    def __init__(self, port=6600):
+    # Classic BPF opcodes
+    BPF_LD_B_ABS = 0x30
+    BPF_LD_H_ABS = 0x28
+    BPF_LD_H_IND = 0x48
+    BPF_LDX_B_MSH = 0xb1
+    BPF_JEQ_K = 0x15
+    BPF_JSET_K = 0x45
+    BPF_RET_K = 0x06
+    SKF_AD_PKTTYPE = 0xfffff000 + 4
+
+    def __init__(self, port=6600, batchSize=16, timeoutMs=1000, rcvBufSize=0, timestamps=True, busyPollUsec=0):
         self._port = port
+        self._busyPollUsec = busyPollUsec
+        self._timestamps = timestamps
+        self._batchSize = batchSize
+        self._timeoutMs = timeoutMs
+        self._rcvBufSize = rcvBufSize
 
-    def read(self, dataProcessor):
+    def createSocket(self):
+        if isinstance(self._port, str):
+            return self.createUnixSocket()
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self._rcvBufSize > 0:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvBufSize)
+            logging.info(f"Downstream socket receive buffer: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}")
+        if self._busyPollUsec > 0:
+            # The blocking receive spins on the device queue that long before sleeping, which saves the wake up
+            # latency when the NIC supports it. Raising it above net.core.busy_read needs CAP_NET_ADMIN.
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, self._busyPollUsec)
+                logging.info(f"Downstream socket busy poll: {self._busyPollUsec} usec")
+            except OSError as e:
+                logging.warning(f"Cannot set SO_BUSY_POLL {self._busyPollUsec} usec on the downstream socket: {e}")
         sock.bind(("0.0.0.0", self._port))
+        return sock
+
+    def createUnixSocket(self):
+        """
+        Datagram socket bound to the path the Streamer sends to, instead of a loopback UDP port:
+        no IP/UDP processing per frame
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvBufSize or UNIX_SOCKET_BUFFER_SIZE)
+        # Left behind by a previous run
+        if os.path.exists(self._port):
+            os.remove(self._port)
+        sock.bind(self._port)
+        logging.info(f"Downstream Unix socket {self._port}, receive buffer "
+                     f"{sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}")
+        return sock
+
+    def read(self, dataProcessor):
+        sock = self.createSocket()
         while True:
             raw_data, addr = sock.recvfrom(SIZE_OF_BUFFER)
             dataProcessor(raw_data)
-    def sniff(self, dataProcessor):
-        logging.info(f"Creating UdpSniffer on port {self._port}")
+
+    def readBatched(self, batchProcessor):
+        """
+        Passes every datagram already waiting in the socket (up to the batch size) to batchProcessor
+        as a list of memoryviews, with one recvmmsg call, along with the list of their kernel receive
+        timestamps (None when disabled). The views point to reused buffers - the processor has to copy
+        the data it keeps. After timeoutMs without data the processor gets an empty list.
+        """
+        sock = self.createSocket()
+        receiver = MMsgReceiver(sock, self._batchSize, SIZE_OF_BUFFER, timestamps=self._timestamps)
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        logging.info(f"Batched reading on port {self._port}: batch {self._batchSize}, timeout {self._timeoutMs} ms, "
+                     f"recvmmsg {'supported' if mmsg.isSupported() else 'not supported, using recv_into'}")
+        while True:
+            if not poller.poll(self._timeoutMs):
+                batchProcessor([], None)
+                continue
+            batchProcessor(*receiver.receive())
+
+    def createSnifferSocket(self):
         snifferSocket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+        try:
+            UdpSniffer.attachFilter(snifferSocket, UdpSniffer.udpPortFilter(self._port))
+            logging.info(f"Attached kernel filter for UDP port {self._port}")
+        except OSError as e:
+            logging.error(f"Cannot attach kernel filter, all the loopback traffic will be filtered in Python: {e}")
         snifferSocket.bind(("lo", 0))
-        pktCount = 0
+        return snifferSocket
+
+    def sniff(self, dataProcessor):
+        logging.info(f"Creating UdpSniffer on port {self._port}")
+        snifferSocket = self.createSnifferSocket()
+        buffer = bytearray(SIZE_OF_SNIFF_BUFFER)
+        bufferView = memoryview(buffer)
         logging.info(f"Created UdpSniffer on port {self._port}")
         while True:
-            raw_data, addr = snifferSocket.recvfrom(SIZE_OF_BUFFER)
-            # logging.info(f"UDP sniffer started on interface: {addr}")
-            if UdpSniffer.pktProtocol(addr) != self.APv4_PROTOCOL or UdpSniffer.pktInterfaceIndex(addr) != 0:
+            size, addr = snifferSocket.recvfrom_into(buffer)
+            # The kernel filter already drops everything else, the checks below only cover the packets
+            # queued before the filter was attached
+            if UdpSniffer.pktProtocol(addr) != self.APv4_PROTOCOL or UdpSniffer.pktInterfaceIndex(addr) != self.PACKET_HOST:
                 continue
-            # Parse IP header
-            if UdpSniffer.ipProtocol(raw_data) == self.IP_UDP_PROTOCOL:
-                # Parse UDP header
-                udp_header = raw_data[34:42]
-                udp_header_data = struct.unpack('!HHHH', udp_header)
-                udp_src_port = udp_header_data[0]
-                udp_dest_port = udp_header_data[1]
-
-                # logging.info(f"ports: {udp_header_data[0]} {udp_header_data[1]}")
-                # Extract UDP payload
-                if udp_dest_port == self._port:
-                    udp_payload = raw_data[42:]
-                    dataProcessor(udp_payload)
+            payload = self.udpPayload(bufferView[:size])
+            if payload is not None:
+                dataProcessor(payload, None)
+
+    def sniffRing(self, dataProcessor):
+        logging.info(f"Creating UdpSniffer with TPACKET_V3 ring on port {self._port}")
+        ring = PacketRing(self.createSnifferSocket())
+
+        def processPacket(packet, pktType, timestampNs):
+            if pktType != self.PACKET_HOST:
+                return
+            payload = self.udpPayload(packet)
+            if payload is not None:
+                dataProcessor(payload, timestampNs)
+
+        ring.run(processPacket)
+
+    def udpPayload(self, packet):
+        """
+        Returns the UDP payload of an Ethernet framed IPv4 packet sent to the sniffed port or None
+        """
+        if len(packet) < ETH_HEADER_LEN + 20 or packet[ETH_HEADER_LEN + 9] != self.IP_UDP_PROTOCOL:
+            return None
+        udpOffset = ETH_HEADER_LEN + (packet[ETH_HEADER_LEN] & 0x0f) * 4
+        if len(packet) < udpOffset + UDP_HEADER_LEN:
+            return None
+        if (packet[udpOffset + 2] << 8 | packet[udpOffset + 3]) != self._port:
+            return None
+        udpLength = packet[udpOffset + 4] << 8 | packet[udpOffset + 5]
+        return packet[udpOffset + UDP_HEADER_LEN:udpOffset + udpLength]
+
+    @staticmethod
+    def udpPortFilter(port):
+        """
+        Classic BPF program accepting only unfragmented IPv4/UDP packets to the port received by this host
+        """
+        drop = 12
+        program = [
+            (UdpSniffer.BPF_LD_B_ABS, 0, 0, UdpSniffer.SKF_AD_PKTTYPE),         # 0: A = packet type
+            (UdpSniffer.BPF_JEQ_K, 0, drop - 2, UdpSniffer.PACKET_HOST),       # 1
+            (UdpSniffer.BPF_LD_H_ABS, 0, 0, 12),                               # 2: A = ether type
+            (UdpSniffer.BPF_JEQ_K, 0, drop - 4, UdpSniffer.APv4_PROTOCOL),     # 3
+            (UdpSniffer.BPF_LD_B_ABS, 0, 0, ETH_HEADER_LEN + 9),               # 4: A = IP protocol
+            (UdpSniffer.BPF_JEQ_K, 0, drop - 6, UdpSniffer.IP_UDP_PROTOCOL),   # 5
+            (UdpSniffer.BPF_LD_H_ABS, 0, 0, ETH_HEADER_LEN + 6),               # 6: A = IP flags and fragment offset
+            (UdpSniffer.BPF_JSET_K, drop - 8, 0, 0x1fff),                      # 7: drop fragments
+            (UdpSniffer.BPF_LDX_B_MSH, 0, 0, ETH_HEADER_LEN),                  # 8: X = IP header length
+            (UdpSniffer.BPF_LD_H_IND, 0, 0, ETH_HEADER_LEN + 2),               # 9: A = UDP destination port
+            (UdpSniffer.BPF_JEQ_K, 0, drop - 11, port),                        # 10
+            (UdpSniffer.BPF_RET_K, 0, 0, 0x40000),                             # 11: accept
+            (UdpSniffer.BPF_RET_K, 0, 0, 0),                                   # 12: drop
+        ]
+        return program
+
+    @staticmethod
+    def attachFilter(sock, program):
+        code = b"".join(struct.pack("HBBI", *instruction) for instruction in program)
+        codeBuffer = ctypes.create_string_buffer(code, len(code))
+        fprog = struct.pack("HP", len(program), ctypes.addressof(codeBuffer))
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
 
     @staticmethod
     def pktProtocol(addr):
@@ -48,10 +197,4 @@ class UdpSniffer:
     def pktInterfaceIndex(addr):
         return addr[2]
 
-    @staticmethod
-    def ipProtocol(raw_data):
-        ip_header = raw_data[14:34]
-        ip_header_data = struct.unpack('!BBHHHBBH4s4s', ip_header)
-        ip_protocol = ip_header_data[6]
-        return ip_protocol
 
@@ -0,0 +1,152 @@
+import collections
+import logging
+import socket
+import threading
+import time
+
+from mmsg import MMsgSender
+from realtime import ThreadTuning
+from udpsniffer import UNIX_SOCKET_BUFFER_SIZE
+
+
+def asBytes(frame):
+    """
+    The bytes of a frame in one copy through the buffer protocol. Only a vector without it, the SWIG
+    ByteVector of pjsua2, is converted element by element.
+    """
+    if isinstance(frame, bytes):
+        return frame
+    try:
+        return memoryview(frame).tobytes()
+    except TypeError:
+        return bytes(frame)
+
+
+class UpstreamSender:
+    """
+    Sends frames to the Streamer from a dedicated thread. The pjsip media callbacks only append
+    the frame to a bounded deque (append/popleft are atomic, one producer and one consumer), and
+    the thread converts and sends whatever is queued in batches on a connected socket.
+    With a voice activity detector the silent frames are skipped or thinned out on that thread too.
+    With a shared memory ring the frames are written to the ring instead of the socket, and the callbacks
+    never wake the thread: it polls the deque every pollMs, as the ring itself costs no syscall either.
+    The conversion of a pjsua2 ByteVector, element by element, stays on that thread in both cases.
+    A port given as a path is an AF_UNIX datagram socket of the Streamer.
+    """
+
+    def __init__(self, port, host="0.0.0.0", maxFrames=50, batchSize=8, latencyHistogram=None, vad=None, ring=None,
+                 threadTuning=None, pollMs=2):
+        self.port = port
+        self.threadTuning = threadTuning
+        self.ring = ring
+        self.pollSec = pollMs / 1000
+        self.sock = None
+        self.sender = None
+        self.connected = False
+        self.connectErrors = 0
+        if ring is None:
+            if isinstance(port, str):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UNIX_SOCKET_BUFFER_SIZE)
+                # A full Unix socket blocks the sender instead of dropping like UDP does
+                self.sock.setblocking(False)
+                self.address = port
+            else:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.address = (host, port)
+            self.connect()
+            self.sender = MMsgSender(self.sock, batchSize)
+        self.batchSize = batchSize
+        self.latencyHistogram = latencyHistogram
+        self.vad = vad
+        self._frames = collections.deque(maxlen=maxFrames)
+        self._wakeup = threading.Event()
+        self._sleeping = False
+        self.framesSent = 0
+        self.framesDropped = 0
+        self.sendErrors = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info(f"Upstream sender started. {f'Ring {ring.path}' if ring else f'Port {port}'}")
+
+    def send(self, frame):
+        """
+        Called from the media callbacks - never blocks. frame is a bytes object or a pj.ByteVector
+        copy owned by the caller.
+        """
+        if len(self._frames) == self._frames.maxlen:
+            self.framesDropped += 1
+        self._frames.append((frame, time.time_ns()))
+        if self._sleeping:
+            self._wakeup.set()
+
+    def run(self):
+        if self.threadTuning:
+            self.threadTuning.apply(f"upstream-{self.port}", ThreadTuning.UPSTREAM)
+        while True:
+            if not self._frames and self.ring:
+                time.sleep(self.pollSec)
+                continue
+            if not self._frames:
+                self._sleeping = True
+                self._wakeup.clear()
+                if not self._frames:
+                    self._wakeup.wait(1)
+                self._sleeping = False
+                continue
+            batch = []
+            queuedTimes = []
+            while self._frames and len(batch) < self.batchSize:
+                frame, queuedTimeNs = self._frames.popleft()
+                data = asBytes(frame)
+                if self.vad and not self.vad.keep(data):
+                    continue
+                batch.append(data)
+                queuedTimes.append(queuedTimeNs)
+            if batch:
+                self.sendBatch(batch)
+            if self.latencyHistogram:
+                now = time.time_ns()
+                for queuedTimeNs in queuedTimes:
+                    self.latencyHistogram.record((now - queuedTimeNs) // 1000)
+
+    def connect(self):
+        # The Unix socket path only exists while the Streamer runs, and is a new socket after its restart
+        try:
+            self.sock.connect(self.address)
+            self.connected = True
+        except OSError as e:
+            self.connected = False
+            self.connectErrors += 1
+            if self.connectErrors % 50 == 1:
+                logging.warning(f"Upstream cannot connect to {self.address} ({self.connectErrors} attempts): {e}")
+        return self.connected
+
+    def queuedFrames(self):
+        return len(self._frames)
+
+    def sendBatch(self, batch):
+        if self.ring:
+            for data in batch:
+                if self.ring.write(data):
+                    self.framesSent += 1
+                else:
+                    # The Streamer is not reading - the ring is full
+                    self.framesDropped += 1
+            return
+        if not self.connected and not self.connect():
+            self.framesDropped += len(batch)
+            return
+        try:
+            sent = self.sender.send(batch)
+            self.framesSent += sent
+            # The socket buffer filled up after part of the batch went out
+            self.framesDropped += len(batch) - sent
+        except OSError as e:
+            # ECONNREFUSED is reported on a connected socket while nobody listens on the port
+            self.sendErrors += 1
+            self.framesDropped += len(batch)
+            if isinstance(self.address, str) and not isinstance(e, BlockingIOError):
+                self.connected = False
+            if self.sendErrors % 50 == 1:
+                logging.error(f"Upstream send to port {self.port} failed ({self.sendErrors} errors): {e}")
@@ -0,0 +1,78 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class VoiceActivityDetector:
+    """
+    Energy based voice activity detector of 16 bit mono frames. A frame is speech when its mean power
+    is above the threshold, and the speech state is held for the hangover time after the last loud
+    frame, so word endings and short pauses are not cut. Silent frames can be thinned instead of
+    suppressed entirely: one of every keepEvery silent frames still passes, showing the stream is alive.
+    """
+    OFF = "off"
+    UPSTREAM = "up"
+    DOWNSTREAM = "down"
+    BOTH = "both"
+    MODES = [OFF, UPSTREAM, DOWNSTREAM, BOTH]
+
+    DEFAULT_THRESHOLD_DB = -45.0
+    DEFAULT_HANGOVER_MS = 300
+
+    def __init__(self, thresholdDb=DEFAULT_THRESHOLD_DB, hangoverMs=DEFAULT_HANGOVER_MS, frameTimeMs=40, keepEvery=0):
+        if np is None:
+            raise RuntimeError("The voice activity detection needs numpy")
+        self.thresholdDb = thresholdDb
+        # Compared with the mean square of the samples, so no square root per frame
+        self.thresholdPower = (32768 * 10 ** (thresholdDb / 20)) ** 2
+        self.hangoverFrames = max(0, round(hangoverMs / frameTimeMs))
+        self.keepEvery = keepEvery
+        self._hangover = 0
+        self._silentRun = 0
+
+        self.speechFrames = 0
+        self.silentFrames = 0
+        self.suppressedFrames = 0
+        self.bytesSaved = 0
+
+    @staticmethod
+    def applies(mode, direction):
+        return mode == VoiceActivityDetector.BOTH or mode == direction
+
+    def isSpeech(self, frame):
+        samples = np.frombuffer(frame, dtype="<i2", count=len(frame) // 2).astype(np.float32)
+        power = float(np.dot(samples, samples)) / len(samples) if len(samples) else 0.0
+        if power >= self.thresholdPower:
+            self._hangover = self.hangoverFrames
+            self.speechFrames += 1
+            return True
+        if self._hangover > 0:
+            self._hangover -= 1
+            self.speechFrames += 1
+            return True
+        self.silentFrames += 1
+        return False
+
+    def keep(self, frame):
+        """
+        Returns False for the silent frames that should not be sent
+        """
+        if self.isSpeech(frame):
+            self._silentRun = 0
+            return True
+        self._silentRun += 1
+        if self.keepEvery and (self._silentRun - 1) % self.keepEvery == 0:
+            return True
+        self.suppressedFrames += 1
+        self.bytesSaved += len(frame)
+        return False
+
+    def stats(self):
+        return {
+            "thresholdDb": self.thresholdDb,
+            "speechFrames": self.speechFrames,
+            "silentFrames": self.silentFrames,
+            "suppressedFrames": self.suppressedFrames,
+            "bytesSaved": self.bytesSaved,
+        }